@@ -0,0 +1,70 @@
+"""
+FILE: bench_codecs.py
+PURPOSE: Measure the throughput of streaming transfers with each compression codec.
+
+Files are streamed with utils.stream_tar into a local directory (a stand-in session runs the
+"remote" side with bash, so the network is left out and the codecs are what is timed). Two kinds
+of data are compared: compressible (CSV-like text) and incompressible (random bytes, like
+HDF5/PNG outputs). The codec chosen by the adaptive mode is shown for each.
+
+Usage: python benchmarks/bench_codecs.py --size-mb 200 --num-files 20
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from slurm_assist.utils import stream_tar, available_codecs, choose_codec
+
+class LocalSession:
+    """Runs the 'remote' commands on this machine."""
+    def popen(self, command, **kwargs):
+        return subprocess.Popen(['bash', '-c', command], **kwargs)
+
+    def which(self, *commands):
+        return {c for c in commands if shutil.which(c) is not None}
+
+def write_data(dir, kind, size_mb, num_files):
+    os.makedirs(dir)
+    rng = random.Random(0)
+    file_size = size_mb*2**20//num_files
+    for k in range(num_files):
+        with open(os.path.join(dir, f'{kind}_{k}.dat'), 'wb') as f:
+            if kind == 'random':
+                f.write(rng.getrandbits(8*file_size).to_bytes(file_size, 'little'))  # randbytes needs Python 3.9
+            else:
+                rows = (f'{i},{rng.random():.6f},{rng.randint(0, 100)},sample_{i % 97}\n' for i in range(file_size))
+                written = 0
+                for row in rows:
+                    written += f.write(row.encode())
+                    if written >= file_size:
+                        break
+
+if __name__=='__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=200, help="Size of each data set.")
+    parser.add_argument('--num-files', type=int, default=20)
+    args = parser.parse_args()
+
+    session = LocalSession()
+    codecs = available_codecs(session)
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        for kind in ('text', 'random'):
+            write_data(kind, kind, args.size_mb, args.num_files)
+            num_bytes = sum(os.path.getsize(os.path.join(kind, f)) for f in os.listdir(kind))
+            print()
+            print(f"{kind} data ({num_bytes/1e6:.0f} MB); adaptive mode picks '{choose_codec([kind], session)}'")
+            print(f"{'codec':<8}{'time (s)':>10}{'MB/s':>10}{'ratio':>8}")
+            for codec in codecs:
+                shutil.rmtree('remote', ignore_errors=True)
+                t1 = time.perf_counter()
+                sent = stream_tar(session, [kind], 'remote', codec=codec)
+                t2 = time.perf_counter()
+                print(f"{codec:<8}{t2 - t1:>10.2f}{num_bytes/1e6/(t2 - t1):>10.1f}{sent/num_bytes:>8.3f}")
@@ -0,0 +1,74 @@
+"""
+FILE: bench_local_pipeline.py
+PURPOSE: Time the split/run/merge stages of an EmbarrassinglyParallelJobs pipeline end to end,
+using the local Slurm backend (no cluster needed).
+
+Usage: python benchmarks/bench_local_pipeline.py --num-rows 100000 --array 1-8 --ntasks 2 --max-slots 8
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from slurm_assist import EmbarrassinglyParallelJobs, use_local_backend
+
+single_run_module_content = \
+"""def single_run(id, data, results_dir):
+    return [id, sum(data)]
+"""
+
+def stage_time(backend, job_id):
+    tasks = backend.jobs[job_id].tasks
+    return max(task.end_time for task in tasks) - min(task.start_time for task in tasks)
+
+if __name__=='__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-rows', type=int, default=100000)
+    parser.add_argument('--array', type=str, default='1-8')
+    parser.add_argument('--ntasks', type=int, default=None)
+    parser.add_argument('--max-slots', type=int, default=None)
+    parser.add_argument('--extra-config', type=str, nargs='*', default=[], help="Extra config fields as key=value.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        with open('data.csv', 'w') as f:
+            f.write('a,b\n')
+            for k in range(args.num_rows):
+                f.write(f'{k},{k % 7}\n')
+        with open('single_run.py', 'w') as f:
+            f.write(single_run_module_content)
+        open('container.sif', 'w').close()
+
+        config = dict(
+            input_data_file='data.csv',
+            single_run_module_parent_dir=work_dir,
+            single_run_module='single_run',
+            single_run_function='single_run',
+            container_image='container.sif',
+            mpi='pmi2',
+            generate_new_ids=True,
+            main_slurm_args={'array': args.array, 'ntasks': args.ntasks, 'time': '01:00:00'},
+            results_dir='results',
+            tmp_dir='tmp'
+        )
+        for field in args.extra_config:
+            key, value = field.split('=', 1)
+            config[key] = int(value) if value.isdigit() else value
+
+        with use_local_backend(max_slots=args.max_slots) as backend:
+            t1 = time.perf_counter()
+            job = EmbarrassinglyParallelJobs(config)
+            job_ids = job.submit(verbose=False)
+            states = backend.wait()
+            t2 = time.perf_counter()
+            if any(state != 'COMPLETED' for state in states.values()):
+                raise RuntimeError(f'Some jobs did not complete: {states}')
+            print()
+            print(f'split  {stage_time(backend, job_ids.split):8.3f} s')
+            print(f'run    {stage_time(backend, job_ids.main):8.3f} s')
+            print(f'merge  {sum(stage_time(backend, job_id) for job_id in job.merge_job_ids):8.3f} s (summed over merge jobs)')
+            print(f'total  {t2 - t1:8.3f} s  ({args.num_rows/(t2 - t1):.1f} rows/s)')
@@ -0,0 +1,70 @@
+"""
+FILE: bench_submission.py
+PURPOSE: Measure sbatch submissions per second against a stub sbatch.
+
+The stub sbatch sleeps for --latency seconds (to mimic the scheduler's response time) and
+prints a fake job ID. Three ways of submitting are compared:
+  - shell:      the old approach (render a new Jinja template and run it with shell=True)
+  - argv:       submission.run_sbatch, one job at a time
+  - concurrent: submission.SubmissionEngine with --workers concurrent sbatch calls
+
+Usage: python benchmarks/bench_submission.py --num-jobs 200 --latency 0.05 --workers 8
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from slurm_assist.submission import sbatch_argv, run_sbatch, SubmissionEngine
+
+stub_sbatch_content = \
+"""#!/bin/bash
+sleep {latency}
+if [[ " $* " == *" --parsable "* ]]; then echo $$; else echo "Submitted batch job $$"; fi
+"""
+
+def submit_shell(slurm_args, job_script_filename):
+    from jinja2 import Template
+    template = Template(
+"""sbatch \
+{% for key, value in slurm_args.items() if value is not none %}\
+{% if value is boolean and value %}--{{ key }} \
+{% elif value is not boolean %}--{{ key }}={{ value }} \
+{% endif %}{% endfor %} \
+{{ job_script_filename }}
+""")
+    sbatch_command = template.render(slurm_args=slurm_args, job_script_filename=job_script_filename)
+    output = subprocess.run(sbatch_command, capture_output=True, text=True, shell=True, env=os.environ.copy())
+    return int(output.stdout.split()[-1])
+
+def bench(name, fn, num_jobs):
+    t1 = time.perf_counter()
+    job_ids = fn()
+    elapsed = time.perf_counter() - t1
+    assert len(job_ids) == num_jobs
+    print(f'{name:<12} {num_jobs} jobs in {elapsed:8.3f} s  ({num_jobs/elapsed:8.1f} submissions/s)')
+
+if __name__=='__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-jobs', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the stub sbatch takes per call.")
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as bin_dir:
+        stub_sbatch = os.path.join(bin_dir, 'sbatch')
+        with open(stub_sbatch, 'w') as f:
+            f.write(stub_sbatch_content.format(latency=args.latency))
+        os.chmod(stub_sbatch, 0o755)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+
+        slurm_args = {'job-name': 'bench', 'time': '00:10:00', 'mem': '1G', 'ntasks': 1, 'exclusive': True}
+        job_script_filename = 'submit_bench.sh'
+        bench('shell', lambda: [submit_shell(slurm_args, job_script_filename) for _ in range(args.num_jobs)], args.num_jobs)
+        bench('argv', lambda: [run_sbatch(sbatch_argv(slurm_args, job_script_filename), verbose=False) for _ in range(args.num_jobs)], args.num_jobs)
+        with SubmissionEngine(max_workers=args.workers) as engine:
+            bench('concurrent', lambda: engine.submit_many([dict(slurm_args=slurm_args, job_script_filename=job_script_filename)]*args.num_jobs), args.num_jobs)
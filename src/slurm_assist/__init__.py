@@ -1,4 +1,7 @@
 from .single.top_level_interface import SingleJob
 from .embarrassingly_parallel.top_level_interface import EmbarrassinglyParallelJobs
 from .serial.top_level_interface import SerialJobsWithState, SerialJobs
+from .packed.top_level_interface import PackedJobs
+from .graph.top_level_interface import JobGraph
+from .local_backend import LocalBackend, use_local_backend
 # from .move.top_level_interface import MoveFilesParallelJobs
\ No newline at end of file
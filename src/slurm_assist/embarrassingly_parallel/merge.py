@@ -16,45 +16,157 @@ def main(
     merged_results_file: str,
     tmp_dir: str,
     job_array: int,
-    ntasks_per_job: int = None
+    ntasks_per_job: int = None,
+    merge_mode: str = 'memory',
+    num_workers: int = 4,
+    prefetch: int = 16,
+    batch_format: str = 'pickle',
+    merged_format: str = 'csv',
+    level: int = 0,
+    num_inputs: Optional[int] = None,
+    file_range: Optional[str] = None,
+    partial_results_dir: Optional[str] = None,
+    partial_results_file: Optional[str] = None
 ):
-    """Collect/merge the results."""
+    """Collect/merge the results.
+
+    With merge_mode='memory', all results are loaded into memory before being written. With 
+    merge_mode='stream', batch files are loaded by `num_workers` threads (at most `prefetch` 
+    files ahead of the writer) and written as soon as all earlier files have been written. 
+    Both modes write the same merged results file (see utils.open_table_writer).
+
+    Results are written batch file by batch file, so they are in input order only if each batch
+    has consecutive rows of the input (not so if the split balanced the batches by cost, see
+    split.py).
+
+    Results batch files are loaded in `batch_format` and the merged results are saved in 
+    `merged_format` ('csv', or one of the columnar formats 'parquet', 'arrow' or 'npy').
+
+    For hierarchical (tree) merges, level=0 merges the results batch files, and level=l>0 merges 
+    the `num_inputs` partial results files `partial_{l}_{k}` in `partial_results_dir`. If 
+    `file_range` ('start:end') is given, only that range of the input files is merged. If 
+    `partial_results_file` is given, the inputs are combined into that file (in `batch_format`)
+    instead of the merged results file, and the tmp files are kept.
+    """
     job_array_ = parse_slurm_array(job_array)
 
-    # Collect results for each batch of computation and append to a single list.
+    # Results files for each batch of computation, in order
     num_jobs = len(job_array_)
-    results = []
+    ext = batch_file_extension(batch_format)
     if ntasks_per_job is None:
-        for i in range(num_jobs):
-            results_batch_file = os.path.join(batched_results_dir, f'results_{job_array_[i]}.pkl')
+        results_batch_files = [
+            os.path.join(batched_results_dir, f'results_{job_array_[i]}{ext}')
+            for i in range(num_jobs)
+        ]
+    else:
+        results_batch_files = [
+            os.path.join(batched_results_dir, f'results_{job_array_[k // ntasks_per_job]}_{k % ntasks_per_job}{ext}')
+            for k in range(num_jobs*ntasks_per_job)
+        ]
+    if level > 0:
+        results_batch_files = [
+            os.path.join(partial_results_dir, f'partial_{level}_{k}{ext}')
+            for k in range(num_inputs)
+        ]
+    if file_range is not None:
+        start, end = map(int, file_range.split(':'))
+        results_batch_files = results_batch_files[start:end]
+
+    if partial_results_file is not None:
+        _merge_partial(results_batch_files, partial_results_file, batch_format)
+        return
+
+    if merge_mode == 'memory':
+        # Collect results for each batch of computation and append to a single list.
+        results = []
+        for results_batch_file in results_batch_files:
             try:
-                res_i = load_pickle(results_batch_file)
+                res_i = load_batch(results_batch_file, batch_format)
                 for res_il in res_i:
                     results.append(res_il)
                 print(f'Loaded {results_batch_file}')
                 
             except:
                 print(f'Failed to load {results_batch_file}')
-    else:
-        for k in range(num_jobs*ntasks_per_job):
-            i = k // ntasks_per_job
-            j = k % ntasks_per_job
-            results_batch_file = os.path.join(batched_results_dir, f'results_{job_array_[i]}_{j}.pkl')
-            try:
-                res_ij = load_pickle(results_batch_file)
-                for res_ijl in res_ij:
-                    results.append(res_ijl)
-                print(f'Loaded {results_batch_file}')
-                
-            except:
-                print(f'Failed to load {results_batch_file}')
     
-    # Save results to a single file
-    # save_csv(results, merged_results_file)
-    pd.DataFrame(results).to_csv(merged_results_file, index=False, header=False)
+        # Save results to a single file
+        # save_csv(results, merged_results_file)
+        writer = open_table_writer(merged_results_file, merged_format)
+        writer.write(results)
+        writer.close()
+    elif merge_mode == 'stream':
+        _merge_streaming(results_batch_files, merged_results_file, num_workers, prefetch, batch_format, merged_format)
+    else:
+        raise ValueError(f"Invalid merge_mode '{merge_mode}'. Must be one of 'memory' or 'stream'.")
 
     # Delete tmp files
     subprocess.run(['rm', '-rf', tmp_dir])
+
+def _merge_partial(results_batch_files: list[str], partial_results_file: str, batch_format: str):
+    """Combine results files into one partial results file, one input file at a time."""
+    if batch_format == 'pickle':
+        save_pickle([], partial_results_file)
+        write = lambda rows: append_pickle(rows, partial_results_file)
+    else:
+        writer = open_table_writer(partial_results_file, batch_format)
+        write = writer.write
+    for results_batch_file in results_batch_files:
+        try:
+            write(load_batch(results_batch_file, batch_format))
+            print(f'Loaded {results_batch_file}')
+        except:
+            print(f'Failed to load {results_batch_file}')
+    if batch_format != 'pickle':
+        writer.close()
+    print(f'Saved partial results to {partial_results_file}')
+
+def _try_load_batch(file_path, fmt):
+    try:
+        return load_batch(file_path, fmt)
+    except:
+        return None
+
+def _merge_streaming(
+    results_batch_files: list[str], 
+    merged_results_file: str, 
+    num_workers: int, 
+    prefetch: int,
+    batch_format: str = 'pickle',
+    merged_format: str = 'csv'
+):
+    """Write the results of each batch file to the merged file as soon as they are loaded."""
+    import time
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    t_start = time.time()
+    num_rows, num_files = 0, 0
+    writer = open_table_writer(merged_results_file, merged_format)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        remaining = iter(results_batch_files)
+        pending = deque()  # (file path, future), in the order the files are written
+        for results_batch_file in remaining:
+            pending.append((results_batch_file, pool.submit(_try_load_batch, results_batch_file, batch_format)))
+            if len(pending) >= prefetch:
+                break
+        while len(pending) > 0:
+            results_batch_file, future = pending.popleft()
+            next_file = next(remaining, None)
+            if next_file is not None:
+                pending.append((next_file, pool.submit(_try_load_batch, next_file, batch_format)))
+            results = future.result()
+            if results is None:
+                print(f'Failed to load {results_batch_file}')
+                continue
+            writer.write(results)
+            num_rows += len(results)
+            num_files += 1
+            del results
+            print(f'Loaded {results_batch_file}')
+    writer.close()
+    elapsed = max(time.time() - t_start, 1e-9)
+    print(f'Merged {num_rows} results from {num_files} files in {elapsed:.2f} s '
+          f'({num_rows / elapsed:.1f} results/s, {num_files / elapsed:.1f} files/s)')
         
 
 if __name__=='__main__':
@@ -69,13 +181,23 @@ if __name__=='__main__':
     parser.add_argument('--tmp-dir', '--tmp_dir', type=str)
     parser.add_argument('--job-array', '--job_array', type=str)
     parser.add_argument('--ntasks-per-job', '--ntasks_per_job', type=int)
+    parser.add_argument('--merge-mode', '--merge_mode', type=str, default='memory')
+    parser.add_argument('--num-workers', '--num_workers', type=int, default=4)
+    parser.add_argument('--prefetch', type=int, default=16)
+    parser.add_argument('--batch-format', '--batch_format', type=str, default='pickle')
+    parser.add_argument('--merged-format', '--merged_format', type=str, default='csv')
+    parser.add_argument('--level', type=int, default=0)
+    parser.add_argument('--num-inputs', '--num_inputs', type=int)
+    parser.add_argument('--file-range', '--file_range', type=str)
+    parser.add_argument('--partial-results-dir', '--partial_results_dir', type=str)
+    parser.add_argument('--partial-results-file', '--partial_results_file', type=str)
     args = parser.parse_args()
 
     print('\nMerging results...')
     t1 = time.time()
     sys.path.append(args.utils_parent_dir)
     try:
-        from utils import load_pickle, save_csv, parse_slurm_array
+        from utils import load_pickle, save_pickle, append_pickle, load_batch, batch_file_extension, open_table_writer, save_csv, parse_slurm_array
     except:
         raise Exception('Could not import utils module. Make sure the --parent-dir argument is pointing to the package\'s many_small_jobs_directory.')
     main(
@@ -83,7 +205,17 @@ if __name__=='__main__':
         merged_results_file=args.merged_results_file,
         tmp_dir=args.tmp_dir,
         job_array=args.job_array,
-        ntasks_per_job=args.ntasks_per_job
+        ntasks_per_job=args.ntasks_per_job,
+        merge_mode=args.merge_mode,
+        num_workers=args.num_workers,
+        prefetch=args.prefetch,
+        batch_format=args.batch_format,
+        merged_format=args.merged_format,
+        level=args.level,
+        num_inputs=args.num_inputs,
+        file_range=args.file_range,
+        partial_results_dir=args.partial_results_dir,
+        partial_results_file=args.partial_results_file
     )
     t2 = time.time()
     print('...done.')
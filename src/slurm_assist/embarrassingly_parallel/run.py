@@ -8,61 +8,231 @@ from typing import Callable, Optional
 
 def main(
     array_id: int, 
-    single_run_fn: Callable[[int, list[str], str], list[str]],
+    single_run_fn: Optional[Callable[[int, list[str], str], list[str]]],
     batched_data_dir: str,
     batched_results_dir: str,
     split_results_dir: str,
     job_array: str,
     ntasks_per_job: int | None,
+    split_mode: str = 'memory',
+    input_data_file: Optional[str] = None,
+    generate_new_ids: bool = True,
+    schedule: str = 'static',
+    schedule_chunksize: int = 1,
+    executor: str = 'serial',
+    executor_chunksize: int = 1,
+    checkpoint_every: Optional[int] = None,
+    batch_format: str = 'pickle',
+    batch_run_fn: Optional[Callable[[list[int], list, str], list]] = None,
+    batch_run_stack: bool = False,
+    array_offset: int = 0,
     **kwargs
 ):
     """Main entry point.
 
-    Note that array_id is the job array task ID, not the SLURM job ID.
+    Note that array_id is the job array task ID, not the SLURM job ID. If the job array was 
+    submitted in chunks, `array_offset` is the position of the chunk's first task in the full
+    job array (task array_id of the chunk runs element array_offset + array_id).
+
+    If split_mode='index', the batch is read straight from `input_data_file` using the byte 
+    ranges in `data_index.pkl`. Otherwise it is loaded from its own file in `batched_data_dir`.
+
+    With MPI, schedule='static' runs each rank on its own batch only. With schedule='dynamic', 
+    all batches of the job array task are pooled and handed out to ranks `schedule_chunksize` 
+    items at a time as they free up. Either way, each rank saves the results for its own batch.
+
+    With executor='process', the items are run in a pool of worker processes (one per cpu in 
+    SLURM_CPUS_PER_TASK, or else per cpu the task may run on), `executor_chunksize` items per dispatch to a worker.
+
+    If checkpoint_every is given, each result is appended to a journal file as soon as it is
+    finished (fsynced every `checkpoint_every` items). When the task is restarted, the items 
+    already in the journal are not run again. `batch_run_fn` is then called on at most 
+    `checkpoint_every` items at a time, so its results are journaled as each call returns.
+
+    Data and results batch files are loaded/saved in `batch_format` (see utils.save_batch).
+
+    If `batch_run_fn` is given, it is used instead of `single_run_fn` and called as 
+    `batch_run_fn(ids, data_batch, results_dir, **kwargs)` on many items at once, returning the 
+    list of their results. It gets all the items still to run in the batch, or, with 
+    schedule='dynamic' or executor='process', one chunk of items at a time. If batch_run_stack 
+    is True, `data_batch` is a stacked NumPy array (one row per item) instead of a list.
     """
-    print('ntasks_per_job: ', ntasks_per_job)
-    print(type(ntasks_per_job))
+    if (single_run_fn is None) and (batch_run_fn is None):
+        raise ValueError("Either single_run_fn or batch_run_fn must be given.")
+    if batch_run_fn is not None:
+        kwargs.update(batch_run_fn=batch_run_fn, batch_run_stack=batch_run_stack, batch_run_chunksize=checkpoint_every)
     if ntasks_per_job is not None:
         from mpi4py import MPI
         batch_id = MPI.COMM_WORLD.rank
     job_array_ = parse_slurm_array(job_array)
-    array_id_ = to_zero_based_indexing(array_id)
+    array_id_ = to_zero_based_indexing(array_offset + array_id)
 
     # Load data batch
-    print(job_array_[array_id_])
     if ntasks_per_job is None:
-        print('Here?')
-        data_batch_filepath = os.path.join(batched_data_dir, f'data_{job_array_[array_id_]}.pkl')
+        batch_name = f'{job_array_[array_id_]}'
     else:
-        print('Or here?')
-        data_batch_filepath = os.path.join(batched_data_dir, f'data_{job_array_[array_id_]}_{batch_id}.pkl')
-    ids_and_data_batch = load_pickle(data_batch_filepath)
-    if len(ids_and_data_batch) == 0:
-        result = []
-        ids = []
-    else:
-        ids, data_batch = list(zip(*ids_and_data_batch))  # unzip
+        batch_name = f'{job_array_[array_id_]}_{batch_id}'
+    load_data_batch = lambda name: _load_data_batch(batched_data_dir, name, split_mode, input_data_file, generate_new_ids, batch_format)
+    ids_and_data_batch = load_data_batch(batch_name)
+    ids = [id for id, _ in ids_and_data_batch]
+    dynamic = (ntasks_per_job is not None) and (schedule == 'dynamic')
+
+    # Collect the results saved to the journal by previous (interrupted) runs of this task
+    journal, done = None, {}
+    if checkpoint_every is not None:
+        journal_filepath = lambda name: os.path.join(batched_results_dir, f'journal_{name}.pkl')
+        journal = ResultJournal(journal_filepath(batch_name), fsync_every=checkpoint_every)
+        done.update(journal.records)
+        if dynamic:
+            # Items of this rank's batch may have been run by any other rank
+            MPI.COMM_WORLD.Barrier()
+            for rank in range(MPI.COMM_WORLD.size):
+                if rank != batch_id:
+                    done.update(load_journal(journal_filepath(f'{job_array_[array_id_]}_{rank}'))[0])
+        print(f'Found {len(done)} finished items in the journal')
+    on_result = journal.append if journal is not None else None
 
-        # Run the batch through processing
-        result = _run_batch(single_run_fn, ids, data_batch, split_results_dir, **kwargs)
+    pool = _make_pool(executor)
+    if dynamic:
+        result = _run_dynamic(
+            MPI.COMM_WORLD,
+            ids_and_data_batch,
+            lambda rank: load_data_batch(f'{job_array_[array_id_]}_{rank}'),
+            single_run_fn,
+            split_results_dir,
+            schedule_chunksize,
+            done=done,
+            pool=pool,
+            pool_chunksize=executor_chunksize,
+            on_result=on_result,
+            **kwargs
+        )
+    else:
+        result = [done.get(id) for id in ids]
+        todo = [k for k, id in enumerate(ids) if id not in done]
+        if len(todo) > 0:
+            # Run the batch through processing
+            result_todo = _run_batch(
+                single_run_fn, 
+                [ids[k] for k in todo], 
+                [ids_and_data_batch[k][1] for k in todo], 
+                split_results_dir, 
+                pool=pool, 
+                pool_chunksize=executor_chunksize, 
+                on_result=on_result,
+                **kwargs
+            )
+            for k, res in zip(todo, result_todo):
+                result[k] = res
+    if pool is not None:
+        pool.shutdown()
+    if journal is not None:
+        journal.close()
     
     # Save results
-    if ntasks_per_job is None:
-        results_batch_filepath = os.path.join(batched_results_dir, f'results_{job_array_[array_id_]}.pkl')
+    results_batch_filepath = os.path.join(batched_results_dir, f'results_{batch_name}{batch_file_extension(batch_format)}')
+    save_batch(list(zip(ids, result)), results_batch_filepath, batch_format)
+
+def _load_data_batch(
+    batched_data_dir: str,
+    batch_name: str,
+    split_mode: str,
+    input_data_file: Optional[str],
+    generate_new_ids: bool,
+    batch_format: str = 'pickle'
+) -> list[tuple[int, list]]:
+    """Load the (id, data) pairs of one batch."""
+    if split_mode == 'index':
+        index = load_pickle(os.path.join(batched_data_dir, 'data_index.pkl'))
+        return _read_indexed_batch(input_data_file, *index['batches'][batch_name], generate_new_ids, index['dtypes'])
+    else:
+        data_batch_filepath = os.path.join(batched_data_dir, f'data_{batch_name}{batch_file_extension(batch_format)}')
+        return load_batch(data_batch_filepath, batch_format)
+
+def _read_indexed_batch(
+    input_data_file: str,
+    start: int,
+    end: int,
+    first_row: int,
+    generate_new_ids: bool,
+    dtypes: Optional[dict] = None
+) -> list[tuple[int, list]]:
+    """Read the rows stored between bytes `start` and `end` of the input file, with the column
+    types of the whole file (`dtypes`, by column position) rather than those of the batch."""
+    import io
+    import pandas as pd
+    with open(input_data_file, 'rb') as f:
+        f.seek(start)
+        buffer = f.read(end - start)
+    if len(buffer.strip()) == 0:
+        return []
+    data = pd.read_csv(io.BytesIO(buffer), header=None, dtype=dtypes).values.tolist()
+    return assign_ids(data, first_row, generate_new_ids, input_data_file)
+
+def _make_pool(executor: str):
+    """Create the process pool for running items in parallel (None for running them serially)."""
+    if executor == 'serial':
+        return None
+    elif executor == 'process':
+        from concurrent.futures import ProcessPoolExecutor
+        if 'SLURM_CPUS_PER_TASK' in os.environ:
+            max_workers = int(os.environ['SLURM_CPUS_PER_TASK'])
+        elif hasattr(os, 'sched_getaffinity'):
+            max_workers = len(os.sched_getaffinity(0))  # the cpus this task may run on
+        else:
+            max_workers = os.cpu_count()
+        print(f'Running items in a pool of {max_workers} processes')
+        return ProcessPoolExecutor(max_workers=max_workers)
+    else:
+        raise ValueError(f"Invalid executor '{executor}'. Must be one of 'serial' or 'process'.")
+
+def _call_single_run_fn(single_run_fn, split_results_dir, kwargs, id, data):
+    return single_run_fn(id, data, split_results_dir, **kwargs)
+
+def _call_batch_run_fn(batch_run_fn, split_results_dir, stack, kwargs, ids, data_batch):
+    if stack:
+        import numpy as np
+        data_batch = np.asarray(data_batch)
+    results = batch_run_fn(list(ids), data_batch, split_results_dir, **kwargs)
+    if len(results) != len(ids):
+        raise ValueError(f"batch_run_fn returned {len(results)} results for {len(ids)} items.")
+    return results
+
+def _iter_batch_run_fn(batch_run_fn, split_results_dir, stack, kwargs, run_ids, data_batch, pool=None, pool_chunksize=1, chunksize=None):
+    """Run `batch_run_fn` on chunks of `chunksize` items (default: the whole batch), or of 
+    `pool_chunksize` items in the pool. The results of each chunk are yielded once it is done."""
+    from functools import partial
+    fn = partial(_call_batch_run_fn, batch_run_fn, split_results_dir, stack, kwargs)
+    if pool is None:
+        chunksize = chunksize or max(1, len(run_ids))
+        for i in range(0, len(run_ids), chunksize):
+            yield from fn(run_ids[i:i + chunksize], data_batch[i:i + chunksize])
     else:
-        results_batch_filepath = os.path.join(batched_results_dir, f'results_{job_array_[array_id_]}_{batch_id}.pkl')
-    save_pickle(list(zip(ids, result)), results_batch_filepath)
+        bounds = range(0, len(run_ids), pool_chunksize)
+        for results in pool.map(fn, [run_ids[i:i + pool_chunksize] for i in bounds], [data_batch[i:i + pool_chunksize] for i in bounds]):
+            yield from results
 
 def _run_batch(
     single_run_fn: Callable[[int, list[str], str], list[str]],
     run_ids: int,
     data_batch: list,
     split_results_dir: str,
+    pool=None,
+    pool_chunksize: int = 1,
+    on_result: Optional[Callable[[int, object], None]] = None,
+    batch_run_fn: Optional[Callable[[list[int], list, str], list]] = None,
+    batch_run_stack: bool = False,
+    batch_run_chunksize: Optional[int] = None,
     **kwargs
 ):
     """Run a batch of data through user-defined processing.
 
     Returns a list of same length as `data_batch` containing the result for each batch.
+    If a process pool is given, the items are run in the pool (results are still in order).
+    If `on_result` is given, it is called with the id and result of each item as it finishes.
+    If `batch_run_fn` is given, it is called on all items at once (or on chunks of 
+    `batch_run_chunksize` items, or of `pool_chunksize` items in the pool) instead of calling 
+    `single_run_fn` on each item.
     
     Parameters
     ----------
@@ -78,11 +248,103 @@ def _run_batch(
     results: list
         List of results
     """
+    if batch_run_fn is not None:
+        results_iter = _iter_batch_run_fn(batch_run_fn, split_results_dir, batch_run_stack, kwargs, list(run_ids), list(data_batch), pool, pool_chunksize, batch_run_chunksize)
+    elif pool is not None:
+        from functools import partial
+        fn = partial(_call_single_run_fn, single_run_fn, split_results_dir, kwargs)
+        results_iter = pool.map(fn, run_ids, data_batch, chunksize=pool_chunksize)
+    else:
+        results_iter = (single_run_fn(id, data, split_results_dir, **kwargs) for id, data in zip(run_ids, data_batch))
     results = []
-    for id, data in zip(run_ids, data_batch):
-        results.append(single_run_fn(id, data, split_results_dir, **kwargs))
+    for id, result in zip(run_ids, results_iter):
+        if on_result is not None:
+            on_result(id, result)
+        results.append(result)
     return results
 
+def _run_dynamic(
+    comm,
+    ids_and_data_batch: list[tuple[int, list]],
+    load_rank_batch: Callable[[int], list[tuple[int, list]]],
+    single_run_fn: Callable[[int, list[str], str], list[str]],
+    split_results_dir: str,
+    chunksize: int,
+    done: Optional[dict] = None,
+    **kwargs
+) -> list:
+    """Run the batches of all ranks, handing out chunks of items to ranks as they free up.
+
+    Items are numbered consecutively across the batches of ranks 0, 1, ..., and a counter 
+    hosted on rank 0 (an MPI window updated with atomic fetch-and-add) holds the number of 
+    the next unclaimed item. Each rank claims `chunksize` items at a time until there are none
+    left. The results are then sent back to the rank that owns each item, so the returned list 
+    is the same as running this rank's own batch. Items whose id is in `done` are skipped and
+    their results are taken from `done` instead.
+    """
+    from array import array
+    from bisect import bisect_right
+    from mpi4py import MPI
+    if done is None:
+        done = {}
+
+    # Number the items of all batches consecutively
+    lengths = comm.allgather(len(ids_and_data_batch))
+    offsets = [0]
+    for length in lengths:
+        offsets.append(offsets[-1] + length)
+    num_items = offsets[-1]
+
+    # Shared counter of claimed items
+    itemsize = MPI.INT64_T.Get_size()
+    win = MPI.Win.Allocate(itemsize if comm.rank == 0 else 0, itemsize, comm=comm)
+    if comm.rank == 0:
+        win.Lock(0)
+        win.Put([array('q', [0]), MPI.INT64_T], 0)
+        win.Unlock(0)
+    comm.Barrier()
+
+    def claim_chunk():
+        increment, start = array('q', [chunksize]), array('q', [0])
+        win.Lock(0, MPI.LOCK_SHARED)
+        win.Fetch_and_op([increment, MPI.INT64_T], [start, MPI.INT64_T], 0, 0, MPI.SUM)
+        win.Unlock(0)
+        return start[0]
+
+    # Only keep the most recently used batch of another rank in memory
+    cached_batch = {comm.rank: ids_and_data_batch}
+    def get_item(k):
+        rank = bisect_right(offsets, k) - 1
+        if rank not in cached_batch:
+            cached_batch.clear()
+            cached_batch[comm.rank] = ids_and_data_batch
+            cached_batch[rank] = load_rank_batch(rank)
+        return rank, k - offsets[rank], cached_batch[rank][k - offsets[rank]]
+
+    # Run chunks until the pool is empty
+    outgoing = [[] for _ in range(comm.size)]  # [(position in owner's batch, result), ...] for each rank
+    start = claim_chunk()
+    while start < num_items:
+        items = [get_item(k) for k in range(start, min(start + chunksize, num_items))]
+        items = [item for item in items if item[2][0] not in done]
+        if len(items) == 0:
+            start = claim_chunk()
+            continue
+        ids, data_batch = list(zip(*[id_and_data for _, _, id_and_data in items]))
+        results = _run_batch(single_run_fn, ids, data_batch, split_results_dir, **kwargs)
+        for (rank, position, _), result in zip(items, results):
+            outgoing[rank].append((position, result))
+        start = claim_chunk()
+    comm.Barrier()
+    win.Free()
+
+    # Collect the results for this rank's own batch
+    result = [done.get(id) for id, _ in ids_and_data_batch]
+    for incoming in comm.alltoall(outgoing):
+        for position, res in incoming:
+            result[position] = res
+    return result
+
 
 if __name__=='__main__':
     import argparse
@@ -96,23 +358,36 @@ if __name__=='__main__':
     parser.add_argument('--single-run-module-parent-dir', type=str)
     parser.add_argument('--single-run-module', type=str)
     parser.add_argument('--single-run-fn', type=str)
+    parser.add_argument('--batch-run-fn', type=str)
+    parser.add_argument('--batch-run-stack', type=str, default='False')
+    parser.add_argument('--array-offset', type=int, default=0)
     parser.add_argument('--batched-data-dir', type=str)
     parser.add_argument('--batched-results-dir', type=str)
     parser.add_argument('--split-results-dir', type=str)
     parser.add_argument('--job-array', type=str)
     parser.add_argument('--ntasks-per-job', type=str)
+    parser.add_argument('--split-mode', type=str, default='memory')
+    parser.add_argument('--input-data-file', type=str)
+    parser.add_argument('--generate-new-ids', type=str, default='True')
+    parser.add_argument('--schedule', type=str, default='static')
+    parser.add_argument('--schedule-chunksize', type=int, default=1)
+    parser.add_argument('--executor', type=str, default='serial')
+    parser.add_argument('--executor-chunksize', type=int, default=1)
+    parser.add_argument('--checkpoint-every', type=int)
+    parser.add_argument('--batch-format', type=str, default='pickle')
     args, unknown_args = parser.parse_known_args()
 
     t1 = time.time()
     sys.path.append(args.utils_parent_dir)
     try:
-        from utils import load_pickle, save_pickle, parse_slurm_array, to_zero_based_indexing, parse_cli_args
+        from utils import load_pickle, load_batch, save_batch, batch_file_extension, parse_slurm_array, to_zero_based_indexing, parse_cli_args, assign_ids, ResultJournal, load_journal
     except:
         raise Exception('Could not import utils module. Make sure the --parent-dir argument is pointing to the package\'s embarrassingly_parallel directory.')
     unknown_args_dict = parse_cli_args(unknown_args)
     sys.path.append(args.single_run_module_parent_dir)
-    single_run_fn = getattr(importlib.import_module(args.single_run_module), args.single_run_fn)
-    print('args.ntasks_per_job: ', args.ntasks_per_job)
+    single_run_module = importlib.import_module(args.single_run_module)
+    single_run_fn = getattr(single_run_module, args.single_run_fn) if args.single_run_fn is not None else None
+    batch_run_fn = getattr(single_run_module, args.batch_run_fn) if args.batch_run_fn is not None else None
     main(
         array_id=args.array_id, 
         single_run_fn=single_run_fn,
@@ -121,6 +396,18 @@ if __name__=='__main__':
         split_results_dir=args.split_results_dir,
         job_array=args.job_array,
         ntasks_per_job=int(args.ntasks_per_job) if str(args.ntasks_per_job).lower() != 'none' else None,
+        split_mode=args.split_mode,
+        input_data_file=args.input_data_file,
+        generate_new_ids=args.generate_new_ids.lower() == 'true',
+        schedule=args.schedule,
+        schedule_chunksize=args.schedule_chunksize,
+        executor=args.executor,
+        executor_chunksize=args.executor_chunksize,
+        checkpoint_every=args.checkpoint_every,
+        batch_format=args.batch_format,
+        batch_run_fn=batch_run_fn,
+        batch_run_stack=args.batch_run_stack.lower() == 'true',
+        array_offset=args.array_offset,
         **unknown_args_dict
     )
     t2 = time.time()
@@ -19,6 +19,8 @@ DESCRIPTION:
 """
 
 import os
+from array import array
+from typing import Callable, Optional
 import pandas as pd
 
 def main(
@@ -26,60 +28,238 @@ def main(
     batched_data_dir: str,
     job_array: list[int],
     ntasks_per_job: int | None,
-    generate_new_ids: bool
+    generate_new_ids: bool,
+    split_mode: str = 'memory',
+    chunksize: int | None = None,
+    batch_format: str = 'pickle',
+    cost_column: Optional[str] = None,
+    cost_fn: Optional[Callable[[int, list], float]] = None
 ):
-    """Split data into batches and save to files."""
+    """Split data into batches and save to files.
+
+    With split_mode='memory' the whole input file is loaded at once. With split_mode='stream' the
+    input is read `chunksize` rows at a time and each chunk is appended to the batch files it
+    belongs to, so peak memory stays at about one chunk regardless of the size of the input.
+    The type of each column is inferred from the whole file in a first pass (as when it is loaded
+    at once), so both modes give the same data: e.g. a column with a missing value in any chunk
+    is read as floats in every chunk.
+    With split_mode='index' no data is copied at all. Instead, the byte range of each batch within
+    the input file is saved to `data_index.pkl`, along with the column types inferred from the
+    whole file (read `chunksize` rows at a time), and each task reads its own rows from the input
+    file directly.
+
+    Batch files are saved in `batch_format` (see utils.save_batch). split_mode='stream' appends
+    to the batch files, so it requires batch_format='pickle'.
+
+    By default, each batch gets the same number of rows. If a per-row cost estimate is given,
+    either as a column of the input file (`cost_column`, which is then removed from the data) or
+    as a function `cost_fn(id, data)`, rows are instead assigned to batches with the greedy
+    longest-processing-time algorithm, so that every batch has about the same total cost. The
+    rows of a batch are then no longer consecutive, so the merged results are not in input order
+    either: they are grouped by batch, in input order within each batch. Sort them by ID after
+    merging if the order matters (with generated IDs, that is the input order).
+    """
 
     job_array_ = parse_slurm_array(job_array)
     num_jobs = len(job_array_)
-    
-    # Import the data file
-    # data = load_csv(input_file)
-    data = pd.read_csv(input_file).values.tolist()
-    
-    # Give each data entry a unique ID
-    if generate_new_ids:
-        print('Generating new IDs')
-        data = list(zip(range(len(data)), data))  # [(id, data), ...]
-    else:
-        is_valid_id = list(map(lambda x: str(x[0]).isdigit(), data))
-        if not all(is_valid_id):
-            raise ValueError('Tried to parse the the first column of the input csv file {input_file} as IDs, but \n \
-                             at least one entry is not an integer. Set generate_new_ids=True to generate new IDs.')
-        print('Using existing IDs')
-        ids = list(map(lambda x: int(x[0]), data))
-        data = list(map(lambda x: x[1:], data))
-        data = list(zip(ids, data))  # [(id, data), ...]
-    
-    # Define helper function for chunking the data
-    def _split_list(a: list, n: int) -> list[tuple[int, list]]:
-        k, m = divmod(len(a), n)
-        return [a[i*k+min(i, m):(i+1)*k+min(i+1, m)] for i in range(n)]
+    print('Generating new IDs' if generate_new_ids else 'Using existing IDs')
 
+    # One batch per job (or per cpu in each job, if ntasks_per_job is given)
     if ntasks_per_job is None:
-        print('ntasks_per_job: ', ntasks_per_job)
-        data_batches = _split_list(data, num_jobs)
-        for i, batch in enumerate(data_batches):
-            data_batch_filepath = os.path.join(batched_data_dir, f'data_{job_array_[i]}.pkl')
-            print(f'Saving data batch {job_array_[i]} to {data_batch_filepath} ... ', end='')
-            save_pickle(batch, data_batch_filepath)
-            print('done.')
-    
+        batch_names = [f'{job_array_[i]}' for i in range(num_jobs)]
     else:
-        # Split data into batches (1 batch per cpu in the job array)
-        data_batches = _split_list(data, num_jobs*ntasks_per_job)  # [[(id, data), ...], ...]
-
-        # Save each data batch to a file
-        for k, batch in enumerate(data_batches):
-            i = k // ntasks_per_job
-            j = k % ntasks_per_job
-            data_batch_filepath = os.path.join(batched_data_dir, f'data_{job_array_[i]}_{j}.pkl')
-            print(f'Saving data batch {job_array_[i]}_{j} to {data_batch_filepath} ... ', end='')
-            save_pickle(batch, data_batch_filepath)
+        batch_names = [f'{job_array_[k // ntasks_per_job]}_{k % ntasks_per_job}' for k in range(num_jobs*ntasks_per_job)]
+    batch_filepaths = [os.path.join(batched_data_dir, f'data_{name}{batch_file_extension(batch_format)}') for name in batch_names]
+
+    if split_mode == 'memory':
+        # Import the data file
+        data = pd.read_csv(input_file)
+        costs = None
+        if cost_column is not None:
+            column = _get_column(data, cost_column)
+            costs = data[column].astype(float).tolist()
+            data = data.drop(columns=[column])
+        data = assign_ids(data.values.tolist(), 0, generate_new_ids, input_file)  # [(id, data), ...]
+        if cost_fn is not None:
+            costs = [float(cost_fn(id, d)) for id, d in data]
+
+        # Split data into batches and save each data batch to a file
+        if costs is None:
+            data_batches = _split_list(data, len(batch_filepaths))  # [[(id, data), ...], ...]
+        else:
+            assignment = balance_by_cost(costs, len(batch_filepaths))
+            _report_batch_costs(costs, assignment, len(batch_filepaths))
+            data_batches = [[] for _ in batch_filepaths]
+            for row, k in zip(data, assignment):
+                data_batches[k].append(row)
+        for name, batch, data_batch_filepath in zip(batch_names, data_batches, batch_filepaths):
+            print(f'Saving data batch {name} to {data_batch_filepath} ... ', end='')
+            save_batch(batch, data_batch_filepath, batch_format)
             print('done.')
+    elif split_mode == 'stream':
+        if chunksize is None:
+            raise ValueError("A chunksize must be given when split_mode='stream'.")
+        if batch_format != 'pickle':
+            raise ValueError(f"split_mode='stream' requires batch_format='pickle' (got '{batch_format}').")
+        _split_streaming(input_file, batch_filepaths, generate_new_ids, chunksize, cost_column, cost_fn)
+    elif split_mode == 'index':
+        if (cost_column is not None) or (cost_fn is not None):
+            raise ValueError("split_mode='index' requires contiguous batches, so it does not support cost-based balancing.")
+        _split_index(input_file, batched_data_dir, batch_names, chunksize)
+    else:
+        raise ValueError(f"Invalid split_mode '{split_mode}'. Must be one of 'memory', 'stream' or 'index'.")
     
     # Return the number of data batches
-    return len(data_batches)
+    return len(batch_filepaths)
+
+def _batch_bounds(num_rows: int, n: int) -> list[int]:
+    """Row offsets delimiting `n` near-equal batches (batch i is rows bounds[i]:bounds[i+1])."""
+    k, m = divmod(num_rows, n)
+    return [i*k + min(i, m) for i in range(n + 1)]
+
+def _split_list(a: list, n: int) -> list[list]:
+    bounds = _batch_bounds(len(a), n)
+    return [a[bounds[i]:bounds[i+1]] for i in range(n)]
+
+def _get_column(df: pd.DataFrame, column: str) -> str:
+    """Get a column name from a name or a (string) position."""
+    if column in df.columns:
+        return column
+    elif str(column).isdigit() and int(column) < len(df.columns):
+        return df.columns[int(column)]
+    raise ValueError(f"Column '{column}' not found in the input file (columns: {list(df.columns)}).")
+
+def _report_batch_costs(costs, assignment, num_batches: int):
+    batch_costs = [0.0]*num_batches
+    for cost, k in zip(costs, assignment):
+        batch_costs[k] += cost
+    max_cost = max(batch_costs)
+    mean_cost = sum(batch_costs)/num_batches
+    print(f'Predicted batch cost: max {max_cost:.6g}, mean {mean_cost:.6g} (max/mean = {max_cost/mean_cost if mean_cost > 0 else 1.0:.3f})')
+
+def _widen_dtypes(dtypes: dict, chunk: pd.DataFrame) -> dict:
+    """Fold the column types of a chunk into `dtypes`, so that after all chunks they are the types
+    pd.read_csv infers when it reads the whole file at once."""
+    import numpy as np
+    is_number = lambda dtype: pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+    for column, dtype in chunk.dtypes.items():
+        if (column not in dtypes) or (dtypes[column] == dtype):
+            dtypes[column] = dtype
+        elif is_number(dtypes[column]) and is_number(dtype):
+            dtypes[column] = np.result_type(dtypes[column], dtype)  # e.g. ints and floats are floats
+        else:
+            dtypes[column] = object
+    return dtypes
+
+def _split_streaming(
+    input_file: str, 
+    batch_filepaths: list[str], 
+    generate_new_ids: bool, 
+    chunksize: int,
+    cost_column: Optional[str] = None,
+    cost_fn: Optional[Callable[[int, list], float]] = None
+):
+    """Split the input file into batches without ever loading more than one chunk of it.
+
+    With cost-based balancing, only the per-row costs and batch assignments are kept in memory.
+    """
+    # First pass: count the rows so the batch boundaries match the in-memory split exactly (or,
+    # with cost-based balancing, collect the cost of each row), and infer the column types.
+    # pd.read_csv infers them per chunk, so without this, chunks could get e.g. ints where the
+    # in-memory split gets floats.
+    assignment, dtypes = None, {}
+    if (cost_column is None) and (cost_fn is None):
+        num_rows = 0
+        for chunk in pd.read_csv(input_file, chunksize=chunksize):
+            num_rows += len(chunk)
+            _widen_dtypes(dtypes, chunk)
+        bounds = _batch_bounds(num_rows, len(batch_filepaths))
+    else:
+        costs = array('d')
+        for chunk in pd.read_csv(input_file, chunksize=chunksize):
+            _widen_dtypes(dtypes, chunk)
+            if cost_column is not None:
+                costs.extend(chunk[_get_column(chunk, cost_column)].astype(float))
+            else:
+                data = assign_ids(chunk.values.tolist(), len(costs), generate_new_ids, input_file)
+                costs.extend(float(cost_fn(id, d)) for id, d in data)
+        num_rows = len(costs)
+        assignment = balance_by_cost(costs, len(batch_filepaths))
+        _report_batch_costs(costs, assignment, len(batch_filepaths))
+        del costs
+    print(f'Found {num_rows} rows in {input_file}')
+
+    # Start every batch file with an empty list, so that batches that receive no rows still exist
+    for data_batch_filepath in batch_filepaths:
+        save_pickle([], data_batch_filepath)
+
+    # Second pass: append each chunk to the batch file(s) that its rows fall into
+    k = 0  # current batch
+    row = 0  # row number of the first entry in the current chunk
+    for chunk in pd.read_csv(input_file, chunksize=chunksize, dtype=dtypes):
+        if cost_column is not None:
+            chunk = chunk.drop(columns=[_get_column(chunk, cost_column)])
+        data = assign_ids(chunk.values.tolist(), row, generate_new_ids, input_file)
+        if assignment is not None:
+            data_batches = {}
+            for i, entry in enumerate(data):
+                data_batches.setdefault(assignment[row + i], []).append(entry)
+            for k, batch in data_batches.items():
+                append_pickle(batch, batch_filepaths[k])
+            row += len(data)
+            print(f'Saved rows {row - len(data)}-{row - 1}')
+            continue
+        start = 0
+        while start < len(data):
+            while bounds[k+1] <= row + start:
+                k += 1
+            stop = min(len(data), bounds[k+1] - row)
+            append_pickle(data[start:stop], batch_filepaths[k])
+            start = stop
+        row += len(data)
+        print(f'Saved rows {row - len(data)}-{row - 1} (through batch {k})')
+
+def _split_index(input_file: str, batched_data_dir: str, batch_names: list[str], chunksize: Optional[int] = None):
+    """Save the byte range of each batch within the input file, and the types of its columns.
+
+    The index has 'batches', which maps each batch name to (start_byte, end_byte, first_row),
+    and 'dtypes', which maps each column position to the name of its type (so that every batch
+    is read with the types of the whole file). Like pd.read_csv, the first non-blank line is
+    treated as the header and blank lines are skipped. Every row must be on a single line
+    (i.e., no quoted fields containing newlines).
+    """
+    offsets = array('q')  # byte offset of the start of each row
+    with open(input_file, 'rb') as f:
+        pos = 0
+        found_header = False
+        for line in f:
+            if line.strip():
+                if found_header:
+                    offsets.append(pos)
+                else:
+                    found_header = True
+            pos += len(line)
+    num_rows = len(offsets)
+    offsets.append(pos)  # end of file
+    print(f'Found {num_rows} rows in {input_file}')
+
+    dtypes = {}
+    for chunk in pd.read_csv(input_file, chunksize=chunksize or 100000):
+        _widen_dtypes(dtypes, chunk)
+
+    bounds = _batch_bounds(num_rows, len(batch_names))
+    index = {
+        'batches': {
+            name: (offsets[bounds[i]], offsets[bounds[i+1]], bounds[i])
+            for i, name in enumerate(batch_names)
+        },
+        # Names rather than dtype objects, which may not unpickle with another version of pandas
+        'dtypes': {i: str(dtype) for i, dtype in enumerate(dtypes.values())}
+    }
+    index_filepath = os.path.join(batched_data_dir, 'data_index.pkl')
+    print(f'Saving data index to {index_filepath} ... ', end='')
+    save_pickle(index, index_filepath)
+    print('done.')
 
 if __name__ == '__main__':
     import argparse
@@ -93,6 +273,13 @@ if __name__ == '__main__':
     parser.add_argument('--job-array', '--job_array', type=str, help='Array of job numbers.')
     parser.add_argument('--ntasks-per-job', '--ntasks_per_job', type=int, help='Number of tasks per job.')
     parser.add_argument('--generate-new-ids', '--generate_new_ids', action='store_true', help='Generate new IDs for the data entries.')
+    parser.add_argument('--split-mode', '--split_mode', type=str, default='memory', help="How to split the input file ('memory', 'stream' or 'index').")
+    parser.add_argument('--chunksize', type=int, help="Number of rows read at a time when split_mode='stream' (or 'index').")
+    parser.add_argument('--batch-format', '--batch_format', type=str, default='pickle', help="File format of the data batches.")
+    parser.add_argument('--cost-column', '--cost_column', type=str, help="Column of the input file with the estimated cost of each row.")
+    parser.add_argument('--cost-module-parent-dir', '--cost_module_parent_dir', type=str)
+    parser.add_argument('--cost-module', '--cost_module', type=str)
+    parser.add_argument('--cost-fn', '--cost_fn', type=str, help="Function cost_fn(id, data) that estimates the cost of each row.")
     args, unknown_args = parser.parse_known_args()
 
     t1 = time.time()
@@ -105,10 +292,14 @@ if __name__ == '__main__':
     print('Contents of utils parent directory:')
     print(os.listdir(args.utils_parent_dir))
     try:
-        from utils import load_csv, save_pickle, parse_slurm_array
+        from utils import load_csv, save_pickle, append_pickle, save_batch, batch_file_extension, parse_slurm_array, assign_ids, balance_by_cost
     except:
         raise Exception('Could not import utils module. Make sure the --parent-dir argument is pointing to the package\'s embarrassingly_parallel directory.')
-    print('args.ntasks_per_job: ', args.ntasks_per_job)
-    main(args.input_file, args.batched_data_dir, args.job_array, args.ntasks_per_job, args.generate_new_ids)
+    cost_fn = None
+    if args.cost_fn is not None:
+        import importlib
+        sys.path.append(args.cost_module_parent_dir)
+        cost_fn = getattr(importlib.import_module(args.cost_module), args.cost_fn)
+    main(args.input_file, args.batched_data_dir, args.job_array, args.ntasks_per_job, args.generate_new_ids, args.split_mode, args.chunksize, args.batch_format, args.cost_column, cost_fn)
     t2 = time.time()
     print('Elapsed time for splitting data: {:.5f}'.format(t2 - t1))
\ No newline at end of file
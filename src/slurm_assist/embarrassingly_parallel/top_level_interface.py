@@ -1,4 +1,5 @@
 import os
+import shlex
 import subprocess
 from typing import Union, Optional
 from collections import namedtuple
@@ -12,11 +13,13 @@ from ..utils import (
     parse_slurm_array, 
     estimate_total_time, 
     submit_slurm_job, 
+    submit_slurm_jobs,
     remove_and_make_dir, 
     cancel_slurm_job,
-    write_temp_file,
+    write_job_script,
     convert_slurm_keys,
-    merge_dicts
+    merge_dicts,
+    batch_file_extension
 )
 
 from .. import utils
@@ -48,8 +51,12 @@ monitor gpu memory > {{ resource_monitoring_dir }}/gpu-memory-run-${SLURM_JOB_ID
 GPU_MEM_PID=$!
 {% endif %}
 
-# Run computations
-srun --mpi={{ mpi }} apptainer run {{ container_image }} {{ python_script }} --array-id $SLURM_ARRAY_TASK_ID {{ python_script_args }}
+# Run computations (the python script arguments are passed to this script). Since Slurm 22.05,
+# srun does not inherit --cpus-per-task from the job, so pass it on to the job step.
+if [ -n "$SLURM_CPUS_PER_TASK" ]; then
+    export SRUN_CPUS_PER_TASK=$SLURM_CPUS_PER_TASK
+fi
+srun --mpi={{ mpi }} apptainer run {{ container_image }} {{ python_script }} --array-id $SLURM_ARRAY_TASK_ID "$@"
 
 # Shut down the resource monitors
 kill -s INT $CPU_USAGE_PID $CPU_MEM_PID
@@ -65,22 +72,46 @@ class EmbarrassinglyParallelJobs(JobGroup):
         config: Union[str, dict, list[Union[str, dict, None]]]
     ):
         super().__init__(config)
-        print('======', self.keys())
         self._set_defaults()
         self.check_config_is_valid()
+        self._set_main_script_args()
+        self.main_job_id = None
+        self.main_job_ids = []
 
+        self._default_split_merge_slurm_args = dict(
+            time='00:10:00',
+            mem='1G'
+        )
+
+    def _set_main_script_args(self):
         # The "main job"
         main_python_script_args = [
             f"--single-run-module-parent-dir {self['single_run_module_parent_dir']}",
             f"--single-run-module {self['single_run_module']}",
-            f"--single-run-fn {self['single_run_function']}",
             f"--batched-data-dir {self.batched_data_dir}",
             f"--batched-results-dir {self.batched_results_dir}",
             f"--split-results-dir {self.split_results_dir}",
-            f"--job-array {self.main_slurm_args['array']}",
+            f"--job-array {self.logical_array}",
             f"--ntasks-per-job {self.main_slurm_args['ntasks']}",
+            f"--split-mode {self.get('split_mode', 'memory')}",
+            f"--input-data-file {self['input_data_file']}",
+            f"--generate-new-ids {self['generate_new_ids']}",
+            f"--schedule {self.get('schedule', 'static')}",
+            f"--schedule-chunksize {self.get('schedule_chunksize', 1)}",
+            f"--executor {self.get('executor', 'serial')}",
+            f"--executor-chunksize {self.get('executor_chunksize', 1)}",
+            f"--batch-format {self.get('batch_format', 'pickle')}",
             f"--utils-parent-dir {utils_parent_dir}",
         ]
+        if 'single_run_function' in self:
+            main_python_script_args += [f"--single-run-fn {self['single_run_function']}"]
+        if 'batch_run_function' in self:
+            main_python_script_args += [
+                f"--batch-run-fn {self['batch_run_function']}",
+                f"--batch-run-stack {self.get('batch_run_stack', False)}"
+            ]
+        if self.get('checkpoint_every') is not None:
+            main_python_script_args += [f"--checkpoint-every {self['checkpoint_every']}"]
         if '_main_python_script_extra_args' in self.keys():
             if isinstance(self['_main_python_script_extra_args'], dict):
                 for k, v in self['_main_python_script_extra_args'].items():
@@ -88,28 +119,30 @@ class EmbarrassinglyParallelJobs(JobGroup):
             else:
                 raise ValueError(f"Expected '_main_python_script_extra_args' to be a dictionary, but got {type(self['_main_python_script_extra_args'])}.")
         main_python_script_args = ' '.join([parse_field(arg) for arg in main_python_script_args])
-        self.main_job_script = main_script_template.render(dict(
+        # Passed to the job script as arguments, so that the script itself can be reused
+        self.main_script_args = shlex.split(main_python_script_args)
+        self._main_script_render_args = dict(
             container_image=self['container_image'],
             python_script=main_python_script,
-            python_script_args=main_python_script_args,
             mpi=self['mpi'],
             use_gpu=self['use_gpu'],
             stdout_dir=self.stdout_dir,
             resource_monitoring_dir=self.resource_monitoring_dir
-        ))
-        self.main_job_id = None
-
-        self._default_split_merge_slurm_args = dict(
-            time='00:10:00',
-            mem='1G'
         )
 
+    def update_main_slurm_args(self, main_slurm_args: dict):
+        """Update the main job's slurm args (e.g. with those from tuning.tune) before submitting."""
+        self['main_slurm_args'] = merge_dicts(self['main_slurm_args'], main_slurm_args)
+        self._set_main_script_args()
+
     def add_suffix_to_job_name(self, slurm_args):
         if self.suffix is not None:
             slurm_args['job-name'] += f"_{self.suffix}"
 
     def check_config_is_valid(self, container_test_cmds=['python3', '-c', 'import os']):
         check_has_keys(self, required_keys=['main_slurm_args', 'results_dir', 'input_data_file', 'container_image', 'mpi', 'generate_new_ids'])
+        if ('single_run_function' not in self) and ('batch_run_function' not in self):
+            raise ValueError("Config must have 'single_run_function' or 'batch_run_function'.")
         if os.path.exists(self['container_image']):
             res = subprocess.run(['apptainer', 'exec', self['container_image'], *container_test_cmds])
             if res.returncode != 0:
@@ -169,9 +202,47 @@ class EmbarrassinglyParallelJobs(JobGroup):
         self.add_suffix_to_job_name(slurm_args)
         return slurm_args
 
+    @property
+    def logical_array(self):
+        """The job array as configured (without a '%' throttle)."""
+        return str(self.main_slurm_args['array']).split('%')[0]
+
     @property
     def array_elements(self):
-        return parse_slurm_array(self.main_slurm_args['array'])
+        return parse_slurm_array(self.logical_array)
+
+    @property
+    def target_concurrency(self) -> Optional[int]:
+        """The most main job tasks to run at a time ('target_concurrency', or the array's '%' throttle)."""
+        _, _, throttle = str(self.main_slurm_args['array']).partition('%')
+        return self.get('target_concurrency', int(throttle) if throttle else None)
+
+    @property
+    def array_chunks(self) -> list[tuple[str, int]]:
+        """The physical job arrays to submit, as (array, offset) pairs.
+
+        If 'max_array_size' (the cluster's MaxArraySize) is set and the array is too large for
+        it, the array is split into chunks of at most max_array_size - 1 tasks, each submitted 
+        as the array '1-<chunk length>'. Task k of a chunk with offset o runs element o + k of 
+        the logical array, so the batch files of each element stay the same. If 
+        'target_concurrency' is set (or the array has a '%' throttle), each chunk gets it as its 
+        throttle, and the chunks run one after the other (see submit_main), so that at most that 
+        many tasks run at a time in total.
+        """
+        array = str(self.main_slurm_args['array']).partition('%')[0]
+        target_concurrency = self.target_concurrency
+        max_array_size = self.get('max_array_size')
+        if (max_array_size is None) or (max(self.array_elements) < max_array_size):
+            chunks = [(array, 0)]
+        else:
+            chunk_size = max_array_size - 1
+            chunks = [
+                (f'1-{min(chunk_size, self.array_size - offset)}', offset)
+                for offset in range(0, self.array_size, chunk_size)
+            ]
+        if target_concurrency is not None:
+            chunks = [(f'{chunk}%{target_concurrency}', offset) for chunk, offset in chunks]
+        return chunks
 
     @property
     def array_size(self):
@@ -186,7 +257,16 @@ class EmbarrassinglyParallelJobs(JobGroup):
     
     @property
     def job_scripts_dir(self):
-        return os.path.join(self.tmp_dir, 'job_scripts')
+        # Kept outside of tmp_dir, so the scripts survive clearing it and can be reused (scripts
+        # unused for a while are removed, see utils.prune_job_scripts)
+        if 'job_scripts_dir' in self.keys():
+            return self['job_scripts_dir']
+        else:
+            return os.path.join('.slurm_assist', 'job_scripts')
+
+    @property
+    def main_job_script(self):
+        return main_script_template.render(self._main_script_render_args)
 
     @property
     def batched_data_dir(self):
@@ -195,6 +275,10 @@ class EmbarrassinglyParallelJobs(JobGroup):
     @property
     def batched_results_dir(self):
         return os.path.join(self.tmp_dir, 'results_batched')
+
+    @property
+    def partial_results_dir(self):
+        return os.path.join(self.tmp_dir, 'results_partial')
     
     @property
     def log_dir(self):
@@ -217,10 +301,14 @@ class EmbarrassinglyParallelJobs(JobGroup):
     
     @property
     def merged_results_file(self):
-        return os.path.join(self['results_dir'], 'merged_results.txt')
+        merged_results_format = self.get('merged_results_format', 'csv')
+        if merged_results_format == 'csv':
+            return os.path.join(self['results_dir'], 'merged_results.txt')
+        else:
+            return os.path.join(self['results_dir'], f'merged_results{batch_file_extension(merged_results_format)}')
     
-    def _write_job_script(self, job_script_str):
-        return write_temp_file(job_script_str, dir=self.job_scripts_dir, prefix='submit_')
+    def _write_job_script(self):
+        return write_job_script(main_script_template_content, self.job_scripts_dir, **self._main_script_render_args)
     
     def setup(self, clear_directories: Optional[bool] = True):
         # Main results directory
@@ -233,6 +321,7 @@ class EmbarrassinglyParallelJobs(JobGroup):
         os.makedirs(self.job_scripts_dir, exist_ok=True)
         os.makedirs(self.batched_data_dir, exist_ok=True)
         os.makedirs(self.batched_results_dir, exist_ok=True)
+        os.makedirs(self.partial_results_dir, exist_ok=True)
         os.makedirs(self.split_results_dir, exist_ok=True)
         os.makedirs(self.resource_monitoring_dir, exist_ok=True)
         os.makedirs(self.stdout_dir, exist_ok=True)
@@ -250,11 +339,19 @@ class EmbarrassinglyParallelJobs(JobGroup):
                     utils_parent_dir=utils_parent_dir,
                     input_file=self['input_data_file'],
                     batched_data_dir=self.batched_data_dir,
-                    job_array=self.main_slurm_args['array'],
+                    job_array=self.logical_array,
                     ntasks_per_job=self.main_slurm_args['ntasks'],
-                    generate_new_ids=self['generate_new_ids']
+                    generate_new_ids=self['generate_new_ids'],
+                    split_mode=self.get('split_mode'),
+                    chunksize=self.get('split_chunksize'),
+                    batch_format=self.get('batch_format'),
+                    cost_column=self.get('split_cost_column'),
+                    cost_module_parent_dir=self['single_run_module_parent_dir'] if 'split_cost_function' in self else None,
+                    cost_module=self['single_run_module'] if 'split_cost_function' in self else None,
+                    cost_fn=self.get('split_cost_function')
                 ),
                 tmp=self.tmp_dir,
+                job_scripts_dir=self.job_scripts_dir,
                 container_image=self['container_image'],
                 slurm_args=self.split_slurm_args
             )
@@ -264,26 +361,48 @@ class EmbarrassinglyParallelJobs(JobGroup):
             dependency_conditions=dependency_conditions,
             clear_directories=False
         )[-1]  # Gets the last job ID (in this case, there is only one)
+        self.all_job_ids.append(self.split_job_id)
 
     def submit_main(
         self,
         dependency_ids=None,
         dependency_conditions=None
     ):
-        job_script_filename = self._write_job_script(self.main_job_script)
-        self.main_job_id = submit_slurm_job(
-            slurm_args=self.main_slurm_args, 
-            job_script_filename=job_script_filename, 
-            dependency_ids=[[self.split_job_id]] if dependency_ids is None else dependency_ids, 
-            dependency_conditions=['afterok'] if dependency_conditions is None else dependency_conditions,
-        )
+        """Submits the main job (one job array per chunk, see array_chunks).
 
-    def submit_merge(
-        self,
-        dependency_ids=None,
-        dependency_conditions=None
-    ):
-        merge_job = SingleJob(
+        The chunks are submitted concurrently and run at the same time, unless the main job has a
+        target concurrency: then each chunk waits for the previous one to finish (afterany), so
+        that the chunks' throttles do not add up.
+        """
+        job_script_filename = self._write_job_script()
+        main_jobs = [
+            dict(
+                slurm_args=dict(self.main_slurm_args, array=array), 
+                job_script_filename=job_script_filename, 
+                dependency_ids=[[self.split_job_id]] if dependency_ids is None else dependency_ids, 
+                dependency_conditions=['afterok'] if dependency_conditions is None else dependency_conditions,
+                script_args=self.main_script_args + ([f'--array-offset', str(offset)] if offset > 0 else [])
+            )
+            for array, offset in self.array_chunks
+        ]
+        if len(main_jobs) == 1:
+            self.main_job_ids = [submit_slurm_job(**main_jobs[0])]
+        elif self.target_concurrency is not None:
+            self.main_job_ids = []
+            for main_job in main_jobs:
+                if len(self.main_job_ids) > 0:
+                    main_job['dependency_ids'] = list(main_job['dependency_ids']) + [[self.main_job_ids[-1]]]
+                    main_job['dependency_conditions'] = list(main_job['dependency_conditions']) + ['afterany']
+                self.main_job_ids.append(submit_slurm_job(**main_job))
+            print(f'Submitted the job array in {len(main_jobs)} chained chunks: {self.main_job_ids}')
+        else:
+            self.main_job_ids = submit_slurm_jobs(main_jobs, max_workers=self.get('submit_workers', 8))
+            print(f'Submitted the job array in {len(main_jobs)} chunks: {self.main_job_ids}')
+        self.main_job_id = self.main_job_ids[-1]
+        self.all_job_ids += self.main_job_ids
+
+    def _merge_job(self, **program_args):
+        return SingleJob(
             dict(
                 program=merge_python_script,
                 program_args=dict(
@@ -291,19 +410,83 @@ class EmbarrassinglyParallelJobs(JobGroup):
                     batched_results_dir=self.batched_results_dir,
                     merged_results_file=self.merged_results_file,
                     tmp_dir=self.tmp_dir,
-                    job_array=self.main_slurm_args['array'],
-                    ntasks_per_job=self.main_slurm_args['ntasks']
+                    job_array=self.logical_array,
+                    ntasks_per_job=self.main_slurm_args['ntasks'],
+                    merge_mode=self.get('merge_mode'),
+                    num_workers=self.get('merge_workers'),
+                    prefetch=self.get('merge_prefetch'),
+                    batch_format=self.get('batch_format'),
+                    merged_format=self.get('merged_results_format'),
+                    **program_args
                 ),
                 tmp=self.tmp_dir,
+                job_scripts_dir=self.job_scripts_dir,
                 container_image=self['container_image'],
                 slurm_args=self.merge_slurm_args
             )
         )
+
+    def submit_merge(
+        self,
+        dependency_ids=None,
+        dependency_conditions=None
+    ):
+        """Submits the merge job(s).
+
+        If 'merge_fan_in' is set, the results files are merged hierarchically. Each merge sub-job
+        combines up to merge_fan_in consecutive files into a partial results file, level by level
+        (each level depending on the previous one), until a final merge job can combine the rest.
+        """
+        dependency_ids = [self.main_job_ids] if dependency_ids is None else dependency_ids
+        dependency_conditions = ['afterany'] if dependency_conditions is None else dependency_conditions
+        fan_in = self.get('merge_fan_in')
+        if fan_in is not None and fan_in < 2:
+            raise ValueError(f"merge_fan_in must be at least 2, but got {fan_in}.")
+        ntasks = self.main_slurm_args['ntasks']
+        num_inputs = self.array_size*(ntasks if ntasks is not None else 1)
+        ext = batch_file_extension(self.get('batch_format', 'pickle'))
+
+        self.merge_job_ids = []
+        level = 0
+        while fan_in is not None and num_inputs > fan_in:
+            num_outputs = -(-num_inputs // fan_in)
+            # The merge jobs of a level are independent, so they are submitted concurrently
+            level_jobs = []
+            for k in range(num_outputs):
+                merge_job = self._merge_job(
+                    level=level,
+                    num_inputs=num_inputs,
+                    file_range=f'{k*fan_in}:{min((k + 1)*fan_in, num_inputs)}',
+                    partial_results_dir=self.partial_results_dir,
+                    partial_results_file=os.path.join(self.partial_results_dir, f'partial_{level + 1}_{k}{ext}')
+                )
+                merge_job.setup(clear_directories=False)
+                level_jobs.append(dict(
+                    slurm_args=merge_job['slurm_args'],
+                    job_script_filename=merge_job._write_job_script(),
+                    script_args=merge_job.script_args,
+                    dependency_ids=dependency_ids, 
+                    dependency_conditions=dependency_conditions
+                ))
+            level_job_ids = submit_slurm_jobs(level_jobs, max_workers=self.get('submit_workers', 8))
+            print(f'Submitted {num_outputs} level-{level + 1} merge jobs: {level_job_ids}')
+            self.merge_job_ids += level_job_ids
+            dependency_ids, dependency_conditions = [level_job_ids], ['afterany']
+            level += 1
+            num_inputs = num_outputs
+
+        merge_job = self._merge_job(
+            level=level,
+            num_inputs=num_inputs if level > 0 else None,
+            partial_results_dir=self.partial_results_dir if level > 0 else None
+        )
         self.merge_job_id = merge_job.submit(
-            dependency_ids=[[self.main_job_id]] if dependency_ids is None else dependency_ids, 
-            dependency_conditions=['afterany'] if dependency_conditions is None else dependency_conditions,
+            dependency_ids=dependency_ids, 
+            dependency_conditions=dependency_conditions,
             clear_directories=False
         )[-1]  # Gets the last job ID (in this case, there is only one)
+        self.merge_job_ids.append(self.merge_job_id)
+        self.all_job_ids += self.merge_job_ids
 
     
     def submit(
@@ -341,7 +524,8 @@ class EmbarrassinglyParallelJobs(JobGroup):
         if verbose:
             print(f"Diagnostics")
             print(f"-----------")
-            print(f"Standard output/error files:    {os.path.abspath(self.stdout_dir)}/slurm-{self.main_job_id}_*.out")
+            main_job_ids_str = self.main_job_id if len(self.main_job_ids) == 1 else '{' + ','.join(map(str, self.main_job_ids)) + '}'
+            print(f"Standard output/error files:    {os.path.abspath(self.stdout_dir)}/slurm-{main_job_ids_str}_*.out")
             print(f"Resource monitoring directory:  {os.path.abspath(self.resource_monitoring_dir)}")
             print()
 
@@ -356,13 +540,18 @@ class EmbarrassinglyParallelJobs(JobGroup):
         return JobIds(split=self.split_job_id, main=self.main_job_id, merge=self.merge_job_id)
     
     def cancel(self):
-        cancel_slurm_job(self.main_job_id)
-        cancel_slurm_job(self.merge_job_id)
+        for main_job_id in self.main_job_ids:
+            cancel_slurm_job(main_job_id)
+        for merge_job_id in self.merge_job_ids:
+            cancel_slurm_job(merge_job_id)
         subprocess.run(["rm", "-rf", self.tmp_dir])
 
     def estimate_total_time(self, num_runs, single_run_time):
         """Estimate total time for all jobs to complete (not including slurm queue wait times).
 
+        For an estimate that includes the split/merge jobs, queue waits, throttling and runtime
+        variance, see planning.simulate.
+
         Example
         -------
 
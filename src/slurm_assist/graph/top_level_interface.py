@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Union, Optional, Sequence
+from ..job import JobGroup
+from ..utils import format_dependencies_to_str
+
+Config = Union[str, dict, list[Union[str, dict, None]]]
+# (upstream node, downstream node) or (upstream node, downstream node, condition)
+Edge = Union[tuple[str, str], tuple[str, str, str]]
+
+class JobGraph(JobGroup):
+    """A directed acyclic graph of job groups.
+
+    Each node is a JobGroup (e.g. SingleJob, EmbarrassinglyParallelJobs). An edge (a, b, condition)
+    makes node b depend on the job IDs returned by submitting node a, with a Slurm dependency
+    condition such as 'afterok' (the default) or 'afterany'. Nodes are submitted in topological
+    order, and each node is submitted as soon as all of its upstream nodes are, so independent
+    branches are submitted concurrently (at most config['submit_workers'] at a time, default 8).
+    Like any JobGroup, a JobGraph can itself depend on other jobs (its root nodes then wait for
+    them), and can be nested in SerialJobs or in another JobGraph.
+
+    Example
+    -------
+    graph = JobGraph(
+        nodes={'prep': prep_job, 'a': job_a, 'b': job_b, 'report': report_job},
+        edges=[('prep', 'a'), ('prep', 'b'), ('a', 'report', 'afterany'), ('b', 'report', 'afterany')]
+    )
+    job_ids = graph.submit()  # (123, 124, 125, 126)
+    graph.job_ids  # {'prep': (123,), 'a': (124,), ...}
+    """
+    def __init__(
+        self,
+        nodes: Optional[dict[str, JobGroup]] = None,
+        edges: Optional[Sequence[Edge]] = None,
+        config: Optional[Config] = None
+    ):
+        super().__init__(config)
+        self.nodes = {}
+        self.edges = []
+        for name, job_group in (nodes or {}).items():
+            self.add_node(name, job_group)
+        for edge in (edges or []):
+            self.add_edge(*edge)
+        self.job_ids = {}
+        self.dependency_strs = {}
+
+    def add_node(self, name: str, job_group: JobGroup):
+        if name in self.nodes:
+            raise ValueError(f"Node '{name}' already exists.")
+        self.nodes[name] = job_group
+
+    def add_edge(self, upstream: str, downstream: str, condition: str = 'afterok'):
+        for name in (upstream, downstream):
+            if name not in self.nodes:
+                raise ValueError(f"Node '{name}' does not exist.")
+        self.edges.append((upstream, downstream, condition))
+
+    def upstream(self, name: str) -> list[tuple[str, str]]:
+        """The (upstream node, condition) pairs of a node."""
+        return [(u, condition) for u, d, condition in self.edges if d == name]
+
+    def topological_order(self) -> list[str]:
+        """The nodes in an order where every node comes after its upstream nodes."""
+        num_upstream = {name: len(self.upstream(name)) for name in self.nodes}
+        ready = [name for name in self.nodes if num_upstream[name] == 0]
+        order = []
+        while len(ready) > 0:
+            name = ready.pop(0)
+            order.append(name)
+            for u, d, _ in self.edges:
+                if u == name:
+                    num_upstream[d] -= 1
+                    if num_upstream[d] == 0:
+                        ready.append(d)
+        if len(order) != len(self.nodes):
+            raise ValueError(f"The job graph has a cycle (through nodes {[n for n in self.nodes if n not in order]}).")
+        return order
+
+    def _dependencies(self, name: str) -> tuple[Optional[list[list[int]]], Optional[list[str]]]:
+        """Dependency IDs and conditions of a node (one entry per condition, as in submit_slurm_job)."""
+        ids_by_condition = {}
+        for u, condition in self.upstream(name):
+            ids_by_condition.setdefault(condition, []).extend(self.job_ids[u])
+        if len(ids_by_condition) == 0:
+            return None, None
+        return list(ids_by_condition.values()), list(ids_by_condition.keys())
+
+    def _submit_node(self, name: str, root_dependency_ids, root_dependency_conditions, clear_directories, verbose) -> tuple:
+        if len(self.upstream(name)) == 0:
+            # Root nodes wait for the jobs the graph as a whole depends on
+            dependency_ids, dependency_conditions = root_dependency_ids, root_dependency_conditions
+        else:
+            dependency_ids, dependency_conditions = self._dependencies(name)
+        if dependency_ids is not None:
+            self.dependency_strs[name] = format_dependencies_to_str(dependency_ids, dependency_conditions)
+        return tuple(self.nodes[name].submit(
+            dependency_ids=dependency_ids,
+            dependency_conditions=dependency_conditions,
+            clear_directories=clear_directories,
+            verbose=verbose
+        ))
+
+    def submit(
+        self,
+        dependency_ids: Optional[list[list[int]]] = None,
+        dependency_conditions: Optional[list[str]] = None,
+        clear_directories: Optional[bool] = True,
+        verbose: Optional[bool] = True
+    ) -> tuple[int]:
+        """Submits all nodes. Returns the job IDs returned by the nodes' submits (in topological
+        order); the IDs of each node are in self.job_ids, by node name."""
+        order = self.topological_order()
+        submitted = set()
+        with ThreadPoolExecutor(max_workers=self.get('submit_workers', 8)) as pool:
+            futures = {}
+            while len(submitted) < len(order):
+                # Submit every node whose upstream nodes have all been submitted
+                for name in order:
+                    if (name not in submitted) and (name not in futures.values()):
+                        if all(u in submitted for u, _ in self.upstream(name)):
+                            futures[pool.submit(self._submit_node, name, dependency_ids, dependency_conditions, clear_directories, verbose)] = name
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures.pop(future)
+                    self.job_ids[name] = future.result()
+                    submitted.add(name)
+                    # Job groups that track all of their jobs report more than their returned IDs
+                    self.all_job_ids += (self.nodes[name].all_job_ids or list(self.job_ids[name]))
+        return tuple(job_id for name in order for job_id in self.job_ids[name])
@@ -1,4 +1,6 @@
+from typing import Optional
 from .utils import load_yaml, merge_dicts, convert_slurm_keys, cancel_slurm_job, parse_config
+from . import status
 
 class JobGroup(dict):
     def __init__(self, config):
@@ -16,5 +18,17 @@ class JobGroup(dict):
     def cancel(self):
         for job_id in self.all_job_ids:
             cancel_slurm_job(job_id)
+
+    def status(self, max_age: Optional[float] = None) -> dict[str, str]:
+        """Get the state of each submitted job (one squeue/sacct call, cached; see status.py)."""
+        return status.get_states(self.all_job_ids, max_age=max_age)
+
+    def wait(self, timeout: Optional[float] = None, **kwargs) -> dict[str, str]:
+        """Block until all submitted jobs are finished. Returns their final states."""
+        return status.wait(self.all_job_ids, timeout=timeout, **kwargs)
+
+    async def async_wait(self, timeout: Optional[float] = None, **kwargs) -> dict[str, str]:
+        """Wait for all submitted jobs to finish, as a coroutine. Returns their final states."""
+        return await status.async_wait(self.all_job_ids, timeout=timeout, **kwargs)
     
     
\ No newline at end of file
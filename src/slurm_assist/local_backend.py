@@ -0,0 +1,390 @@
+"""
+FILE: local_backend.py
+PURPOSE: Emulate a Slurm cluster on one machine, for running and profiling pipelines locally.
+
+Example
+-------
+from slurm_assist import EmbarrassinglyParallelJobs, use_local_backend
+
+with use_local_backend(max_slots=4) as backend:
+    job = EmbarrassinglyParallelJobs('config.yaml')
+    job.submit()
+    backend.wait()
+"""
+
+import os
+import sys
+import shlex
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+from .utils import parse_slurm_array
+from . import submission
+
+PENDING, RUNNING, COMPLETED, FAILED, CANCELLED = 'PENDING', 'RUNNING', 'COMPLETED', 'FAILED', 'CANCELLED'
+TERMINAL_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# Stand-ins for the cluster commands used by the job scripts. They are put first on the PATH of
+# the jobs (and of this process, while the backend is in use).
+shims = {
+    # Environment modules are not needed locally
+    'module': """#!/bin/bash
+exit 0
+""",
+    # Resource monitor: print a timestamped sample of the requested metric every second until
+    # killed or until the job script that started it exits
+    'monitor': """#!/bin/bash
+PARENT=$PPID
+trap 'exit 0' INT TERM
+while kill -0 $PARENT 2>/dev/null; do
+    echo "$(date +%s) $1 $2 0"
+    sleep 1
+done
+""",
+    # srun: launch the command on SLURM_NTASKS ranks (with mpirun if there are more than one)
+    'srun': """#!/bin/bash
+NTASKS=${SLURM_NTASKS:-1}
+while [[ "$1" == -* ]]; do
+    case "$1" in
+        -n|--ntasks) NTASKS=$2; shift 2;;
+        --ntasks=*) NTASKS=${1#*=}; shift;;
+        -c|--cpus-per-task) export SLURM_CPUS_PER_TASK=$2; shift 2;;
+        --cpus-per-task=*) export SLURM_CPUS_PER_TASK=${1#*=}; shift;;
+        *) shift;;
+    esac
+done
+if [ "$NTASKS" -gt 1 ]; then
+    exec {mpirun} -n $NTASKS "$@"
+else
+    exec "$@"
+fi
+""",
+    # apptainer: run the command on the host (scripts ending in .py with the current Python)
+    'apptainer': """#!/bin/bash
+ACTION=$1; shift
+while [[ "$1" == -* ]]; do shift; done
+shift  # container image
+if [[ "$ACTION" == "run" && "$1" == *.py ]]; then
+    exec {python} "$@"
+fi
+exec "$@"
+""",
+}
+
+def _parse_sbatch_argv(argv: list[str]) -> tuple[dict, str, list[str]]:
+    """Split an sbatch command into its options, job script and job script arguments."""
+    options = {}
+    k = 1
+    while k < len(argv) and argv[k].startswith('-'):
+        key, sep, value = argv[k].lstrip('-').partition('=')
+        options[key] = value if sep else True
+        k += 1
+    if k == len(argv):
+        raise RuntimeError(f'No job script given to sbatch: {argv}')
+    return options, argv[k], argv[k + 1:]
+
+def _parse_script_options(job_script_filename: str) -> dict:
+    """Get the options given in the #SBATCH lines of a job script."""
+    options = {}
+    with open(job_script_filename, 'r') as f:
+        for line in f:
+            if line.startswith('#SBATCH'):
+                for arg in shlex.split(line[len('#SBATCH'):]):
+                    key, sep, value = arg.lstrip('-').partition('=')
+                    options[key] = value if sep else True
+    return options
+
+def _parse_dependency(dependency: str) -> list[tuple[str, list[int]]]:
+    """Parse e.g. 'afterok:1:2,afterany:3' into [('afterok', [1, 2]), ('afterany', [3])]."""
+    conditions = []
+    for part in dependency.split(','):
+        condition, *job_ids = part.split(':')
+        if condition not in ('afterok', 'afterany', 'afternotok'):
+            raise RuntimeError(f"Dependency type '{condition}' is not supported by the local backend.")
+        conditions.append((condition, [int(job_id.split('_')[0]) for job_id in job_ids]))
+    return conditions
+
+class _LocalTask:
+    def __init__(self, job, array_task_id: Optional[int]):
+        self.job = job
+        self.array_task_id = array_task_id
+        self.state = PENDING
+        self.process = None
+        self.returncode = None
+        self.start_time = None
+        self.end_time = None
+
+class _LocalJob:
+    def __init__(self, job_id: int, options: dict, job_script_filename: str, script_args: list[str], env: dict, cwd: str):
+        self.job_id = job_id
+        self.options = options
+        self.job_script_filename = job_script_filename
+        self.script_args = script_args
+        self.env = env
+        self.cwd = options.get('chdir', cwd)
+        self.dependencies = _parse_dependency(options['dependency']) if 'dependency' in options else []
+        self.ntasks = int(options.get('ntasks', 1))
+        self.slots = self.ntasks*int(options.get('cpus-per-task', 1))
+        self.throttle = None
+        if 'array' in options:
+            array, _, throttle = str(options['array']).partition('%')
+            self.throttle = int(throttle) if throttle else None
+            self.tasks = [_LocalTask(self, k) for k in parse_slurm_array(array)]
+        else:
+            self.tasks = [_LocalTask(self, None)]
+
+    @property
+    def state(self) -> str:
+        states = [task.state for task in self.tasks]
+        for state in (RUNNING, PENDING, FAILED, CANCELLED):
+            if state in states:
+                return state
+        return COMPLETED
+
+class LocalBackend:
+    """Runs sbatch submissions as local processes, emulating the Slurm features used here.
+
+    Supported: job arrays (SLURM_ARRAY_TASK_ID etc., and '%' throttles), afterok/afterany/
+    afternotok dependencies, --output/--error (including %A, %a, %j) and --ntasks (srun
+    launches ntasks ranks with mpirun). At most `max_slots` cpus (ntasks*cpus-per-task of the
+    running tasks) are used at a time. A job whose dependency can never be satisfied is
+    cancelled, like Slurm with kill_on_invalid_dep.
+    """
+    def __init__(self, max_slots: Optional[int] = None, shim_dir: Optional[str] = None, mpirun: str = 'mpirun', poll_interval: float = 0.05):
+        self.max_slots = max_slots if max_slots is not None else os.cpu_count()
+        self.poll_interval = poll_interval
+        self.jobs = {}
+        self._next_job_id = 1
+        self._lock = threading.Condition()
+        self._scheduler = None
+        self._stop = threading.Event()
+        self._tmp_dir = None
+        if shim_dir is None:
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix='slurm_assist_local_')
+            shim_dir = self._tmp_dir.name
+        self.shim_dir = shim_dir
+        self._write_shims(mpirun)
+
+    def _write_shims(self, mpirun: str):
+        os.makedirs(self.shim_dir, exist_ok=True)
+        for name, content in shims.items():
+            path = os.path.join(self.shim_dir, name)
+            with open(path, 'w') as f:
+                f.write(content.replace('{python}', shlex.quote(sys.executable)).replace('{mpirun}', mpirun))
+            os.chmod(path, 0o755)
+
+    def sbatch(self, argv: list[str]) -> int:
+        """Queue a job given as an sbatch command. Returns the job ID."""
+        options, job_script_filename, script_args = _parse_sbatch_argv(argv)
+        options = dict(_parse_script_options(job_script_filename), **options)
+        env = os.environ.copy()
+        env['PATH'] = self.shim_dir + os.pathsep + env.get('PATH', '')
+        with self._lock:
+            if self._stop.is_set():
+                raise RuntimeError('The local backend has been shut down.')
+            job = _LocalJob(self._next_job_id, options, job_script_filename, script_args, env, os.getcwd())
+            for _, job_ids in job.dependencies:
+                for job_id in job_ids:
+                    if job_id not in self.jobs:
+                        raise RuntimeError(f'Job dependency problem: job {job_id} does not exist.')
+            self.jobs[job.job_id] = job
+            self._next_job_id += 1
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._schedule, daemon=True)
+                self._scheduler.start()
+            self._lock.notify_all()
+        return job.job_id
+
+    def scancel(self, job_id: int):
+        """Cancel all pending and running tasks of a job."""
+        with self._lock:
+            for task in self.jobs[int(job_id)].tasks:
+                self._cancel_task(task)
+            self._lock.notify_all()
+
+    def state(self, job_id: int) -> str:
+        """Get the state of a job: PENDING, RUNNING, COMPLETED, FAILED or CANCELLED."""
+        with self._lock:
+            return self.jobs[int(job_id)].state
+
+    def query_states(self, job_ids: list) -> dict[str, str]:
+        """States in the form squeue reports them (array elements as '<job id>_<task id>')."""
+        states = {}
+        with self._lock:
+            for job_id in job_ids:
+                job = self.jobs.get(int(job_id))
+                if job is None:
+                    continue
+                for task in job.tasks:
+                    if task.array_task_id is None:
+                        states[str(job.job_id)] = task.state
+                    else:
+                        states[f'{job.job_id}_{task.array_task_id}'] = task.state
+        return states
+
+    def wait(self, job_ids: Optional[list[int]] = None, timeout: Optional[float] = None) -> dict:
+        """Block until the jobs (all jobs by default) are finished. Returns their states."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            job_ids = list(self.jobs) if job_ids is None else [int(job_id) for job_id in job_ids]
+            while any(self.jobs[job_id].state not in TERMINAL_STATES for job_id in job_ids):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f'Jobs {job_ids} did not finish within {timeout} seconds.')
+                self._lock.wait(remaining)
+            return {job_id: self.jobs[job_id].state for job_id in job_ids}
+
+    def shutdown(self):
+        """Cancel everything still running, stop the scheduler and remove the shims."""
+        with self._lock:
+            self._stop.set()
+            for job in self.jobs.values():
+                for task in job.tasks:
+                    self._cancel_task(task)
+            self._lock.notify_all()
+        if self._scheduler is not None:
+            self._scheduler.join()
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+
+    def _cancel_task(self, task: _LocalTask):
+        if task.state == RUNNING:
+            try:
+                os.killpg(task.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            task.process.wait()
+        if task.state in (PENDING, RUNNING):
+            task.state = CANCELLED
+            task.end_time = time.time()
+
+    def _dependencies_status(self, job: _LocalJob) -> Optional[bool]:
+        """True if the dependencies of the job are satisfied, False if they never will be, else None."""
+        status = True
+        for condition, job_ids in job.dependencies:
+            for job_id in job_ids:
+                state = self.jobs[job_id].state
+                if state not in TERMINAL_STATES:
+                    status = None
+                elif (condition == 'afterok') and (state != COMPLETED):
+                    return False
+                elif (condition == 'afternotok') and (state == COMPLETED):
+                    return False
+        return status
+
+    def _start_task(self, task: _LocalTask):
+        job = task.job
+        env = dict(
+            job.env,
+            SLURM_JOB_ID=str(job.job_id),
+            SLURM_JOB_NAME=str(job.options.get('job-name', os.path.basename(job.job_script_filename))),
+            SLURM_NTASKS=str(job.ntasks),
+            SLURM_CPUS_PER_TASK=str(job.options.get('cpus-per-task', 1)),
+            SLURM_SUBMIT_DIR=job.cwd
+        )
+        job_id_pattern = str(job.job_id)
+        if task.array_task_id is not None:
+            array_task_ids = [t.array_task_id for t in job.tasks]
+            env.update(
+                SLURM_ARRAY_JOB_ID=str(job.job_id),
+                SLURM_ARRAY_TASK_ID=str(task.array_task_id),
+                SLURM_ARRAY_TASK_COUNT=str(len(array_task_ids)),
+                SLURM_ARRAY_TASK_MIN=str(min(array_task_ids)),
+                SLURM_ARRAY_TASK_MAX=str(max(array_task_ids))
+            )
+            job_id_pattern = f'{job.job_id}_{task.array_task_id}'
+        def expand(pattern):
+            pattern = pattern.replace('%A', str(job.job_id)).replace('%j', str(job.job_id))
+            pattern = pattern.replace('%a', str(task.array_task_id) if task.array_task_id is not None else '4294967294')
+            return os.path.join(job.cwd, pattern)
+        output_file = expand(str(job.options.get('output', f'slurm-{job_id_pattern}.out')))
+        stdout = open(output_file, 'w')
+        stderr = open(expand(str(job.options['error'])), 'w') if 'error' in job.options else subprocess.STDOUT
+        task.process = subprocess.Popen(
+            ['bash', job.job_script_filename, *job.script_args],
+            stdout=stdout,
+            stderr=stderr,
+            cwd=job.cwd,
+            env=env,
+            start_new_session=True
+        )
+        stdout.close()
+        if stderr is not subprocess.STDOUT:
+            stderr.close()
+        task.state = RUNNING
+        task.start_time = time.time()
+
+    def _schedule(self):
+        while not self._stop.is_set():
+            with self._lock:
+                if self._stop.is_set():
+                    break
+                # Collect finished tasks
+                used_slots = 0
+                for job in self.jobs.values():
+                    for task in job.tasks:
+                        if task.state == RUNNING:
+                            returncode = task.process.poll()
+                            if returncode is None:
+                                used_slots += min(job.slots, self.max_slots)
+                            else:
+                                task.returncode = returncode
+                                task.state = COMPLETED if returncode == 0 else FAILED
+                                task.end_time = time.time()
+
+                # Start pending tasks, in order of submission, while there are free slots
+                for job in self.jobs.values():
+                    if job.state not in (PENDING, RUNNING):
+                        continue
+                    ready = self._dependencies_status(job)
+                    if ready is False:
+                        for task in job.tasks:
+                            self._cancel_task(task)
+                        continue
+                    elif ready is None:
+                        continue
+                    num_running = sum(task.state == RUNNING for task in job.tasks)
+                    for task in job.tasks:
+                        if task.state != PENDING:
+                            continue
+                        if (job.throttle is not None) and (num_running >= job.throttle):
+                            break
+                        slots = min(job.slots, self.max_slots)
+                        if used_slots + slots > self.max_slots:
+                            break
+                        try:
+                            self._start_task(task)
+                        except OSError as e:
+                            # E.g. the output directory does not exist (Slurm fails the job too)
+                            print(f'Local backend: could not start job {job.job_id}: {e}')
+                            task.state = FAILED
+                            task.end_time = time.time()
+                            continue
+                        used_slots += slots
+                        num_running += 1
+                self._lock.notify_all()
+                self._lock.wait(self.poll_interval)
+
+@contextmanager
+def use_local_backend(backend: Optional[LocalBackend] = None, **kwargs):
+    """Send all sbatch/scancel calls to a LocalBackend (created with `kwargs` if not given).
+
+    The shims are also put first on this process's PATH, so that e.g. the container check of
+    EmbarrassinglyParallelJobs finds the local apptainer.
+    """
+    if backend is None:
+        backend = LocalBackend(**kwargs)
+    previous_backend = submission.get_backend()
+    previous_path = os.environ.get('PATH', '')
+    submission.set_backend(backend)
+    os.environ['PATH'] = backend.shim_dir + os.pathsep + previous_path
+    try:
+        yield backend
+    finally:
+        submission.set_backend(previous_backend)
+        os.environ['PATH'] = previous_path
+        backend.shutdown()
@@ -0,0 +1,177 @@
+"""
+FILE: monitoring.py
+PURPOSE: Read back the resource monitoring logs written by the job scripts, and recommend slurm
+args ('mem', 'cpus-per-task' and 'time') that fit what the jobs actually used.
+
+The job scripts write one log per metric and job (or array task) to the resource monitoring
+directory, named e.g. cpu-percent-run-<job id>_<array task id>.log (or with no array task id
+after the '_', for the steps of PackedJobs, which are not array tasks). Each line of a log is a
+sample: a timestamp (seconds since the epoch, or a date and time), optionally a hostname, and
+the value of the metric (the last number on the line). Only the node running the job script
+is monitored.
+
+Example
+-------
+summary, timeseries = load_resource_logs(job.resource_monitoring_dir, resolution=60)
+recommended = right_size(summary, current_slurm_args=job.main_slurm_args)
+"""
+
+import os
+import re
+import math
+from glob import glob
+from typing import Optional
+import pandas as pd
+from .utils import parse_slurm_time, format_slurm_time
+
+_log_name_pattern = re.compile(r'^(cpu|gpu)-(percent|memory)-run-(\d+)(?:_(\d*))?\.log$')
+
+def _is_number(token: str) -> bool:
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+def parse_monitor_log(file_path: str) -> pd.DataFrame:
+    """Parse a resource monitoring log into a DataFrame with columns 'time' (seconds since the
+    epoch) and 'value'. Lines without a number (e.g. headers) are skipped."""
+    timestamps, values = [], []
+    with open(file_path, 'r') as f:
+        for line in f:
+            tokens = line.replace(',', ' ').split()
+            numbers = [token for token in tokens[1:] if _is_number(token)]
+            if len(numbers) == 0:
+                continue
+            if _is_number(tokens[0]):
+                timestamp = tokens[0]
+            elif len(tokens) > 1 and ':' in tokens[1] and '-' in tokens[0]:
+                timestamp = f'{tokens[0]} {tokens[1]}'  # date and time
+            else:
+                timestamp = tokens[0]
+            timestamps.append(timestamp)
+            values.append(float(numbers[-1]))
+    if len(timestamps) == 0:
+        return pd.DataFrame({'time': pd.Series(dtype=float), 'value': pd.Series(dtype=float)})
+    if all(_is_number(t) for t in timestamps):
+        times = pd.Series(timestamps, dtype=float)
+    else:
+        # Not .astype('int64'), whose units depend on the resolution pandas picks (ns or us)
+        times = (pd.to_datetime(pd.Series(timestamps)) - pd.Timestamp(0)).dt.total_seconds()
+    return pd.DataFrame({'time': times.to_numpy(), 'value': values})
+
+def load_resource_logs(
+    resource_monitoring_dir: str,
+    resolution: float = 60.0,
+    memory_units: str = 'GB',
+    node_memory: Optional[float] = None,
+    cores_per_node: Optional[int] = None
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Aggregate the resource monitoring logs of all jobs and array tasks in a directory.
+
+    Memory is converted to GB ('memory_units' is 'GB', 'MB', or 'percent' of `node_memory` GB),
+    and cpu usage to a number of cpus (the percent is of one cpu, or of a node with
+    `cores_per_node` cpus if given).
+
+    Returns
+    -------
+    summary : pd.DataFrame
+        One row per job (or array task), indexed by (job_id, array_task_id), with the duration
+        (in seconds) and the peak and mean of each metric (e.g. cpu_percent_peak, cpu_memory_mean).
+    timeseries : pd.DataFrame
+        Columns job_id, array_task_id, metric, t (seconds since the first sample, in bins of
+        `resolution` seconds) and value (the mean over the bin).
+    """
+    if memory_units not in ('GB', 'MB', 'percent'):
+        raise ValueError(f"Invalid memory units '{memory_units}'. Must be one of 'GB', 'MB' or 'percent'.")
+    if memory_units == 'percent' and node_memory is None:
+        raise ValueError("node_memory must be given when memory_units is 'percent'.")
+    logs = []
+    for file_path in sorted(glob(os.path.join(resource_monitoring_dir, '*.log'))):
+        match = _log_name_pattern.match(os.path.basename(file_path))
+        if match is None:
+            continue
+        device, kind, job_id, array_task_id = match.groups()
+        log = parse_monitor_log(file_path)
+        if len(log) == 0:
+            continue
+        if kind == 'memory' and device == 'cpu':
+            log['value'] *= {'GB': 1.0, 'MB': 1/1024, 'percent': (node_memory or 0)/100}[memory_units]
+        elif kind == 'percent' and device == 'cpu':
+            log['value'] *= (cores_per_node or 1)/100  # number of cpus in use
+        log['job_id'] = int(job_id)
+        log['array_task_id'] = int(array_task_id) if array_task_id else -1
+        log['metric'] = f'{device}_{kind}'
+        logs.append(log)
+    columns = ['job_id', 'array_task_id', 'metric', 't', 'value']
+    if len(logs) == 0:
+        return pd.DataFrame(), pd.DataFrame(columns=columns)
+    samples = pd.concat(logs, ignore_index=True)
+
+    keys = ['job_id', 'array_task_id']
+    start = samples.groupby(keys + ['metric'])['time'].transform('min')
+    samples['t'] = ((samples['time'] - start)//resolution)*resolution
+    timeseries = samples.groupby(keys + ['metric', 't'], as_index=False)['value'].mean()[columns]
+
+    stats = samples.groupby(keys + ['metric'])['value'].agg(['max', 'mean']).unstack('metric')
+    stats.columns = [f"{metric}_{'peak' if stat == 'max' else 'mean'}" for stat, metric in stats.columns]
+    times = samples.groupby(keys + ['metric'])['time'].agg(['min', 'max'])
+    summary = stats.assign(duration=(times['max'] - times['min']).groupby(keys).max())
+    return summary[['duration'] + sorted(stats.columns)], timeseries
+
+def _format_memory(gigabytes: float) -> str:
+    if gigabytes < 1:
+        return f'{max(1, math.ceil(gigabytes*1024))}M'
+    return f'{math.ceil(gigabytes)}G'
+
+def _parse_memory(mem) -> Optional[float]:
+    """Slurm memory (e.g. '4G', '500M', or a number of MB) in GB."""
+    if mem is None:
+        return None
+    mem = str(mem).upper()
+    units = {'K': 1/1024**2, 'M': 1/1024, 'G': 1.0, 'T': 1024.0}
+    if mem[-1] in units:
+        return float(mem[:-1])*units[mem[-1]]
+    return float(mem)/1024
+
+def right_size(
+    summary: pd.DataFrame,
+    current_slurm_args: Optional[dict] = None,
+    headroom: float = 1.2,
+    time_headroom: float = 1.5,
+    quantile: float = 1.0,
+    verbose: bool = True
+) -> dict:
+    """Recommend 'mem', 'cpus-per-task' and 'time' from a summary of load_resource_logs.
+
+    Each is the `quantile` (default: the maximum) over jobs of the peak memory, the mean number
+    of cpus in use and the duration, with some headroom. The recommendations are per job (or
+    array task), so for jobs with several tasks, 'mem' is the memory of the whole job and
+    'cpus-per-task' should be divided among the tasks.
+    """
+    if len(summary) == 0:
+        raise ValueError("No resource monitoring logs to right-size from.")
+    recommended = {}
+    if 'cpu_memory_peak' in summary:
+        recommended['mem'] = _format_memory(summary['cpu_memory_peak'].quantile(quantile)*headroom)
+    if 'cpu_percent_mean' in summary:
+        recommended['cpus-per-task'] = max(1, math.ceil(summary['cpu_percent_mean'].quantile(quantile)*headroom))
+    recommended['time'] = format_slurm_time(60*max(1, math.ceil(summary['duration'].quantile(quantile)*time_headroom/60)))
+
+    if verbose:
+        current_slurm_args = current_slurm_args or {}
+        print(f'Right-sizing from {len(summary)} jobs')
+        print('------------')
+        print(f"{'':<15}{'requested':>12}{'used (peak)':>14}{'recommended':>14}")
+        if 'mem' in recommended:
+            print(f"{'mem':<15}{str(current_slurm_args.get('mem', '-')):>12}{summary['cpu_memory_peak'].max():>12.2f}GB{recommended['mem']:>14}")
+        if 'cpus-per-task' in recommended:
+            print(f"{'cpus-per-task':<15}{str(current_slurm_args.get('cpus-per-task', '-')):>12}{summary['cpu_percent_peak'].max():>14.1f}{recommended['cpus-per-task']:>14}")
+        print(f"{'time':<15}{str(current_slurm_args.get('time', '-')):>12}{format_slurm_time(summary['duration'].max()):>14}{recommended['time']:>14}")
+        requested_mem = _parse_memory(current_slurm_args.get('mem'))
+        if (requested_mem is not None) and ('cpu_memory_peak' in summary):
+            print(f"Memory used: {summary['cpu_memory_peak'].max()/requested_mem:.0%} of requested (peak)")
+        if 'time' in current_slurm_args:
+            print(f"Time used:   {summary['duration'].max()/parse_slurm_time(current_slurm_args['time']):.0%} of requested (longest job)")
+        print()
+    return recommended
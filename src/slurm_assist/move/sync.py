@@ -0,0 +1,143 @@
+"""
+FILE: sync.py
+PURPOSE: Send only the files that are new or changed since the last transfer.
+
+A manifest with the size, modification time and a fast hash of every file sent is kept in the
+destination directory, keyed by where the file is in the destination directory (see
+relative_path). On the next sync, files whose size and modification time match the
+manifest are skipped without being read. Files whose size or modification time differ are
+hashed and sent only if their content changed.
+
+The transport (where the destination is) is pluggable: LocalDirTransport for a directory on
+this machine (e.g. for tests), SSHTransport for a remote over SSH.
+"""
+
+import os
+import json
+import shlex
+import shutil
+import hashlib
+from collections import namedtuple
+from typing import Optional
+from ..utils import _path_sizes, stream_tar, parallel_stream_tar
+
+SyncResult = namedtuple('SyncResult', ['sent', 'unchanged', 'manifest'])
+
+def file_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class LocalDirTransport:
+    """The destination is a directory on this machine."""
+    def read_file(self, path: str) -> Optional[str]:
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return f.read()
+
+    def write_file(self, path: str, content: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+    def send(self, local_paths: list[str], remote_dir: str):
+        for path in local_paths:
+            destination = os.path.join(remote_dir, relative_path(path))
+            if os.path.isdir(path):
+                os.makedirs(destination, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copy2(path, destination)
+
+class SSHTransport:
+    """The destination is on a remote, reached over pooled SSH connections (see transport.py).
+    Files are streamed with tar (compressed with `codec`), over `num_streams` connections at
+    once if more than one."""
+    def __init__(self, hostname: str, username: str, key_filename: Optional[str] = None, num_streams: int = 1, retries: int = 2, codec: str = 'gzip'):
+        from ..transport import get_session
+        self.hostname, self.username, self.key_filename = hostname, username, key_filename
+        self.num_streams, self.retries, self.codec = num_streams, retries, codec
+        self.session = get_session(hostname, username, key_filename)
+
+    def read_file(self, path: str) -> Optional[str]:
+        output = self.session.run(f'cat {shlex.quote(path)}', check=False, capture_output=True, text=True)
+        return output.stdout if output.returncode == 0 else None
+
+    def write_file(self, path: str, content: str):
+        # Written to a temporary file and moved into place, so readers never see half of it
+        dir, tmp_path = shlex.quote(os.path.dirname(path) or '.'), shlex.quote(path + '.tmp')
+        self.session.run(
+            f'mkdir -p {dir} && cat > {tmp_path} && mv {tmp_path} {shlex.quote(path)}',
+            input=content, text=True
+        )
+
+    def send(self, local_paths: list[str], remote_dir: str):
+        if self.num_streams > 1:
+            parallel_stream_tar(self.hostname, self.username, self.key_filename, local_paths, remote_dir, self.num_streams, retries=self.retries, codec=self.codec)
+        else:
+            stream_tar(self.session, local_paths, remote_dir, codec=self.codec)
+
+manifest_name = '.slurm_assist_manifest.json'
+
+def relative_path(path: str) -> str:
+    """Where a local path ends up relative to the destination directory. As with tar, absolute
+    paths lose their leading '/' (and paths that start with '..' lose those components)."""
+    parts = os.path.normpath(path).split(os.sep)
+    while len(parts) > 1 and parts[0] in ('', '..'):
+        parts.pop(0)
+    return os.path.join(*parts)
+
+def sync(
+    local_paths: list[str],
+    remote_dir: str,
+    transport,
+    manifest_file: Optional[str] = None,
+    verbose: bool = True
+) -> SyncResult:
+    """Send the files in local_paths (directories are expanded) that are not in remote_dir
+    already. Returns the paths sent, the paths skipped and the new manifest.
+
+    The manifest of remote_dir is shared by all syncs to it. It is read again just before it is
+    updated, so syncs of different paths (e.g. by different array tasks) keep each other's
+    entries, unless they update it at the very same time; the files whose entries are lost are
+    then sent again on the next sync.
+    """
+    if manifest_file is None:
+        manifest_file = os.path.join(remote_dir, manifest_name)
+    content = transport.read_file(manifest_file)
+    old_manifest = json.loads(content) if content else {}
+
+    entries, to_send, unchanged = {}, [], []
+    for path, size in _path_sizes(local_paths):
+        key = relative_path(path)
+        old = old_manifest.get(key)
+        if os.path.isdir(path):  # empty directory
+            (to_send if old is None else unchanged).append(path)
+            entries[key] = dict(size=0, mtime=0, hash=None)
+            continue
+        mtime = os.stat(path).st_mtime
+        if (old is not None) and (old['size'] == size) and (old['mtime'] == mtime):
+            unchanged.append(path)
+            continue
+        entry = dict(size=size, mtime=mtime, hash=file_hash(path))
+        if (old is not None) and (old['hash'] == entry['hash']):
+            unchanged.append(path)  # touched, but the content is the same
+        else:
+            to_send.append(path)
+        entries[key] = entry
+
+    if verbose:
+        print(f"Sync to {remote_dir}: {len(to_send)} new or changed files, {len(unchanged)} unchanged.")
+    if len(to_send) > 0:
+        transport.send(to_send, remote_dir)
+    manifest = old_manifest
+    if any(old_manifest.get(key) != entry for key, entry in entries.items()):
+        content = transport.read_file(manifest_file)
+        manifest = json.loads(content) if content else {}
+        manifest.update(entries)
+        transport.write_file(manifest_file, json.dumps(manifest, indent=1, sort_keys=True))
+    return SyncResult(sent=to_send, unchanged=unchanged, manifest=manifest)
@@ -26,7 +26,12 @@ def single_run(
         {{ username }}, 
         {{ key_filename }}, 
         [local_path], 
-        {{ remote_dir }}
+        {{ remote_dir }},
+        stream={{ stream }},
+        num_streams={{ num_streams }},
+        retries={{ stream_retries }},
+        sync={{ sync }},
+        codec='{{ codec }}'
     )
     remote_path = remote_paths[0]
 """
@@ -40,7 +45,12 @@ class MoveFilesParallelJobs(EmbarrassinglyParallelJobs):
             hostname=config['hostname'],
             username=config['username'],
             key_filename=config['key_filename'],
-            remote_dir=config['remote_dir']
+            remote_dir=config['remote_dir'],
+            stream=config.get('stream', False),
+            num_streams=config.get('num_streams', 1),
+            stream_retries=config.get('stream_retries', 2),
+            sync=config.get('sync', False),
+            codec=config.get('codec', 'gzip')
         ))
 
         single_run_path = os.path.abspath(self._write_single_run_python_script(config))
@@ -0,0 +1,120 @@
+"""
+FILE: launcher.py
+PURPOSE: Run the packed jobs of a PackedJobs allocation, as many at a time as fit on its cpus.
+
+Each job is launched as its own job step (srun --exclusive) when running under Slurm, with its
+own cpus and memory. Jobs are started longest first (by their time limit), and a job that does
+not fit yet (in the free cpus and, if the allocation's memory is known, the free memory) does
+not keep smaller ones behind it from starting. Only uses the standard library, so it can run with the
+system python3.
+"""
+
+import os
+import json
+import shutil
+import subprocess
+import threading
+import time
+from typing import Optional
+
+def main(manifest_file: str, exit_codes_dir: str, num_slots: int, use_srun: bool, total_mem: Optional[int] = None):
+    """Run the jobs listed in the manifest.
+
+    Jobs without memory ('mem', in MB) in the manifest get a share of `total_mem` (the
+    allocation's memory in MB, if known) proportional to their cpus.
+
+    Writes an "index exit_code start end" line for each finished job to 
+    `exit_codes_dir`/packed-<job id>.exit_codes.
+    """
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+    jobs = manifest['jobs']
+    job_id = os.environ.get('SLURM_JOB_ID', 'local')
+    exit_codes_file = os.path.join(exit_codes_dir, f'packed-{job_id}.exit_codes')
+    for job in jobs:
+        if job['slots'] > num_slots:
+            raise ValueError(f"Job {job['index']} needs {job['slots']} cpus, but the allocation only has {num_slots}.")
+        if (job.get('mem') is None) and (total_mem is not None):
+            job['mem'] = total_mem*job['slots']//num_slots
+        if (job.get('mem') is not None) and (total_mem is not None) and (job['mem'] > total_mem):
+            raise ValueError(f"Job {job['index']} needs {job['mem']}M of memory, but the allocation only has {total_mem}M.")
+
+    pending = sorted(jobs, key=lambda job: -job['time'])  # longest first
+    free_slots, free_mem = num_slots, total_mem
+    fits = lambda job: (job['slots'] <= free_slots) and ((total_mem is None) or (job.get('mem') is None) or (job['mem'] <= free_mem))
+    exit_codes = {}
+    lock = threading.Condition()
+    exit_codes_f = open(exit_codes_file, 'a')
+
+    def run(job):
+        nonlocal free_slots, free_mem
+        argv = ['bash', job['job_script'], *job['script_args']]
+        if use_srun:
+            # Without --mem, a step may be given all of the allocation's memory and keep the
+            # other steps from starting
+            mem = [f"--mem={job['mem']}M"] if job.get('mem') is not None else []
+            argv = ['srun', '--exclusive', '--nodes=1', '--ntasks=1', f"--cpus-per-task={job['slots']}", *mem, *argv]
+        env = dict(os.environ, SLURM_ARRAY_TASK_ID=str(job['index']))
+        stdout_file = os.path.join(manifest['stdout_dir'], f"slurm-{job_id}_{job['index']}.out")
+        start = time.time()
+        with open(stdout_file, 'w') as stdout:
+            returncode = subprocess.run(argv, stdout=stdout, stderr=subprocess.STDOUT, env=env).returncode
+        with lock:
+            exit_codes[job['index']] = returncode
+            exit_codes_f.write(f"{job['index']} {returncode} {start:.3f} {time.time():.3f}\n")
+            exit_codes_f.flush()
+            free_slots += job['slots']
+            if (total_mem is not None) and (job.get('mem') is not None):
+                free_mem += job['mem']
+            lock.notify_all()
+
+    threads = []
+    with lock:
+        while len(pending) > 0:
+            for job in list(pending):
+                if fits(job):
+                    pending.remove(job)
+                    free_slots -= job['slots']
+                    if (total_mem is not None) and (job.get('mem') is not None):
+                        free_mem -= job['mem']
+                    thread = threading.Thread(target=run, args=(job,))
+                    thread.start()
+                    threads.append(thread)
+            if len(pending) > 0:
+                lock.wait()
+    for thread in threads:
+        thread.join()
+    exit_codes_f.close()
+
+    num_failed = sum(code != 0 for code in exit_codes.values())
+    print(f'Ran {len(jobs)} packed jobs on {num_slots} cpus: {len(jobs) - num_failed} succeeded, {num_failed} failed')
+    return num_failed
+
+
+if __name__=='__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest-file', '--manifest_file', type=str)
+    parser.add_argument('--exit-codes-dir', '--exit_codes_dir', type=str)
+    parser.add_argument('--num-slots', '--num_slots', type=int, help="Number of cpus to pack the jobs onto (default: all cpus of the allocation).")
+    parser.add_argument('--total-mem', '--total_mem', type=int, help="Memory (in MB) of the allocation (default: from SLURM_MEM_PER_NODE or SLURM_MEM_PER_CPU, if set).")
+    parser.add_argument('--launcher', type=str, default='auto', help="'srun' (one job step per job), 'local', or 'auto' (srun if in a Slurm allocation).")
+    args = parser.parse_args()
+
+    num_slots = args.num_slots
+    if num_slots is None:
+        num_slots = int(os.environ.get('SLURM_NTASKS', 1))*int(os.environ.get('SLURM_CPUS_PER_TASK', 1))
+    total_mem = args.total_mem
+    if (total_mem is None) and ('SLURM_MEM_PER_NODE' in os.environ):
+        total_mem = int(os.environ['SLURM_MEM_PER_NODE'])
+    elif (total_mem is None) and ('SLURM_MEM_PER_CPU' in os.environ):
+        total_mem = int(os.environ['SLURM_MEM_PER_CPU'])*num_slots
+    if args.launcher == 'auto':
+        use_srun = ('SLURM_JOB_ID' in os.environ) and (shutil.which('srun') is not None)
+    elif args.launcher in ('srun', 'local'):
+        use_srun = args.launcher == 'srun'
+    else:
+        raise ValueError(f"Invalid launcher '{args.launcher}'. Must be one of 'auto', 'srun' or 'local'.")
+    num_failed = main(args.manifest_file, args.exit_codes_dir, num_slots, use_srun, total_mem)
+    sys.exit(1 if num_failed > 0 else 0)
@@ -0,0 +1,257 @@
+import os
+import json
+import subprocess
+from typing import Union, Optional
+from . import launcher
+from ..job import JobGroup
+from ..single.top_level_interface import SingleJob, script_template_content as single_script_template_content
+from ..utils import (
+    remove_and_make_dir,
+    submit_slurm_job,
+    write_job_script,
+    write_temp_file,
+    parse_slurm_time,
+    format_slurm_time,
+    parse_slurm_memory
+)
+
+Config = Union[str, dict, list[Union[str, dict, None]]]
+launcher_python_script = os.path.abspath(launcher.__file__)
+
+launcher_script_template_content = \
+"""#!/bin/bash -l
+
+#SBATCH --output={{ stdout_dir }}/slurm-%j.out
+
+module purge
+
+# Run the packed jobs (the launcher arguments are passed to this script)
+python3 {{ launcher }} "$@"
+"""
+
+# Slurm args that may differ between packed jobs (the rest must match)
+per_job_slurm_keys = ('job-name', 'time', 'output', 'error', 'ntasks', 'cpus-per-task', 'mem', 'mem-per-cpu')
+
+def _max_concurrent_total(amounts: list[int], cpus: list[int], num_cpus: int) -> int:
+    """Upper bound on the total of `amounts` over jobs that can run at once on num_cpus cpus
+    (the fractional knapsack: the jobs with the most per cpu first)."""
+    total, free = 0.0, num_cpus
+    for amount, c in sorted(zip(amounts, cpus), key=lambda job: -job[0]/job[1]):
+        if free <= 0:
+            break
+        fraction = min(1.0, free/c)
+        total += fraction*amount
+        free -= fraction*c
+    return int(-(-total // 1))
+
+class PackedJobs(JobGroup):
+    """Runs many small SingleJobs inside one Slurm allocation.
+
+    The jobs are given as SingleJobs or SingleJob configs (configs are merged with `config`,
+    with the job's own fields taking precedence). A launcher in the allocation runs them as
+    their own job steps, as many at a time as fit on the allocation's cpus (a job uses its
+    ntasks*cpus-per-task cpus). The stdout of job k goes to slurm-<job id>_<k>.out, and its exit
+    code can be read with `exit_codes()`.
+
+    Jobs that set 'mem' or 'mem-per-cpu' get that memory for their job step, and are only
+    started when it is free; either all jobs or none of them must set it. Jobs that do not get
+    a share of the allocation's memory proportional to their cpus.
+
+    The allocation's slurm args are `config['slurm_args']`. By default, they are the slurm
+    args shared by the jobs, with 'ntasks' = `config['max_cpus']` (default 16, or fewer if the
+    jobs need fewer), 'mem' = the most memory the jobs can use at once on those cpus (if the
+    jobs set their memory), and a time limit that the launcher's packing cannot exceed
+    (unless too little memory keeps jobs waiting while cpus are free).
+    """
+    def __init__(
+        self,
+        jobs: list[Union[SingleJob, Config]],
+        config: Optional[Config] = None
+    ):
+        super().__init__(config)
+        if len(jobs) == 0:
+            raise ValueError("No jobs to pack.")
+        # Fields shared by all jobs (the allocation's own settings are not passed on)
+        shared_config = {k: v for k, v in self.items() if k not in ('slurm_args', 'max_cpus')}
+        self.jobs = []
+        for job in jobs:
+            if not isinstance(job, SingleJob):
+                job = SingleJob([shared_config, job] if isinstance(job, (str, dict)) else [shared_config, *job])
+            self.jobs.append(job)
+        self.check_jobs_are_compatible()
+        self.job_id = None
+
+    def check_jobs_are_compatible(self):
+        shared = lambda job: {k: v for k, v in job['slurm_args'].items() if k not in per_job_slurm_keys}
+        for k, job in enumerate(self.jobs):
+            if shared(job) != shared(self.jobs[0]):
+                raise ValueError(f"Job {k} has incompatible slurm args ({shared(job)}, expected {shared(self.jobs[0])}). Only {per_job_slurm_keys} may differ.")
+            if 'array' in job['slurm_args']:
+                raise ValueError(f"Job {k} is an array job, which cannot be packed.")
+        for k, cpus in enumerate(self.job_cpus):
+            if cpus > self.num_cpus:
+                raise ValueError(f"Job {k} needs {cpus} cpus, but the allocation only has {self.num_cpus}.")
+        mems = self.job_mems
+        if any(mem is None for mem in mems) and any(mem is not None for mem in mems):
+            k = mems.index(None)
+            raise ValueError(f"Job {k} sets neither 'mem' nor 'mem-per-cpu', but other jobs do. Either all packed jobs or none must set their memory.")
+
+    @property
+    def job_cpus(self) -> list[int]:
+        return [int(job['slurm_args'].get('ntasks', 1))*int(job['slurm_args'].get('cpus-per-task', 1)) for job in self.jobs]
+
+    @property
+    def job_times(self) -> list[int]:
+        return [parse_slurm_time(job['slurm_args'].get('time', '01:00:00')) for job in self.jobs]
+
+    @property
+    def job_mems(self) -> list[Optional[int]]:
+        """Memory of each job in MB (None if it sets neither 'mem' nor 'mem-per-cpu')."""
+        mems = []
+        for job, cpus in zip(self.jobs, self.job_cpus):
+            if 'mem' in job['slurm_args']:
+                mems.append(parse_slurm_memory(job['slurm_args']['mem']))
+            elif 'mem-per-cpu' in job['slurm_args']:
+                mems.append(parse_slurm_memory(job['slurm_args']['mem-per-cpu'])*cpus)
+            else:
+                mems.append(None)
+        return mems
+
+    @property
+    def num_cpus(self) -> int:
+        if 'slurm_args' in self.keys() and 'ntasks' in self['slurm_args']:
+            return int(self['slurm_args']['ntasks'])*int(self['slurm_args'].get('cpus-per-task', 1))
+        return min(int(self.get('max_cpus', 16)), sum(self.job_cpus))
+
+    @property
+    def slurm_args(self) -> dict:
+        if 'slurm_args' in self.keys():
+            slurm_args = dict(self['slurm_args'])
+        else:
+            slurm_args = {k: v for k, v in self.jobs[0]['slurm_args'].items() if k not in per_job_slurm_keys}
+            slurm_args['ntasks'] = self.num_cpus
+            if self.job_mems[0] is not None:
+                slurm_args['mem'] = f'{_max_concurrent_total(self.job_mems, self.job_cpus, self.num_cpus)}M'
+        slurm_args.setdefault('job-name', 'packed')
+        if 'time' not in slurm_args:
+            # While a job waits, none of the waiting jobs fit, so more than num_cpus - (most cpus
+            # of a job) cpus are busy. So the last job starts within (total cpu time)/(num_cpus -
+            # most cpus of a job + 1), and finishes at most the longest job later.
+            cpu_time = sum(t*c for t, c in zip(self.job_times, self.job_cpus))
+            slurm_args['time'] = format_slurm_time(cpu_time/(self.num_cpus - max(self.job_cpus) + 1) + max(self.job_times))
+        return slurm_args
+
+    @property
+    def tmp_dir(self):
+        if 'tmp' in self.keys():
+            return self['tmp']
+        else:
+            return 'tmp'
+
+    @property
+    def job_scripts_dir(self):
+        if 'job_scripts_dir' in self.keys():
+            return self['job_scripts_dir']
+        else:
+            return os.path.join('.slurm_assist', 'job_scripts')
+
+    @property
+    def log_dir(self):
+        if 'log_dir' in self.keys():
+            return os.path.relpath(self['log_dir'])
+        else:
+            return 'logs'
+
+    @property
+    def stdout_dir(self):
+        return os.path.join(self.log_dir, 'stdout')
+
+    @property
+    def exit_codes_file(self):
+        return os.path.join(self.log_dir, f'packed-{self.job_id}.exit_codes')
+
+    @property
+    def stdout_files(self) -> list[str]:
+        return [os.path.join(self.stdout_dir, f'slurm-{self.job_id}_{k}.out') for k in range(len(self.jobs))]
+
+    def setup(self, clear_directories: Optional[bool] = True):
+        if clear_directories:
+            remove_and_make_dir(self.tmp_dir)
+        else:
+            os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(self.job_scripts_dir, exist_ok=True)
+        os.makedirs(self.stdout_dir, exist_ok=True)
+        for job in self.jobs:
+            job.setup(clear_directories=False)
+
+    def _write_manifest(self) -> str:
+        jobs = []
+        for k, job in enumerate(self.jobs):
+            # Rendered as an array job, so that the resource monitoring logs of job k are named
+            # after SLURM_ARRAY_TASK_ID=k (set by the launcher)
+            job_script = write_job_script(single_script_template_content, job.job_scripts_dir, **dict(job._script_render_args, is_array_job=True))
+            jobs.append(dict(
+                index=k,
+                job_script=os.path.abspath(job_script),
+                script_args=job.script_args,
+                slots=self.job_cpus[k],
+                mem=self.job_mems[k],
+                time=self.job_times[k]
+            ))
+        manifest = dict(stdout_dir=os.path.abspath(self.stdout_dir), jobs=jobs)
+        return write_temp_file(json.dumps(manifest), dir=self.tmp_dir, prefix='packed_manifest_')
+
+    def submit(
+        self,
+        dependency_ids: Optional[list[list[int]]] = None,
+        dependency_conditions: Optional[list[str]] = None,
+        clear_directories: Optional[bool] = True,
+        verbose: Optional[bool] = True
+    ) -> tuple[int]:
+        self.setup(clear_directories=clear_directories)
+        manifest_file = self._write_manifest()
+        job_script_filename = write_job_script(
+            launcher_script_template_content, self.job_scripts_dir,
+            launcher=launcher_python_script,
+            stdout_dir=self.stdout_dir
+        )
+
+        if verbose:
+            print()
+            print(' -------------')
+            print('| PACKED JOBS |')
+            print(' -------------')
+
+        self.job_id = submit_slurm_job(
+            slurm_args=self.slurm_args,
+            job_script_filename=job_script_filename,
+            dependency_ids=dependency_ids,
+            dependency_conditions=dependency_conditions,
+            script_args=[f'--manifest-file={os.path.abspath(manifest_file)}', f'--exit-codes-dir={os.path.abspath(self.log_dir)}'],
+            verbose=verbose
+        )
+        self.all_job_ids.append(self.job_id)
+
+        if verbose:
+            print(f"Diagnostics")
+            print(f"-----------")
+            print(f"Number of packed jobs:          {len(self.jobs)} (on {self.num_cpus} cpus)")
+            print(f"Standard output/error files:    {os.path.abspath(self.stdout_dir)}/slurm-{self.job_id}_*.out")
+            print(f"Exit codes:                     {os.path.abspath(self.exit_codes_file)}")
+            print()
+
+        return (self.job_id,)
+
+    def exit_codes(self) -> list[Optional[int]]:
+        """Exit code of each packed job (None if it has not finished)."""
+        exit_codes = [None]*len(self.jobs)
+        if os.path.exists(self.exit_codes_file):
+            with open(self.exit_codes_file, 'r') as f:
+                for line in f:
+                    index, returncode = line.split()[:2]
+                    exit_codes[int(index)] = int(returncode)
+        return exit_codes
+
+    def cancel(self):
+        super().cancel()
+        subprocess.run(["rm", "-rf", self.tmp_dir])
@@ -0,0 +1,325 @@
+"""
+FILE: planning.py
+PURPOSE: Estimate how long a job group will take to finish, without submitting anything.
+
+The job group (SingleJob, EmbarrassinglyParallelJobs, PackedJobs, SerialJobs or JobGraph,
+nested in any way) is walked and its jobs are simulated many times (Monte Carlo), with
+runtimes and queue waits drawn from given distributions. This accounts for the split and merge
+jobs, array throttling, serial stages and the variance of the per-item runtimes, unlike
+utils.estimate_total_time.
+
+Example
+-------
+plan = simulate(
+    job,
+    runtimes={'split': 60, 'run': lognormal(median=180, sigma=0.5), 'merge': uniform(60, 120)},
+    queue_wait=exponential(mean=300),
+    num_runs=100000
+)
+plan.summary()
+"""
+
+import heapq
+import math
+import random
+import statistics
+from collections import Counter
+from copy import deepcopy
+from typing import Callable, Optional, Union
+from .job import JobGroup
+from .utils import parse_slurm_time, parse_slurm_array
+
+# A distribution takes a random number generator and returns a duration (in seconds)
+Distribution = Callable[[random.Random], float]
+
+def constant(seconds: float) -> Distribution:
+    return lambda rng: seconds
+
+def uniform(low: float, high: float) -> Distribution:
+    return lambda rng: rng.uniform(low, high)
+
+def normal(mean: float, std: float) -> Distribution:
+    """Normal distribution, truncated at zero."""
+    return lambda rng: max(0.0, rng.gauss(mean, std))
+
+def lognormal(median: float, sigma: float) -> Distribution:
+    return lambda rng: rng.lognormvariate(math.log(median), sigma)
+
+def exponential(mean: float) -> Distribution:
+    return lambda rng: rng.expovariate(1/mean) if mean > 0 else 0.0
+
+def empirical(samples: list[float]) -> Distribution:
+    """Resample measured durations (e.g. from resource monitoring logs of earlier runs)."""
+    samples = list(samples)
+    return lambda rng: rng.choice(samples)
+
+def _as_distribution(dist: Union[Distribution, float, int]) -> Distribution:
+    return constant(float(dist)) if isinstance(dist, (int, float)) else dist
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q*len(sorted_values)))]
+
+def _format_duration(seconds: float) -> str:
+    hours, rest = divmod(seconds, 3600)
+    return f'{hours:.0f}h {rest//60:02.0f}m {rest % 60:02.0f}s'
+
+class Plan:
+    """Results of a simulation: the makespan of each trial, the duration of each stage and
+    the cpu hours used (both per trial), how often each path of a JobGraph was critical, and 
+    how many jobs of each stage ran past their time limit."""
+    def __init__(self):
+        self.makespans = []
+        self.cpu_hours = []
+        self.stage_durations = {}
+        self.critical_paths = Counter()
+        self.timeouts = Counter()
+
+    def percentile(self, q: float) -> float:
+        return _percentile(sorted(self.makespans), q)
+
+    @property
+    def mean(self) -> float:
+        return statistics.mean(self.makespans)
+
+    def summary(self):
+        print(f'Makespan ({len(self.makespans)} trials)')
+        print('--------')
+        print(f'mean: {_format_duration(self.mean)}')
+        for q in (0.5, 0.9, 0.99):
+            print(f'p{int(q*100):<3} {_format_duration(self.percentile(q))}')
+        print(f'cpu hours (mean): {statistics.mean(self.cpu_hours):.1f}')
+        print()
+        print('Stages (mean duration, including queue waits)')
+        print('------')
+        for name, durations in self.stage_durations.items():
+            print(f'{name:<30} {_format_duration(statistics.mean(durations))}')
+        if len(self.critical_paths) > 0:
+            print()
+            print('Critical paths')
+            print('--------------')
+            for path, count in self.critical_paths.most_common(5):
+                print(f"{count/len(self.makespans):6.1%}  {' -> '.join(path)}")
+        if len(self.timeouts) > 0:
+            print()
+            print('Jobs past their time limit (per trial)')
+            print('--------------------------')
+            for name, count in self.timeouts.items():
+                print(f'{name:<30} {count/len(self.makespans):.2f}')
+
+class _Trial:
+    """State of a single simulated trial."""
+    def __init__(self, runtimes: dict, queue_wait: Distribution, num_runs, rng: random.Random, sum_approximations: dict):
+        self.runtimes = runtimes
+        self.queue_wait = queue_wait
+        self.num_runs = num_runs
+        self.rng = rng
+        self.stage_durations = {}
+        self.cpu_seconds = 0.0
+        self.critical_path = None
+        self.timeouts = Counter()
+        self._sum_approximations = sum_approximations  # shared by the trials
+
+    def runtime(self, *names: str) -> Distribution:
+        """The runtime distribution of the first of `names` found in the runtimes."""
+        for name in names:
+            if name in self.runtimes:
+                return self.runtimes[name]
+        raise ValueError(f"No runtime distribution given for any of {names}.")
+
+    def sample_sum(self, dist: Distribution, n: int) -> float:
+        """Sample the sum of n draws (approximated by a normal distribution for large n)."""
+        if n <= 200:
+            return sum(dist(self.rng) for _ in range(n))
+        if id(dist) not in self._sum_approximations:
+            pilot = [dist(self.rng) for _ in range(2000)]
+            self._sum_approximations[id(dist)] = (statistics.mean(pilot), statistics.pstdev(pilot))
+        mean, std = self._sum_approximations[id(dist)]
+        return max(0.0, self.rng.gauss(n*mean, math.sqrt(n)*std))
+
+    def record(self, name: str, start: float, end: float):
+        self.stage_durations[name] = end - start
+
+    def job(self, eligible: float, runtime: float, slurm_args: dict, name: str) -> float:
+        """Simulate one job becoming eligible to run at `eligible`. Returns its end time.
+
+        A job that runs past its time limit is counted (it is assumed to run to completion).
+        """
+        if ('time' in slurm_args) and (runtime > parse_slurm_time(slurm_args['time'])):
+            self.timeouts[name] += 1
+        self.cpu_seconds += runtime*_cpus(slurm_args)
+        return eligible + self.queue_wait(self.rng) + runtime
+
+def _cpus(slurm_args: dict) -> int:
+    ntasks = slurm_args.get('ntasks')
+    return (int(ntasks) if ntasks is not None else 1)*int(slurm_args.get('cpus-per-task', 1))
+
+def _simulate_single(job, start: float, trial: _Trial, label: str) -> float:
+    runtime = trial.runtime(label, job['slurm_args'].get('job-name', 'single'), 'single')(trial.rng)
+    end = trial.job(start, runtime, job['slurm_args'], label)
+    trial.record(label, start, end)
+    return end
+
+def _simulate_embarrassingly_parallel(job, start: float, trial: _Trial, label: str) -> float:
+    suffix = job.suffix
+    names = lambda stage: ((f'{stage}_{suffix}',) if suffix is not None else ()) + (stage,)
+
+    # Split
+    split_end = trial.job(start, trial.runtime(*names('split'))(trial.rng), job.split_slurm_args, f'{label}/split')
+    trial.record(f'{label}/split', start, split_end)
+
+    # Main: each array task runs its share of the items (one share per task for each rank)
+    num_runs = trial.num_runs.get(label, trial.num_runs.get('*')) if isinstance(trial.num_runs, dict) else trial.num_runs
+    if num_runs is None:
+        raise ValueError(f"num_runs must be given to simulate '{label}'.")
+    run_dist = trial.runtime(*names('run'))
+    ntasks = job.main_slurm_args['ntasks'] or 1
+    num_tasks = job.array_size
+    num_ranks = num_tasks*ntasks
+    chunks = job.array_chunks
+    target_concurrency = job.target_concurrency
+    if (target_concurrency is not None) and (len(chunks) > 1):
+        # Each chunk waits for the previous one to finish (see submit_main)
+        chunk_sizes = [len(parse_slurm_array(chunk.partition('%')[0])) for chunk, _ in chunks]
+    else:
+        chunk_sizes = [num_tasks]
+    concurrency = target_concurrency if target_concurrency is not None else num_tasks
+    schedule = job.get('schedule', 'static')
+    task, main_end = 0, split_end
+    for chunk_size in chunk_sizes:
+        slots = [main_end]*min(concurrency, chunk_size)  # times at which a throttle slot frees up
+        for _ in range(chunk_size):
+            rank_items = [num_runs//num_ranks + (task*ntasks + k < num_runs % num_ranks) for k in range(ntasks)]
+            if schedule == 'static':
+                runtime = max(trial.sample_sum(run_dist, n) for n in rank_items)
+            else:
+                # The ranks share the task's items
+                runtime = trial.sample_sum(run_dist, sum(rank_items))/ntasks
+            task_end = trial.job(heapq.heappop(slots), runtime, job.main_slurm_args, f'{label}/main')
+            heapq.heappush(slots, task_end)
+            main_end = max(main_end, task_end)
+            task += 1
+    trial.record(f'{label}/main', split_end, main_end)
+
+    # Merge (each level of a merge tree runs after the previous one)
+    fan_in = job.get('merge_fan_in')
+    num_inputs = num_ranks
+    merge_dist = trial.runtime(*names('merge'))
+    merge_end = main_end
+    while fan_in is not None and num_inputs > fan_in:
+        num_inputs = -(-num_inputs // fan_in)
+        merge_end = max(trial.job(merge_end, merge_dist(trial.rng), job.merge_slurm_args, f'{label}/merge') for _ in range(num_inputs))
+    merge_end = trial.job(merge_end, merge_dist(trial.rng), job.merge_slurm_args, f'{label}/merge')
+    trial.record(f'{label}/merge', main_end, merge_end)
+    return merge_end
+
+def _simulate_packed(job, start: float, trial: _Trial, label: str) -> float:
+    # Mirrors the launcher: longest (by time limit) first, starting every job that fits
+    runtimes = [
+        trial.runtime(f'{label}/{k}', packed_job['slurm_args'].get('job-name', 'single'), 'single')(trial.rng)
+        for k, packed_job in enumerate(job.jobs)
+    ]
+    pending = sorted(range(len(job.jobs)), key=lambda k: -job.job_times[k])
+    free, now, running = job.num_cpus, 0.0, []
+    while len(pending) > 0:
+        for k in list(pending):
+            if job.job_cpus[k] <= free:
+                pending.remove(k)
+                free -= job.job_cpus[k]
+                heapq.heappush(running, (now + runtimes[k], k))
+        if len(pending) > 0:
+            now, k = heapq.heappop(running)
+            free += job.job_cpus[k]
+    runtime = max([now] + [end for end, _ in running])
+    for k, packed_job in enumerate(job.jobs):
+        if ('time' in packed_job['slurm_args']) and (runtimes[k] > job.job_times[k]):
+            trial.timeouts[f'{label}/{k}'] += 1
+    end = trial.job(start, runtime, job.slurm_args, label)
+    trial.record(label, start, end)
+    return end
+
+def _serial_job_groups(job) -> list[JobGroup]:
+    """The job groups of SerialJobs(WithState), generated from a copy of its state."""
+    state = deepcopy(job.config_gen_state)
+    job_groups = []
+    for config_gen_fn, job_group_gen_fn in zip(job.config_gen_fns, job.job_group_gen_fns):
+        config, state = config_gen_fn(job.global_config, state)
+        job_group, state = job_group_gen_fn(config, state)
+        job_groups.append(job_group)
+    return job_groups
+
+def _simulate_graph(job, start: float, trial: _Trial, label: str) -> float:
+    ends, critical_parent = {}, {}
+    for name in job.topological_order():
+        node_start, critical_parent[name] = start, None
+        for upstream, _ in job.upstream(name):
+            if ends[upstream] > node_start:
+                node_start, critical_parent[name] = ends[upstream], upstream
+        ends[name] = _simulate(job.nodes[name], node_start, trial, f'{label}/{name}' if label else name)
+    last = max(ends, key=ends.get)
+    path = [last]
+    while critical_parent[path[-1]] is not None:
+        path.append(critical_parent[path[-1]])
+    trial.critical_path = tuple(reversed(path))
+    return ends[last]
+
+def _simulate(job: JobGroup, start: float, trial: _Trial, label: str) -> float:
+    """Simulate a job group whose first job is submitted at `start`. Returns its end time."""
+    # Imported here to avoid circular imports
+    from .single.top_level_interface import SingleJob
+    from .embarrassingly_parallel.top_level_interface import EmbarrassinglyParallelJobs
+    from .packed.top_level_interface import PackedJobs
+    from .serial.top_level_interface import SerialJobsWithState
+    from .graph.top_level_interface import JobGraph
+    if isinstance(job, SingleJob):
+        return _simulate_single(job, start, trial, label or 'single')
+    if isinstance(job, EmbarrassinglyParallelJobs):
+        return _simulate_embarrassingly_parallel(job, start, trial, label or 'parallel')
+    if isinstance(job, PackedJobs):
+        return _simulate_packed(job, start, trial, label or 'packed')
+    if isinstance(job, SerialJobsWithState):
+        end = start
+        for k, job_group in enumerate(_serial_job_groups(job)):
+            end = _simulate(job_group, end, trial, f'{label}/{k}' if label else str(k))
+        return end
+    if isinstance(job, JobGraph):
+        return _simulate_graph(job, start, trial, label)
+    raise ValueError(f"Cannot simulate job group of type {type(job).__name__}.")
+
+def simulate(
+    job: JobGroup,
+    runtimes: dict[str, Union[Distribution, float]],
+    queue_wait: Union[Distribution, float] = 0.0,
+    num_runs: Optional[Union[int, dict[str, int]]] = None,
+    num_trials: int = 1000,
+    seed: Optional[int] = None
+) -> Plan:
+    """Estimate the makespan of a job group by Monte Carlo simulation (nothing is submitted).
+
+    Parameters
+    ----------
+    runtimes : dict
+        Runtime distributions (or constant runtimes, in seconds), by stage. For
+        EmbarrassinglyParallelJobs, the stages are 'split', 'run' (a single item) and 'merge'
+        (or e.g. 'run_<job_name_suffix>', to tell jobs apart). A SingleJob uses its label
+        (e.g. 'a' for node 'a' of a JobGraph), its job name or 'single', in that order.
+    queue_wait : Distribution or float
+        Time each job (and each array task) waits in the queue once it is eligible to run.
+    num_runs : int or dict
+        Number of items processed by the EmbarrassinglyParallelJobs, or a dict of them by
+        label (e.g. '0' for the first job group of a SerialJobs; '*' for the default).
+    """
+    runtimes = {name: _as_distribution(dist) for name, dist in runtimes.items()}
+    queue_wait = _as_distribution(queue_wait)
+    rng = random.Random(seed)
+    plan = Plan()
+    sum_approximations = {}
+    for _ in range(num_trials):
+        trial = _Trial(runtimes, queue_wait, num_runs, rng, sum_approximations)
+        plan.makespans.append(_simulate(job, 0.0, trial, ''))
+        plan.cpu_hours.append(trial.cpu_seconds/3600)
+        for name, duration in trial.stage_durations.items():
+            plan.stage_durations.setdefault(name, []).append(duration)
+        if trial.critical_path is not None:
+            plan.critical_paths[trial.critical_path] += 1
+        plan.timeouts.update(trial.timeouts)
+    return plan
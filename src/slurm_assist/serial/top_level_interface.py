@@ -77,7 +77,8 @@ class SerialJobsWithState(JobGroup):
         job_ids = job_group_i.submit(dependency_ids=dep[0], dependency_conditions=dep[1])
         self.job_groups.append(job_group_i)
         self.i_submit += 1
-        for id in job_ids:
+        # Job groups that track all of their jobs (e.g. every merge job) report more than job_ids
+        for id in (job_group_i.all_job_ids or job_ids):
             self.all_job_ids.append(id)
         self.last_job_ids = job_ids
 
@@ -3,7 +3,7 @@ from typing import Union, Optional
 from jinja2 import Template
 import subprocess
 from ..job import JobGroup
-from ..utils import check_has_keys, remove_and_make_dir, submit_slurm_job, cancel_slurm_job, write_temp_file
+from ..utils import check_has_keys, remove_and_make_dir, submit_slurm_job, cancel_slurm_job, write_job_script
 
 script_template_content = \
 """#!/bin/bash -l
@@ -32,18 +32,16 @@ monitor gpu memory > {{ resource_monitoring_dir }}/gpu-memory-run-$SLURM_JOB_ID{
 GPU_MEM_PID=$!
 {% endif %}
 
-# Run computations
-apptainer run {{ container_image }} {{ program }} \
-{% for key, value in program_args.items() if value is not none %}\
-{% if value is boolean and value %}--{{ key }} \
-{% elif value is not boolean %}--{{ key }}=\"{{ value }}\" \
-{% endif %}{% endfor %}
+# Run computations (the program arguments are passed to this script)
+apptainer run {{ container_image }} {{ program }} "$@"
+EXIT_CODE=$?
 
 # Shut down the resource monitors
 kill -s INT $CPU_USAGE_PID $CPU_MEM_PID
 {% if use_gpu %}
 kill -s INT $GPU_USAGE_PID $GPU_MEM_PID
 {% endif %}
+exit $EXIT_CODE
 """
 script_template = Template(script_template_content)
 
@@ -55,19 +53,35 @@ class SingleJob(JobGroup):
     ):
         super().__init__(config)
         self.check_config_is_valid()
+        self.job_id = None
+    
+    def check_config_is_valid(self):
+        check_has_keys(self, required_keys=['slurm_args', 'program', 'program_args', 'container_image'])
 
-        self.job_script = script_template.render(dict(
+    @property
+    def _script_render_args(self):
+        return dict(
             container_image=self['container_image'],
             program=self['program'],
-            program_args=self['program_args'],
             stdout_dir=self.stdout_dir,
             resource_monitoring_dir=self.resource_monitoring_dir,
             is_array_job = 'array' in self['slurm_args'].keys()
-        ))
-        self.job_id = None
-    
-    def check_config_is_valid(self):
-        check_has_keys(self, required_keys=['slurm_args', 'program', 'program_args', 'container_image'])
+        )
+
+    @property
+    def job_script(self):
+        return script_template.render(self._script_render_args)
+
+    @property
+    def script_args(self) -> list[str]:
+        """The program arguments, as passed to the job script."""
+        args = []
+        for key, value in self['program_args'].items():
+            if value is True:
+                args.append(f'--{key}')
+            elif (value is not None) and (value is not False):
+                args.append(f'--{key}={value}')
+        return args
     
     @property
     def tmp_dir(self):
@@ -78,7 +92,12 @@ class SingleJob(JobGroup):
     
     @property
     def job_scripts_dir(self):
-        return os.path.join(self.tmp_dir, 'job_scripts')
+        # Kept outside of tmp_dir, so the scripts survive clearing it and can be reused (scripts
+        # unused for a while are removed, see utils.prune_job_scripts)
+        if 'job_scripts_dir' in self.keys():
+            return self['job_scripts_dir']
+        else:
+            return os.path.join('.slurm_assist', 'job_scripts')
     
     @property
     def log_dir(self):
@@ -95,8 +114,8 @@ class SingleJob(JobGroup):
     def stdout_dir(self):
         return os.path.join(self.log_dir, 'stdout')
     
-    def _write_job_script(self, job_script_str):
-        return write_temp_file(job_script_str, dir=self.job_scripts_dir, prefix='submit_')
+    def _write_job_script(self):
+        return write_job_script(script_template_content, self.job_scripts_dir, **self._script_render_args)
 
     def setup(self, clear_directories: Optional[bool] = True):
         if clear_directories:
@@ -115,7 +134,7 @@ class SingleJob(JobGroup):
         verbose: Optional[bool] = True
     ) -> tuple[int]:
         self.setup(clear_directories=clear_directories)
-        job_script_filename = self._write_job_script(self.job_script)
+        job_script_filename = self._write_job_script()
 
         if verbose:
             print()
@@ -127,8 +146,10 @@ class SingleJob(JobGroup):
             slurm_args=self['slurm_args'], 
             job_script_filename=job_script_filename,
             dependency_ids=dependency_ids,
-            dependency_conditions=dependency_conditions
+            dependency_conditions=dependency_conditions,
+            script_args=self.script_args
         )
+        self.all_job_ids.append(self.job_id)
 
         if verbose:
             print(f"Diagnostics")
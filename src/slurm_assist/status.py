@@ -0,0 +1,221 @@
+"""
+FILE: status.py
+PURPOSE: Get the state of submitted jobs, with one squeue/sacct call for many jobs.
+
+Job states are cached for `ttl` seconds (states of finished jobs are cached for good), and the
+cache is shared by all job groups, so polling many groups at once costs a single squeue call.
+"""
+
+import asyncio
+import subprocess
+import threading
+import time
+from typing import Optional, Union
+from . import submission
+
+JobId = Union[int, str]
+
+TERMINAL_STATES = (
+    'COMPLETED', 'FAILED', 'CANCELLED', 'TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL',
+    'PREEMPTED', 'BOOT_FAIL', 'DEADLINE', 'REVOKED', 'NOT_FOUND'
+)
+# Order of precedence when summarizing the states of the elements of an array job
+_STATE_PRECEDENCE = ('RUNNING', 'PENDING', 'CONFIGURING', 'COMPLETING', 'SUSPENDED', 'REQUEUED')
+
+def _summarize_states(states: list[str]) -> str:
+    for state in _STATE_PRECEDENCE:
+        if state in states:
+            return state
+    not_completed = [state for state in states if state != 'COMPLETED']
+    return not_completed[0] if len(not_completed) > 0 else 'COMPLETED'
+
+def _parse_state_lines(stdout: str) -> dict[str, str]:
+    """Parse lines of "<job id>|<state>" (state may be e.g. "CANCELLED by 123")."""
+    states = {}
+    for line in stdout.splitlines():
+        if '|' not in line:
+            continue
+        job_id, state = line.split('|')[:2]
+        states[job_id.strip()] = state.split()[0] if state.strip() else 'UNKNOWN'
+    return states
+
+def query_squeue(job_ids: list[JobId]) -> dict[str, str]:
+    """States of the queued/running jobs (array elements listed separately, e.g. '123_4')."""
+    argv = ['squeue', '--noheader', '--array', '--states=all', f"--jobs={','.join(str(id) for id in job_ids)}", '--format=%i|%T']
+    output = subprocess.run(argv, capture_output=True, text=True)
+    # squeue fails if none of the jobs are still known to slurmctld
+    return _parse_state_lines(output.stdout) if output.returncode == 0 else {}
+
+def query_sacct(job_ids: list[JobId]) -> dict[str, str]:
+    """States of jobs from the accounting database (also finished jobs)."""
+    argv = ['sacct', '--noheader', '--parsable2', '--allocations', f"--jobs={','.join(str(id) for id in job_ids)}", '--format=JobID,State']
+    output = subprocess.run(argv, capture_output=True, text=True)
+    if output.returncode != 0:
+        print(output.stderr)
+        return {}
+    return _parse_state_lines(output.stdout)
+
+class JobStatusCache:
+    """Caches job states, fetching the states of all stale jobs in one query.
+
+    Jobs that neither squeue nor sacct know of are 'UNKNOWN' (e.g. just after submission, before
+    they reach the accounting database), and 'NOT_FOUND' (a terminal state) once they have been
+    unknown for `max_unknown` queries in a row.
+
+    With the local backend (see local_backend.py), states are read from the backend instead.
+    """
+    def __init__(self, ttl: float = 10.0, max_unknown: int = 10):
+        self.ttl = ttl
+        self.max_unknown = max_unknown
+        self._states = {}  # job id (str) -> (state, time fetched)
+        self._elements = {}  # job id (str) -> ids of its array elements
+        self._unknown = {}  # job id (str) -> number of queries in a row it was unknown
+        self._lock = threading.Lock()  # guards the cache
+        self._query_lock = threading.Lock()  # one query at a time, so waiters share them
+
+    def _query(self, job_ids: list[str]) -> dict[str, str]:
+        backend = submission.get_backend()
+        if backend is not None:
+            return backend.query_states(job_ids)
+        states = query_squeue(job_ids)
+        # Jobs squeue does not know of are looked up in sacct, and so are array jobs whose
+        # elements squeue lists as finished: elements that finished a while ago (e.g. failed
+        # ones) may have aged out of squeue already.
+        reconcile = []
+        for id in job_ids:
+            found = [state for k, state in states.items() if k == id or k.startswith(f'{id}_')]
+            if (len(found) == 0) or ((id not in states) and all(state in TERMINAL_STATES for state in found)):
+                reconcile.append(id)
+        if len(reconcile) > 0:
+            for k, state in query_sacct(reconcile).items():
+                states.setdefault(k, state)  # squeue is more up to date
+        return states
+
+    def _stale(self, job_ids: list[str], max_age: float) -> list[str]:
+        now = time.monotonic()
+        return [
+            id for id in job_ids
+            if (id not in self._states) or
+            ((self._states[id][0] not in TERMINAL_STATES) and (now - self._states[id][1] >= max_age))
+        ]
+
+    def states(self, job_ids: list[JobId], max_age: Optional[float] = None) -> dict[str, str]:
+        """Get the state of each job (for an array job, a summary of the states of its elements).
+
+        States fetched more than `max_age` seconds ago (default: the cache's ttl) are fetched again.
+        """
+        job_ids = [str(id) for id in job_ids]
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            stale = self._stale(job_ids, max_age)
+        if len(stale) > 0:
+            with self._query_lock:
+                # Another thread may have fetched them while this one waited
+                with self._lock:
+                    stale = self._stale(stale, max_age)
+                if len(stale) > 0:
+                    fetched = self._query(stale)  # without holding the cache's lock
+                    self._update(stale, fetched)
+        with self._lock:
+            return {id: self._states[id][0] for id in job_ids}
+
+    def _update(self, job_ids: list[str], fetched: dict[str, str]):
+        now = time.monotonic()
+        with self._lock:
+            for id in job_ids:
+                elements = sorted(k for k in fetched if k.startswith(f'{id}_'))
+                if len(elements) > 0:
+                    self._elements[id] = elements
+                    for k in elements:
+                        self._states[k] = (fetched[k], now)
+                    state = _summarize_states([fetched[k] for k in elements])
+                else:
+                    state = fetched.get(id, 'UNKNOWN')
+                if state == 'UNKNOWN':
+                    self._unknown[id] = self._unknown.get(id, 0) + 1
+                    if self._unknown[id] >= self.max_unknown:
+                        state = 'NOT_FOUND'
+                else:
+                    self._unknown.pop(id, None)
+                self._states[id] = (state, now)
+
+    def element_states(self, job_id: JobId) -> dict[str, str]:
+        """States of the elements of an array job, from the last query."""
+        with self._lock:
+            return {k: self._states[k][0] for k in self._elements.get(str(job_id), [])}
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+            self._elements.clear()
+            self._unknown.clear()
+
+# Shared by all job groups
+default_cache = JobStatusCache()
+
+def get_states(job_ids: list[JobId], max_age: Optional[float] = None, cache: Optional[JobStatusCache] = None) -> dict[str, str]:
+    return (cache or default_cache).states(job_ids, max_age=max_age)
+
+def _next_interval(interval: float, changed: bool, min_interval: float, max_interval: float, backoff: float) -> float:
+    # Poll quickly while states are changing and back off while they are not
+    return min_interval if changed else min(interval*backoff, max_interval)
+
+def wait(
+    job_ids: list[JobId],
+    timeout: Optional[float] = None,
+    min_interval: float = 1.0,
+    max_interval: float = 60.0,
+    backoff: float = 1.5,
+    cache: Optional[JobStatusCache] = None,
+    verbose: bool = False
+) -> dict[str, str]:
+    """Block until all jobs are finished. Returns their final states.
+
+    The states are polled every `min_interval` seconds while they are changing; while they are 
+    not, the interval grows by a factor `backoff` up to `max_interval`. Waiters sharing the cache
+    reuse each other's queries.
+    """
+    cache = cache or default_cache
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval, last_states = min_interval, None
+    while True:
+        states = cache.states(job_ids, max_age=interval)
+        if verbose and states != last_states:
+            print(states)
+        if all(state in TERMINAL_STATES for state in states.values()):
+            return states
+        interval = _next_interval(interval, states != last_states, min_interval, max_interval, backoff)
+        last_states = states
+        if deadline is not None:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f'Jobs did not finish within {timeout} seconds: {states}')
+            interval = min(interval, max(deadline - time.monotonic(), 0))
+        time.sleep(interval)
+
+async def async_wait(
+    job_ids: list[JobId],
+    timeout: Optional[float] = None,
+    min_interval: float = 1.0,
+    max_interval: float = 60.0,
+    backoff: float = 1.5,
+    cache: Optional[JobStatusCache] = None,
+    verbose: bool = False
+) -> dict[str, str]:
+    """Like `wait`, but can be awaited (the queries run in a worker thread)."""
+    cache = cache or default_cache
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    interval, last_states = min_interval, None
+    while True:
+        states = await loop.run_in_executor(None, lambda: cache.states(job_ids, max_age=interval))
+        if verbose and states != last_states:
+            print(states)
+        if all(state in TERMINAL_STATES for state in states.values()):
+            return states
+        interval = _next_interval(interval, states != last_states, min_interval, max_interval, backoff)
+        last_states = states
+        if deadline is not None:
+            if loop.time() >= deadline:
+                raise TimeoutError(f'Jobs did not finish within {timeout} seconds: {states}')
+            interval = min(interval, max(deadline - loop.time(), 0))
+        await asyncio.sleep(interval)
@@ -0,0 +1,134 @@
+"""
+FILE: submission.py
+PURPOSE: Submit jobs with sbatch, one at a time or many concurrently.
+"""
+
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from .utils import format_dependencies_to_str
+
+# If set, sbatch/scancel calls are sent to this object (e.g. a local_backend.LocalBackend) 
+# instead of the cluster
+_backend = None
+
+def set_backend(backend):
+    """Send sbatch/scancel calls to `backend` (None for the real Slurm commands)."""
+    global _backend
+    _backend = backend
+
+def get_backend():
+    return _backend
+
+def sbatch_argv(
+    slurm_args: dict,
+    job_script_filename: str,
+    dependency_ids: Optional[list[list[int]]] = None,
+    dependency_conditions: Optional[list[str]] = None,
+    script_args: Optional[list[str]] = None
+) -> list[str]:
+    """Build the sbatch command as an argument list (no shell involved).
+
+    Options with value None or False are left out, and options with value True are passed as
+    flags. `script_args` are passed to the job script.
+    """
+    if (dependency_ids is not None) and (dependency_conditions is not None):
+        slurm_args = dict(**slurm_args, dependency=format_dependencies_to_str(dependency_ids, dependency_conditions))
+    elif (dependency_ids is None) ^ (dependency_conditions is None):
+        raise RuntimeError(f'Cannot specify only one of dependency_ids ({dependency_ids}) and dependency_conditions ({dependency_conditions}).')
+    argv = ['sbatch', '--parsable']
+    for key, value in slurm_args.items():
+        if value is None or value is False:
+            continue
+        elif value is True:
+            argv.append(f'--{key}')
+        else:
+            argv.append(f'--{key}={value}')
+    argv.append(job_script_filename)
+    if script_args is not None:
+        argv += [str(arg) for arg in script_args]
+    return argv
+
+def parse_sbatch_output(stdout: str) -> int:
+    """Get the job ID from the output of `sbatch --parsable` ("<job id>" or "<job id>;<cluster>")."""
+    lines = stdout.strip().splitlines()
+    if len(lines) == 0:
+        raise RuntimeError('sbatch did not print a job ID.')
+    return int(lines[-1].split(';')[0])
+
+def run_sbatch(argv: list[str], verbose: bool = True) -> int:
+    """Run an sbatch command (from sbatch_argv) and return the job ID."""
+    if _backend is not None:
+        job_id = _backend.sbatch(argv)
+        if verbose:
+            print()
+            print('Submit command (local backend)')
+            print('------------------------------')
+            print(subprocess.list2cmdline(argv))
+            print()
+            print('Confirmation')
+            print('------------')
+            print(job_id)
+        return job_id
+    output = subprocess.run(argv, capture_output=True, text=True)
+    if output.stderr != '':
+        print(output.stderr)
+    if verbose:
+        print()
+        print('Submit command')
+        print('--------------')
+        print(subprocess.list2cmdline(argv))
+        print()
+        print('Confirmation')
+        print('------------')
+        print(output.stdout)
+    if output.returncode != 0:
+        raise RuntimeError(f'sbatch failed with exit code {output.returncode}: {output.stderr.strip()}')
+    return parse_sbatch_output(output.stdout)
+
+class SubmissionEngine:
+    """Submits independent jobs concurrently, with at most `max_workers` sbatch calls at a time.
+
+    Example
+    -------
+    with SubmissionEngine(max_workers=8) as engine:
+        futures = [engine.submit(slurm_args, script) for script in scripts]
+        job_ids = [future.result() for future in futures]
+    """
+    def __init__(self, max_workers: int = 8):
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, but got {max_workers}.")
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(
+        self,
+        slurm_args: dict,
+        job_script_filename: str,
+        dependency_ids: Optional[list[list[int]]] = None,
+        dependency_conditions: Optional[list[str]] = None,
+        script_args: Optional[list[str]] = None,
+        verbose: bool = False
+    ):
+        """Queue a submission. Returns a future for the job ID."""
+        argv = sbatch_argv(slurm_args, job_script_filename, dependency_ids, dependency_conditions, script_args)
+        return self._pool.submit(run_sbatch, argv, verbose)
+
+    def submit_many(self, jobs: list[dict]) -> list[int]:
+        """Submit jobs given as dicts of `submit` arguments. Returns the job IDs in the same order."""
+        futures = [self.submit(**job) for job in jobs]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+def submit_slurm_jobs(jobs: list[dict], max_workers: int = 8) -> list[int]:
+    """Submit independent jobs concurrently (see SubmissionEngine.submit_many)."""
+    with SubmissionEngine(max_workers=min(max_workers, max(len(jobs), 1))) as engine:
+        return engine.submit_many(jobs)
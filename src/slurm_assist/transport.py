@@ -0,0 +1,184 @@
+"""
+FILE: transport.py
+PURPOSE: Reuse one SSH connection for every command and file transfer to the same remote.
+
+A session keeps an OpenSSH master connection (ControlMaster) per (host, user, key), and runs
+all ssh and scp commands through its control socket, so only the master does the handshake and
+authentication. The master outlives the process for `persist` seconds, so other processes on the
+same machine (e.g. the tasks of a job array) reuse it too. Sessions with different `channel`
+numbers have their own master connections (for parallel streams that each get a TCP connection).
+Whether the master is up is only checked when it may have exited: on first use, after it has
+been idle for `persist` seconds, or after a command failed to connect. With `batch_mode`, ssh
+fails instead of prompting for a password or passphrase (e.g. in jobs, where no one can answer).
+
+Example
+-------
+session = get_session('cluster.example.edu', 'me', '~/.ssh/id_rsa')
+session.run('mkdir -p /scratch/me/data')
+session.put('data.tar.gz', '/scratch/me/data')
+print(transport_stats())  # {'sessions': 1, 'handshakes': 1, 'commands': 2, 'reused': 1}
+"""
+
+import os
+import hashlib
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional
+
+def _default_control_dir() -> str:
+    # Unix socket paths are short (~100 characters), so keep the directory name short
+    return os.path.join(tempfile.gettempdir(), f'slurm_assist_ssh_{os.getuid()}')
+
+class SSHSession:
+    """Runs ssh/scp commands to a remote over one persistent, multiplexed connection."""
+    def __init__(
+        self,
+        hostname: str,
+        username: str,
+        key_filename: Optional[str] = None,
+        control_dir: Optional[str] = None,
+        persist: int = 600,
+        channel: int = 0,
+        batch_mode: bool = False
+    ):
+        self.hostname = hostname
+        self.username = username
+        self.key_filename = os.path.expanduser(key_filename) if key_filename is not None else None
+        self.control_dir = control_dir or _default_control_dir()
+        self.persist = persist
+        self.channel = channel
+        self.batch_mode = batch_mode
+        key = hashlib.sha256(f'{username}@{hostname}:{self.key_filename}:{channel}'.encode()).hexdigest()[:16]
+        self.control_path = os.path.join(self.control_dir, key)
+        self.handshakes = 0  # master connections opened by this session
+        self.commands = 0  # ssh/scp commands run over the master connection
+        self.reused = 0  # commands that did not need a new master connection
+        self._commands = {}  # remote command -> whether it exists
+        self._up_until = 0.0  # the master is known to be up until then (time.monotonic())
+        self._lock = threading.Lock()
+
+    @property
+    def target(self) -> str:
+        return f'{self.username}@{self.hostname}'
+
+    def _options(self) -> list[str]:
+        options = ['-o', f'ControlPath={self.control_path}']
+        if self.batch_mode:
+            options += ['-o', 'BatchMode=yes']
+        if self.key_filename is not None:
+            options += ['-i', self.key_filename]
+        return options
+
+    def is_alive(self) -> bool:
+        output = subprocess.run(
+            ['ssh', *self._options(), '-O', 'check', self.target],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        return output.returncode == 0
+
+    def open(self) -> bool:
+        """Start the master connection unless one is running. Returns whether one was started."""
+        with self._lock:
+            if time.monotonic() < self._up_until:
+                return False
+            if self.is_alive():
+                self._up_until = time.monotonic() + self.persist
+                return False
+            os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+            subprocess.run([
+                'ssh', *self._options(),
+                '-o', 'ControlMaster=yes', '-o', f'ControlPersist={self.persist}',
+                '-N', '-f', self.target
+            ], check=True)
+            self.handshakes += 1
+            self._up_until = time.monotonic() + self.persist
+            return True
+
+    def _count(self):
+        started = self.open()
+        with self._lock:
+            self.commands += 1
+            if not started:
+                self.reused += 1
+            # The master stays up for `persist` seconds after its last use
+            self._up_until = time.monotonic() + self.persist
+
+    def _forget_master(self):
+        # The master may be gone (ssh exits with 255 if it cannot connect), so check it next time
+        with self._lock:
+            self._up_until = 0.0
+
+    def ssh_argv(self, command: str) -> list[str]:
+        """The argv of an ssh command that goes over the master connection."""
+        return ['ssh', *self._options(), '-o', 'ControlMaster=no', self.target, command]
+
+    def run(self, command: str, check: bool = True, **kwargs) -> subprocess.CompletedProcess:
+        """Run a shell command on the remote (kwargs are passed to subprocess.run)."""
+        self._count()
+        output = subprocess.run(self.ssh_argv(command), **kwargs)
+        if output.returncode == 255:
+            self._forget_master()
+        if check:
+            output.check_returncode()
+        return output
+
+    def popen(self, command: str, **kwargs) -> subprocess.Popen:
+        """Start a shell command on the remote without waiting (kwargs are passed to Popen)."""
+        self._count()
+        return subprocess.Popen(self.ssh_argv(command), **kwargs)
+
+    def which(self, *commands: str) -> set[str]:
+        """Which of the commands exist on the remote (cached)."""
+        unknown = [c for c in commands if c not in self._commands]
+        if len(unknown) > 0:
+            output = self.run(' ; '.join(f'command -v {c} >/dev/null && echo {c}' for c in unknown), check=False, capture_output=True, text=True)
+            found = set(output.stdout.split())
+            self._commands.update({c: c in found for c in unknown})
+        return {c for c in commands if self._commands[c]}
+
+    def put(self, local_path: str, remote_path: str, check: bool = True) -> subprocess.CompletedProcess:
+        self._count()
+        output = subprocess.run(['scp', *self._options(), '-o', 'ControlMaster=no', local_path, f'{self.target}:{remote_path}'])
+        if output.returncode != 0:
+            self._forget_master()
+        if check:
+            output.check_returncode()
+        return output
+
+    def close(self):
+        """Stop the master connection (other processes sharing it lose it too)."""
+        subprocess.run(
+            ['ssh', *self._options(), '-O', 'exit', self.target],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self._forget_master()
+
+    def stats(self) -> dict[str, int]:
+        return dict(handshakes=self.handshakes, commands=self.commands, reused=self.reused)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(hostname: str, username: str, key_filename: Optional[str] = None, channel: int = 0, **kwargs) -> SSHSession:
+    """The pooled session for (hostname, username, key_filename, channel), created on first use."""
+    key = (hostname, username, os.path.expanduser(key_filename) if key_filename is not None else None, channel)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = SSHSession(hostname, username, key_filename, channel=channel, **kwargs)
+        return _sessions[key]
+
+def transport_stats() -> dict[str, int]:
+    """Connection reuse counters, summed over the pooled sessions of this process."""
+    stats = dict(sessions=len(_sessions), handshakes=0, commands=0, reused=0)
+    for session in list(_sessions.values()):
+        for k, v in session.stats().items():
+            stats[k] += v
+    return stats
+
+def close_all():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,152 @@
+"""
+FILE: tuning.py
+PURPOSE: Choose the array size, ntasks and time limit of the main job of an
+EmbarrassinglyParallelJobs, given the number of runs, a per-run time model and the site's limits.
+
+Example
+-------
+result = tune(
+    num_runs=100000,
+    single_run_time=lognormal(median=180, sigma=0.5),  # or a number of seconds
+    limits=SiteLimits(max_array_size=1001, max_walltime='24:00:00', cores_per_node=64),
+    objective='time'
+)
+job.update_main_slurm_args(result.main_slurm_args)
+job.submit()
+"""
+
+import math
+import random
+import statistics
+from collections import namedtuple
+from typing import Callable, Optional, Union
+from .planning import Distribution, _as_distribution
+from .utils import parse_slurm_time, format_slurm_time
+
+SiteLimits = namedtuple(
+    'SiteLimits',
+    ['max_array_size', 'max_walltime', 'cores_per_node', 'max_concurrent', 'core_hour_cost'],
+    defaults=[1001, '24:00:00', 1, None, 1.0]
+)
+SiteLimits.__doc__ = """Limits of a cluster.
+
+max_array_size: Slurm's MaxArraySize (array indices must be smaller).
+max_walltime: The longest time limit of the partition.
+cores_per_node: The most tasks a job can have (one cpu each, on one node).
+max_concurrent: The most array tasks that can run at once (e.g. MaxJobs of the QOS), if any.
+core_hour_cost: Fairshare (or billing) cost of one core hour (to report the cost of a tuning).
+"""
+
+Tuning = namedtuple(
+    'Tuning',
+    ['main_slurm_args', 'expected_time', 'walltime', 'core_hours', 'cost', 'array_size', 'ntasks']
+)
+
+def _ntasks_options(cores_per_node: int) -> list[int]:
+    options = {cores_per_node}
+    n = 1
+    while n < cores_per_node:
+        options.add(n)
+        n *= 2
+    return sorted(options)
+
+def _expected_max_z(n: int) -> float:
+    """Expected maximum of n standard normal draws (Blom's approximation)."""
+    return statistics.NormalDist().inv_cdf((n - 0.375)/(n + 0.25)) if n > 1 else 0.0
+
+def evaluate(
+    array_size: int,
+    ntasks: int,
+    num_runs: int,
+    run_mean: float,
+    run_std: float,
+    limits: SiteLimits,
+    quantile: float = 0.99,
+    safety_factor: float = 1.2,
+    task_overhead: float = 0.0,
+    queue_wait: Union[float, Callable[[dict], float]] = 0.0
+) -> Optional[Tuning]:
+    """Expected time to result and core hours of a main job (None if it exceeds the limits).
+
+    A rank runs its items serially (modelled as a sum of normal draws), and a task lasts as
+    long as its slowest rank. The time limit is set so that, with probability `quantile`, no
+    rank of the whole array runs past it, times the safety factor. Array tasks run in
+    waves of at most `max_concurrent`, each wave waiting `queue_wait` in the queue (a number
+    of seconds, or a function of the slurm args).
+    """
+    if (array_size >= limits.max_array_size) or (ntasks > limits.cores_per_node):
+        return None
+    num_ranks = array_size*ntasks
+    if num_ranks > num_runs:
+        return None
+    max_items = -(-num_runs // num_ranks)
+    rank_time = lambda z: task_overhead + max_items*run_mean + z*math.sqrt(max_items)*run_std
+    z = statistics.NormalDist().inv_cdf(min(quantile**(1/num_ranks), 1 - 1e-12))
+    walltime = safety_factor*rank_time(z)
+    walltime = 60*math.ceil(walltime/60)  # whole minutes
+    if walltime > parse_slurm_time(limits.max_walltime):
+        return None
+    # ntasks=None runs one rank per task without MPI (any ntasks, even 1, selects the MPI path)
+    main_slurm_args = {'array': f'1-{array_size}', 'ntasks': ntasks if ntasks > 1 else None, 'time': format_slurm_time(walltime)}
+    wait = queue_wait(main_slurm_args) if callable(queue_wait) else queue_wait
+    wave_size = array_size if limits.max_concurrent is None else min(array_size, limits.max_concurrent)
+    num_waves = -(-array_size // wave_size)
+    core_hours = array_size*ntasks*rank_time(_expected_max_z(ntasks))/3600
+    return Tuning(
+        main_slurm_args=main_slurm_args,
+        expected_time=num_waves*(wait + rank_time(_expected_max_z(wave_size*ntasks))),
+        walltime=walltime,
+        core_hours=core_hours,
+        cost=core_hours*limits.core_hour_cost,
+        array_size=array_size,
+        ntasks=ntasks
+    )
+
+def tune(
+    num_runs: int,
+    single_run_time: Union[Distribution, float],
+    limits: SiteLimits = SiteLimits(),
+    objective: str = 'time',
+    ntasks_options: Optional[list[int]] = None,
+    quantile: float = 0.99,
+    safety_factor: float = 1.2,
+    task_overhead: float = 0.0,
+    queue_wait: Union[float, Callable[[dict], float]] = 0.0,
+    seed: Optional[int] = None
+) -> Tuning:
+    """Find the main_slurm_args ('array', 'ntasks' and 'time') that minimize the objective.
+
+    Parameters
+    ----------
+    single_run_time : Distribution or float
+        Time (in seconds) of a single run, as a number or a distribution (see planning.py).
+    objective : str
+        'time' (expected time to result) or 'core_hours'. Ties are broken by the other objective.
+        (The fairshare cost is proportional to the core hours, so minimizing the core hours
+        minimizes it too.)
+    ntasks_options : list[int]
+        The ntasks to try (default: powers of 2 up to cores_per_node, and cores_per_node).
+    """
+    if objective not in ('time', 'core_hours'):
+        raise ValueError(f"Invalid objective '{objective}'. Must be one of 'time' or 'core_hours'.")
+    dist = _as_distribution(single_run_time)
+    rng = random.Random(seed)
+    samples = [dist(rng) for _ in range(2000)]
+    run_mean, run_std = statistics.mean(samples), statistics.pstdev(samples)
+
+    if objective == 'time':
+        key = lambda t: (t.expected_time, t.core_hours)
+    else:
+        key = lambda t: (t.core_hours, t.expected_time)
+    best = None
+    for ntasks in (ntasks_options or _ntasks_options(limits.cores_per_node)):
+        for array_size in range(1, min(limits.max_array_size - 1, -(-num_runs // ntasks)) + 1):
+            tuning = evaluate(
+                array_size, ntasks, num_runs, run_mean, run_std, limits,
+                quantile=quantile, safety_factor=safety_factor, task_overhead=task_overhead, queue_wait=queue_wait
+            )
+            if (tuning is not None) and ((best is None) or (key(tuning) < key(best))):
+                best = tuning
+    if best is None:
+        raise ValueError(f"No array size and ntasks fit the site limits {limits} for {num_runs} runs.")
+    return best
@@ -1,8 +1,11 @@
 import os
 import csv
 import pickle
+import struct
+import hashlib
 import subprocess
 import tempfile
+import time
 from glob import glob
 # from gitignore_parser import parse_gitignore
 
@@ -26,6 +29,16 @@ def load_pickle(file_path):
     with open(file_path, 'rb') as f:
         return pickle.load(f)
 
+def load_pickle_list(file_path):
+    """Load a file of one or more consecutively pickled lists and concatenate them."""
+    out = []
+    with open(file_path, 'rb') as f:
+        while True:
+            try:
+                out.extend(pickle.load(f))
+            except EOFError:
+                return out
+
 def append_text(obj, file_path):
     with open(file_path, 'a') as f:
         f.write(obj)
@@ -48,6 +61,289 @@ def save_pickle(obj, file_path):
     with open(file_path, 'wb') as f:
         pickle.dump(obj, f)
 
+def append_pickle(obj, file_path):
+    with open(file_path, 'ab') as f:
+        pickle.dump(obj, f)
+
+BATCH_FORMAT_EXTENSIONS = {
+    'pickle': '.pkl',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'npy': '.npy',
+}
+
+def batch_file_extension(fmt: str) -> str:
+    if fmt not in BATCH_FORMAT_EXTENSIONS:
+        raise ValueError(f"Invalid format '{fmt}'. Must be one of {list(BATCH_FORMAT_EXTENSIONS)}.")
+    return BATCH_FORMAT_EXTENSIONS[fmt]
+
+def save_batch(rows: list, file_path: str, fmt: str = 'pickle'):
+    """Save a list of (id, value) rows in the given format.
+
+    The columnar formats store the id in column 'id' and, if the values are lists/tuples, each
+    element in columns 'c0', 'c1', ... (otherwise the value is stored in column 'value'); lists
+    shorter than the longest are padded with None. The 'npy' format stores a 2D float array with the id in the first column, so it only supports
+    numeric values.
+    """
+    batch_file_extension(fmt)
+    if fmt == 'pickle':
+        save_pickle(rows, file_path)
+    else:
+        writer = open_table_writer(file_path, fmt)
+        writer.write(rows)
+        writer.close()
+
+def load_batch(file_path: str, fmt: str = 'pickle') -> list:
+    """Load a list of (id, value) rows saved with save_batch (or appended with append_pickle).
+
+    Values saved as lists/tuples are loaded as lists. Values in 'npy' files are always loaded
+    as lists.
+    """
+    batch_file_extension(fmt)
+    if fmt == 'pickle':
+        return load_pickle_list(file_path)
+    elif fmt == 'npy':
+        import numpy as np
+        array = np.load(file_path)
+        return [(int(row[0]), row[1:].tolist()) for row in array]
+    else:
+        import pyarrow as pa
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(file_path)
+        else:
+            with pa.memory_map(file_path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        return _table_to_rows(table)
+
+def _rows_to_table(rows: list):
+    import pyarrow as pa
+    columns = {'id': pa.array([id for id, _ in rows], type=pa.int64())}
+    num_lists = sum(isinstance(value, (list, tuple)) for _, value in rows)
+    if 0 < num_lists < len(rows):
+        raise ValueError('Cannot write a mix of list and scalar values to a table.')
+    is_list = num_lists > 0
+    if is_list:
+        width = max(len(value) for _, value in rows)
+        for c in range(width):
+            columns[f'c{c}'] = [value[c] if c < len(value) else None for _, value in rows]
+    elif len(rows) > 0:
+        columns['value'] = [value for _, value in rows]
+    return pa.table(columns, metadata={'row_type': 'list' if is_list else 'scalar'})
+
+def _table_to_rows(table) -> list:
+    columns = table.to_pydict()
+    ids = columns.pop('id')
+    if (table.schema.metadata or {}).get(b'row_type') == b'list':
+        return list(zip(ids, [list(value) for value in zip(*columns.values())]))
+    elif 'value' in columns:
+        return list(zip(ids, columns['value']))
+    return []
+
+class _CsvTableWriter:
+    """Writes rows with pandas' to_csv, one batch of rows at a time. Missing values are empty
+    fields, and every value is written as it is (an int with missing values in its column is
+    still an int, e.g. 1 rather than 1.0), so the output does not depend on how the rows are 
+    split into batches."""
+    def __init__(self, file_path):
+        self._file = open(file_path, 'w', newline='')
+
+    def write(self, rows):
+        import pandas as pd
+        if len(rows) == 0:
+            return
+        pd.DataFrame(rows, dtype=object).to_csv(self._file, index=False, header=False)
+
+    def close(self):
+        self._file.close()
+
+def _unify_schemas(schema, other, file_path):
+    """The narrowest schema that fits both schemas (e.g. int64 and double columns are widened to
+    double, and null columns to the type of the other)."""
+    import pyarrow as pa
+    if schema.metadata != other.metadata:
+        raise ValueError(f'Cannot write a mix of list and scalar values to {file_path}.')
+    for field in other:
+        if field.name not in schema.names:
+            continue
+        try:
+            pa.unify_schemas([pa.schema([schema.field(field.name)]), pa.schema([field])], promote_options='permissive')
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            raise ValueError(
+                f"Column '{field.name}' has values of types {schema.field(field.name).type} and "
+                f"{field.type}, which cannot be written to one column of {file_path}."
+            )
+    return pa.unify_schemas([schema, other], promote_options='permissive')
+
+def _conform_table(table, schema):
+    """Cast a table to a (wider) schema, with nulls in the columns it does not have."""
+    import pyarrow as pa
+    columns = [
+        table.column(field.name).cast(field.type) if field.name in table.column_names else pa.nulls(len(table), field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def _iter_table_batches(file_path, fmt):
+    import pyarrow as pa
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(file_path).iter_batches():
+            yield pa.Table.from_batches([batch])
+    else:
+        with pa.memory_map(file_path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield pa.Table.from_batches([reader.get_batch(i)])
+
+class _ArrowTableWriter:
+    """Writes rows to a parquet or arrow file as they arrive.
+
+    The schema is that of the first rows, widened when later rows do not fit it (e.g. a column
+    of ints that gets a float, or a column of None that gets values): the rows written so far
+    are then rewritten with the wider schema. A column can only be widened a few times, so this
+    is rare. Columns with values that cannot share a type (e.g. numbers and strings) raise a
+    ValueError.
+    """
+    def __init__(self, file_path, fmt):
+        self.file_path = file_path
+        self.fmt = fmt
+        self._writer = None
+        self._schema = None
+
+    def _open(self, schema):
+        self._schema = schema
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.file_path, schema)
+        else:
+            import pyarrow as pa
+            self._writer = pa.ipc.new_file(self.file_path, schema)
+
+    def _widen(self, schema):
+        self._writer.close()
+        written_file = self.file_path + '.widen'
+        os.replace(self.file_path, written_file)
+        self._open(schema)
+        for table in _iter_table_batches(written_file, self.fmt):
+            self._writer.write_table(_conform_table(table, schema))
+        os.remove(written_file)
+
+    def write(self, rows):
+        if len(rows) == 0:
+            return
+        table = _rows_to_table(rows)
+        if self._writer is None:
+            self._open(table.schema)
+        elif not table.schema.equals(self._schema, check_metadata=True):
+            schema = _unify_schemas(self._schema, table.schema, self.file_path)
+            if not schema.equals(self._schema, check_metadata=True):
+                self._widen(schema)
+        self._writer.write_table(_conform_table(table, self._schema))
+
+    def close(self):
+        if self._writer is None:
+            # No rows were written
+            self._open(_rows_to_table([]).schema)
+        self._writer.close()
+
+class _NpyTableWriter:
+    """Writes rows to a .npy file as they arrive.
+
+    The shape of the array is not known until all rows are written, so space for the header is
+    reserved at the start of the file and the header is written when the file is closed.
+    """
+    header_size = 256
+
+    def __init__(self, file_path):
+        self._file = open(file_path, 'wb')
+        self._file.write(b' '*self.header_size)
+        self._num_rows = 0
+        self._width = None
+
+    def write(self, rows):
+        import numpy as np
+        if len(rows) == 0:
+            return
+        array = np.array([[id, *value] if isinstance(value, (list, tuple)) else [id, value] for id, value in rows], dtype='<f8')
+        if self._width is None:
+            self._width = array.shape[1]
+        elif array.shape[1] != self._width:
+            raise ValueError(f'Expected rows with {self._width} columns, but got {array.shape[1]}.')
+        self._file.write(array.tobytes())
+        self._num_rows += len(array)
+
+    def close(self):
+        shape = (self._num_rows, self._width if self._width is not None else 0)
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': %r, }" % (shape,)
+        header = header.ljust(self.header_size - 10 - 1) + '\n'
+        self._file.seek(0)
+        self._file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+        self._file.close()
+
+def open_table_writer(file_path: str, fmt: str):
+    """Open a writer that appends (id, value) rows to a file in the given format ('csv' or any batch format except 'pickle')."""
+    if fmt == 'csv':
+        return _CsvTableWriter(file_path)
+    elif fmt in ('parquet', 'arrow'):
+        return _ArrowTableWriter(file_path, fmt)
+    elif fmt == 'npy':
+        return _NpyTableWriter(file_path)
+    else:
+        raise ValueError(f"Invalid format '{fmt}'. Must be one of 'csv', 'parquet', 'arrow' or 'npy'.")
+
+def load_journal(file_path):
+    """Load the records of a journal file written by ResultJournal.
+
+    Returns the records and the size (in bytes) of the complete records. A partially written 
+    record at the end of the file (e.g., from a job killed mid-write) is ignored.
+    """
+    records, size = [], 0
+    if not os.path.exists(file_path):
+        return records, size
+    with open(file_path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            payload = f.read(struct.unpack('>Q', header)[0])
+            try:
+                records.append(pickle.loads(payload))
+            except Exception:
+                break
+            size += len(header) + len(payload)
+    return records, size
+
+class ResultJournal:
+    """Append-only file of length-prefixed, pickled (id, result) records.
+
+    Records are flushed and fsynced to disk every `fsync_every` appends. Records already in the 
+    file are loaded into `records` when the journal is opened.
+    """
+    def __init__(self, file_path: str, fsync_every: int = 1):
+        self.file_path = file_path
+        self.fsync_every = fsync_every
+        self.records, size = load_journal(file_path)
+        self._file = open(file_path, 'ab')
+        self._file.truncate(size)  # Drop a partially written record, if any
+        self._num_unsynced = 0
+
+    def append(self, id, result):
+        payload = pickle.dumps((id, result))
+        self._file.write(struct.pack('>Q', len(payload)) + payload)
+        self._num_unsynced += 1
+        if self._num_unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._num_unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
 def write_temp_file(
     obj: str, 
     dir: Optional[str] = None, 
@@ -57,6 +353,91 @@ def write_temp_file(
         f.write(obj)
     return f.name
 
+# (script directory, render key) -> path of the rendered job script, for this process
+_job_script_index = {}
+# Template contents -> compiled Jinja template
+_compiled_templates = {}
+# Job scripts not used for this long (in seconds) are removed by prune_job_scripts
+job_script_max_age = 30*24*3600
+
+def write_job_script(template_content: str, dir: str, **render_args) -> str:
+    """Render a job script and save it under the hash of its contents. Returns its path.
+
+    Scripts with the same contents are saved only once, so per-job values should be passed to 
+    the script as arguments rather than rendered into it. The render arguments of each script 
+    are recorded in `dir`/index.txt, so later submissions with the same arguments (also from 
+    other processes) reuse the script without rendering or writing anything. Whenever a new
+    entry is added to the index, the directory is pruned (see prune_job_scripts).
+    """
+    dir = os.path.abspath(dir)
+    render_key = hashlib.sha256(repr((template_content, sorted(render_args.items()))).encode()).hexdigest()
+    index_file = os.path.join(dir, 'index.txt')
+    if (dir, render_key) not in _job_script_index and os.path.exists(index_file):
+        with open(index_file, 'r') as f:
+            for line in f:
+                key, _, filename = line.strip().partition(' ')
+                _job_script_index[(dir, key)] = os.path.join(dir, filename)
+    path = _job_script_index.get((dir, render_key))
+    if path is not None:
+        try:
+            os.utime(path)  # the modification time is when the script was last used
+            return path
+        except FileNotFoundError:
+            pass
+
+    if template_content not in _compiled_templates:
+        from jinja2 import Template
+        _compiled_templates[template_content] = Template(template_content)
+    script = _compiled_templates[template_content].render(render_args)
+    filename = f'submit_{hashlib.sha256(script.encode()).hexdigest()[:16]}.sh'
+    path = os.path.join(dir, filename)
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        # Write to a temporary file first so no one ever sees a partly written script
+        tmp_path = write_temp_file(script, dir=dir, prefix='.submit_')
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    with open(index_file, 'a') as f:
+        f.write(f'{render_key} {filename}\n')
+    _job_script_index[(dir, render_key)] = path
+    prune_job_scripts(dir)
+    return path
+
+def prune_job_scripts(dir: str, max_age: float = job_script_max_age) -> int:
+    """Remove the job scripts in `dir` that were not used for `max_age` seconds, and rewrite the
+    index without them (and without duplicate entries). Returns the number of scripts removed.
+
+    Jobs already submitted are not affected, since sbatch keeps a copy of the script.
+    """
+    dir = os.path.abspath(dir)
+    if not os.path.isdir(dir):
+        return 0
+    num_removed = 0
+    for filename in os.listdir(dir):
+        if filename.startswith('submit_') and filename.endswith('.sh'):
+            path = os.path.join(dir, filename)
+            try:
+                if time.time() - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    num_removed += 1
+            except FileNotFoundError:
+                pass  # removed by another process
+    index_file = os.path.join(dir, 'index.txt')
+    if os.path.exists(index_file):
+        entries = {}
+        with open(index_file, 'r') as f:
+            for line in f:
+                key, _, filename = line.strip().partition(' ')
+                if os.path.exists(os.path.join(dir, filename)):
+                    entries[key] = filename
+        tmp_path = write_temp_file(''.join(f'{key} {filename}\n' for key, filename in entries.items()), dir=dir, prefix='.index_')
+        os.replace(tmp_path, index_file)
+    for key, path in list(_job_script_index.items()):
+        if key[0] == dir and not os.path.exists(path):
+            del _job_script_index[key]
+    return num_removed
+
 def remove_and_make_dir(dir):
     if os.path.exists(dir):
         subprocess.run(["rm", "-rf", dir])
@@ -132,6 +513,35 @@ def parse_cli_args(args):
             
     return arg_dict
 
+def assign_ids(data: list, first_id: int, generate_new_ids: bool, source: str = '') -> list[tuple[int, list]]:
+    """Give each data entry a unique ID. `first_id` is the row number of the first entry in `data`."""
+    if generate_new_ids:
+        return list(zip(range(first_id, first_id + len(data)), data))  # [(id, data), ...]
+    is_valid_id = list(map(lambda x: str(x[0]).isdigit(), data))
+    if not all(is_valid_id):
+        raise ValueError(f'Tried to parse the the first column of the input csv file {source} as IDs, but \n \
+                         at least one entry is not an integer. Set generate_new_ids=True to generate new IDs.')
+    ids = list(map(lambda x: int(x[0]), data))
+    data = list(map(lambda x: x[1:], data))
+    return list(zip(ids, data))  # [(id, data), ...]
+
+def balance_by_cost(costs, n: int):
+    """Assign items to `n` bins so that the bins have about the same total cost.
+
+    Uses the greedy longest-processing-time algorithm: items are taken in order of decreasing 
+    cost and each is put in the bin with the lowest total cost so far. Returns the bin of each 
+    item (as an array of ints).
+    """
+    import heapq
+    from array import array
+    assignment = array('q', bytes(8*len(costs)))
+    bins = [(0.0, k) for k in range(n)]  # (total cost, bin), as a heap
+    for i in sorted(range(len(costs)), key=costs.__getitem__, reverse=True):
+        total, k = heapq.heappop(bins)
+        assignment[i] = k
+        heapq.heappush(bins, (total + costs[i], k))
+    return assignment
+
 def to_zero_based_indexing(ind: Union[int, list]):
     if isinstance(ind, int):
         return ind - 1
@@ -164,55 +574,27 @@ def get_value_from_nested_dict(nested_dict, key_list):
         value = value[key]
     return value
 
-def cancel_slurm_job(job_id: int, verbose: bool = True):
-    output = subprocess.run(['scancel', str(job_id)], capture_output=True, text=True)
-    if output.stderr != '':
-        print(output.stderr)
-    if verbose:
-        print(output.stdout)
-
 def submit_slurm_job(
     slurm_args: dict, 
     job_script_filename: str, 
-    verbose: bool = Optional[True],
+    verbose: bool = True,
     dependency_ids: Optional[list[list[int]]] = None, 
-    dependency_conditions: Optional[list[str]] = None
+    dependency_conditions: Optional[list[str]] = None,
+    script_args: Optional[list[str]] = None
 ) -> int:
-    from jinja2 import Template
-    submit_command_template_content = \
-"""sbatch \
-{% for key, value in slurm_args.items() if value is not none %}\
-{% if value is boolean and value %}--{{ key }} \
-{% elif value is not boolean %}--{{ key }}={{ value }} \
-{% endif %}{% endfor %} \
-{{ job_script_filename }}
-"""
-    submit_command_template = Template(submit_command_template_content)
-
-    if (dependency_ids is not None) and (dependency_conditions is not None):
-        dependencies_str = format_dependencies_to_str(dependency_ids, dependency_conditions)
-        slurm_args = dict(**slurm_args, dependency=dependencies_str)
-    elif (dependency_ids is None) ^ (dependency_conditions is None):
-        raise RuntimeError(f'Cannot specify only one of dependency_ids ({dependency_ids}) and dependency_conditions ({dependency_conditions}).')
-
-    env = os.environ.copy()
-    sbatch_command = submit_command_template.render(slurm_args=slurm_args, job_script_filename=job_script_filename)
-    output = subprocess.run(sbatch_command, capture_output=True, text=True, shell=True, env=env)
-    if output.stderr != '':
-        print(output.stderr)
-    if verbose:
-        print()
-        print('Submit command')
-        print('--------------')
-        print(sbatch_command)
-        print()
-        print('Confirmation')
-        print('------------')
-        print(output.stdout)
-    job_id = int(output.stdout.split()[-1])
-    return job_id
+    from .submission import sbatch_argv, run_sbatch
+    argv = sbatch_argv(slurm_args, job_script_filename, dependency_ids, dependency_conditions, script_args)
+    return run_sbatch(argv, verbose=verbose)
+
+def submit_slurm_jobs(jobs: list[dict], max_workers: int = 8) -> list[int]:
+    """Submit independent jobs concurrently. Each job is a dict of submit_slurm_job arguments."""
+    from .submission import submit_slurm_jobs as _submit_slurm_jobs
+    return _submit_slurm_jobs(jobs, max_workers=max_workers)
 
 def cancel_slurm_job(job_id: int, verbose: bool = True):
+    from .submission import get_backend
+    if get_backend() is not None:
+        return get_backend().scancel(job_id)
     output = subprocess.run(['scancel', str(job_id)], capture_output=True, text=True)
     if output.stderr != '':
         print(output.stderr)
@@ -236,6 +618,41 @@ def format_dependencies_to_str(ids: list[list[int]], conditions: list[str]) -> s
     # Join all dependency strings into a single string with commas
     return ",".join(dependencies)
 
+def parse_slurm_time(time_str) -> int:
+    """Convert a Slurm time limit (e.g. '90', '1:30:00', '2-12:00:00') to seconds."""
+    time_str = str(time_str)
+    days = 0
+    if '-' in time_str:
+        days, time_str = time_str.split('-', 1)
+        days = int(days)
+        parts = [int(p) for p in time_str.split(':')]
+        parts += [0]*(3 - len(parts))  # days-hours[:minutes[:seconds]]
+    else:
+        parts = [int(p) for p in time_str.split(':')]
+        if len(parts) == 1:
+            parts = [0, parts[0], 0]  # minutes
+        elif len(parts) == 2:
+            parts = [0] + parts  # minutes:seconds
+    hours, minutes, seconds = parts
+    return ((days*24 + hours)*60 + minutes)*60 + seconds
+
+def format_slurm_time(seconds: float) -> str:
+    """Convert seconds to a Slurm time limit ('[days-]hours:minutes:seconds'), rounding up."""
+    seconds = int(-(-seconds // 1))
+    days, seconds = divmod(seconds, 24*3600)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    time_str = f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+    return f'{days}-{time_str}' if days > 0 else time_str
+
+def parse_slurm_memory(mem) -> int:
+    """Convert a Slurm memory size (e.g. '4G', '500M', or a number of MB) to MB, rounding up."""
+    mem = str(mem).upper()
+    units = {'K': 1/1024, 'M': 1, 'G': 1024, 'T': 1024**2}
+    if mem[-1] in units:
+        return int(-(-float(mem[:-1])*units[mem[-1]] // 1))
+    return int(mem)
+
 def estimate_total_time(num_runs, single_run_time, job_array_size, n_tasks_per_job, safety_factor=1.0):
     """Estimates the amount of time a job will take.
     
@@ -294,57 +711,238 @@ def execute_and_print_cmd(cmd):
         print("Error:", error)
 
 
-def compress_and_transfer(hostname, username, key_filename, local_paths, remote_dir, archive_name=None):
+# Compression codecs for transfers: tar options to create and to extract, and archive extension
+transfer_codecs = {
+    'none': ([], [], '.tar'),
+    'gzip': (['-z'], ['-z'], '.tar.gz'),
+    'zstd': (['-I', 'zstd -T0 -3'], ['-I', 'zstd -d'], '.tar.zst'),
+    'lz4': (['-I', 'lz4 -1'], ['-I', 'lz4 -d'], '.tar.lz4'),
+}
+# Commands needed by each codec (on both ends)
+_codec_commands = {'none': [], 'gzip': ['gzip'], 'zstd': ['zstd'], 'lz4': ['lz4']}
+
+def _tar_create_options(codec):
+    import shutil
+    if codec == 'gzip' and shutil.which('pigz') is not None:
+        return ['-I', 'pigz']  # multithreaded gzip, readable by gzip
+    return transfer_codecs[codec][0]
+
+def _tar_extract_command(codec, archive, remote_dir):
+    import shlex
+    return shlex.join(['tar', *transfer_codecs[codec][1], '-xf', archive, '-C', remote_dir])
+
+def available_codecs(session=None):
+    """The codecs whose commands exist here (and on the remote of `session`, if given)."""
+    import shutil
+    codecs = [codec for codec, commands in _codec_commands.items() if all(shutil.which(c) for c in commands)]
+    if session is not None:
+        remote_commands = session.which(*[c for codec in codecs for c in _codec_commands[codec]])
+        codecs = [codec for codec in codecs if all(c in remote_commands for c in _codec_commands[codec])]
+    return codecs
+
+def choose_codec(local_paths, session=None, sample_size=1 << 20, threshold=0.9):
+    """Pick a codec for local_paths by compressing a sample of them.
+
+    Up to `sample_size` bytes are read from the middle of the largest files. If they do not
+    compress below `threshold` of their size (e.g. HDF5, PNG or other compressed data), no
+    compression is used; otherwise the fastest available codec (zstd, then lz4, then gzip).
+    """
+    import zlib
+    files = sorted((size, path) for path, size in _path_sizes(local_paths) if size > 0)[::-1][:16]
+    sample = b''
+    for size, path in files:
+        with open(path, 'rb') as f:
+            f.seek(size//2 - min(size, sample_size//len(files))//2)
+            sample += f.read(sample_size//len(files))
+    if len(sample) == 0 or len(zlib.compress(sample, 1))/len(sample) > threshold:
+        return 'none'
+    codecs = available_codecs(session)
+    return next(codec for codec in ('zstd', 'lz4', 'gzip', 'none') if codec in codecs)
+
+def _resolve_codec(codec, local_paths, session=None):
+    if codec == 'adaptive':
+        codec = choose_codec(local_paths, session)
+        print(f"Using codec '{codec}'.")
+    if codec not in transfer_codecs:
+        raise ValueError(f"Invalid codec '{codec}'. Must be one of {list(transfer_codecs)} or 'adaptive'.")
+    return codec
+
+def stream_tar(session, local_paths, remote_dir, chunk_size=1 << 20, progress=None, codec='gzip'):
+    """Pipe `tar -c` of local_paths into `tar -x` in remote_dir over one SSH channel, without
+    writing an archive anywhere. Returns the number of (compressed) bytes sent.
+
+    `progress`, if given, is called with the size of each chunk sent. `codec` is one of 
+    transfer_codecs.
+    """
+    tar = subprocess.Popen(["tar", *_tar_create_options(codec), "-cf", "-"] + list(local_paths), stdout=subprocess.PIPE)
+    import shlex
+    remote = session.popen(f"mkdir -p {shlex.quote(remote_dir)} && {_tar_extract_command(codec, '-', remote_dir)}", stdin=subprocess.PIPE)
+    num_bytes = 0
+    try:
+        while True:
+            chunk = tar.stdout.read(chunk_size)
+            if not chunk:
+                break
+            remote.stdin.write(chunk)
+            num_bytes += len(chunk)
+            if progress is not None:
+                progress(len(chunk))
+    except BrokenPipeError:
+        pass  # the remote tar exited early; its return code says why
+    finally:
+        tar.stdout.close()
+        try:
+            remote.stdin.close()  # flushes what is left in the buffer
+        except BrokenPipeError:
+            pass
+    for process, argv in ((tar, tar.args), (remote, remote.args)):
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, argv)
+    return num_bytes
+
+def _path_sizes(local_paths):
+    """(path, size in bytes) of each file in local_paths (directories are expanded)."""
+    sizes = []
+    for path in local_paths:
+        if not os.path.isdir(path):
+            sizes.append((path, os.path.getsize(path)))
+            continue
+        for dir_path, dir_names, file_names in os.walk(path):
+            if len(dir_names) == 0 and len(file_names) == 0:
+                sizes.append((dir_path, 0))  # keep empty directories
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                sizes.append((file_path, os.path.getsize(file_path)))
+    return sizes
+
+def parallel_stream_tar(hostname, username, key_filename, local_paths, remote_dir, num_streams, retries=2, codec='gzip', report_interval=5.0):
+    """Stream local_paths to remote_dir over `num_streams` concurrent SSH connections.
+
+    The files are split into shards of about the same total size (see balance_by_cost), one per
+    stream. A shard that fails is resent on its own, up to `retries` times. The bytes sent over
+    all streams, and the throughput, are printed every `report_interval` seconds. Returns the
+    number of (compressed) bytes sent.
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from .transport import get_session
+    sizes = _path_sizes(local_paths)
+    assignment = balance_by_cost([size for _, size in sizes], num_streams)
+    shards = [[path for (path, _), k in zip(sizes, assignment) if k == shard] for shard in range(num_streams)]
+    shards = [shard for shard in shards if len(shard) > 0]
+    if len(shards) == 0:
+        print("Nothing to transfer.")
+        return 0
+    sent = [0]*len(shards)
+    lock = threading.Lock()
+    t1 = time.time()
+    last_report = t1
+
+    def send(k):
+        def progress(num_bytes):
+            nonlocal last_report
+            with lock:
+                sent[k] += num_bytes
+                now = time.time()
+                if now - last_report < report_interval:
+                    return
+                last_report = now
+                total = sum(sent)
+            print(f"{total/1e6:.2f} MB sent over {len(shards)} streams in {now - t1:.1f} s ({total/1e6/max(now - t1, 1e-9):.2f} MB/s)")
+        session = get_session(hostname, username, key_filename, channel=k)
+        for attempt in range(retries + 1):
+            t_shard = time.time()
+            with lock:
+                sent[k] = 0  # a retried shard is sent again from the start
+            try:
+                num_bytes = stream_tar(session, shards[k], remote_dir, progress=progress, codec=codec)
+            except subprocess.CalledProcessError as e:
+                print(f"Stream {k}: attempt {attempt + 1} failed ({e}).")
+                if attempt == retries:
+                    raise
+                continue
+            elapsed = time.time() - t_shard
+            with lock:
+                total = sum(sent)
+            print(f"Stream {k}: {len(shards[k])} files, {num_bytes/1e6:.2f} MB in {elapsed:.2f} s ({num_bytes/1e6/max(elapsed, 1e-9):.2f} MB/s); {total/1e6:.2f} MB sent in total")
+            return num_bytes
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        num_bytes = sum(pool.map(send, range(len(shards))))
+    elapsed = time.time() - t1
+    print(f"Transfer successful: {num_bytes/1e6:.2f} MB over {len(shards)} streams in {elapsed:.2f} s ({num_bytes/1e6/max(elapsed, 1e-9):.2f} MB/s)")
+    return num_bytes
+
+def compress_and_transfer(hostname, username, key_filename, local_paths, remote_dir, archive_name=None, session=None, stream=False, num_streams=1, retries=2, sync=False, codec='gzip'):
+    """Compress files, copy them to a remote directory and uncompress them there.
+
+    All steps run over one pooled SSH connection per (hostname, username, key_filename) (see 
+    transport.py), or over `session` if given. With `stream`, the archive is piped straight into
+    the remote tar instead of being written to disk on either side. With `num_streams` > 1, the
+    files are streamed over that many connections at once (see parallel_stream_tar). With 
+    `sync`, only files that are new or changed since the last transfer are streamed (see
+    move/sync.py). `codec` is one of transfer_codecs ('none', 'gzip', 'zstd', 'lz4'), or 
+    'adaptive' to pick one from a sample of the files (see choose_codec).
+    """
+    from .transport import get_session
+    if session is None:
+        session = get_session(hostname, username, key_filename)
+    codec = _resolve_codec(codec, local_paths, session)
+    if sync:
+        from .move.sync import sync as sync_files, SSHTransport
+        try:
+            sync_files(local_paths, remote_dir, SSHTransport(hostname, username, key_filename, num_streams=num_streams, retries=retries, codec=codec))
+        except subprocess.CalledProcessError as e:
+            print(f"Error: {e}")
+        return [os.path.join(remote_dir, p) for p in local_paths]
+    if num_streams > 1:
+        print(f"Streaming files to {remote_dir} on {hostname} over {num_streams} streams...")
+        try:
+            parallel_stream_tar(hostname, username, key_filename, local_paths, remote_dir, num_streams, retries=retries, codec=codec)
+        except subprocess.CalledProcessError as e:
+            print(f"Error: {e}")
+        return [os.path.join(remote_dir, p) for p in local_paths]
+
+    if stream:
+        print(f"Streaming files to {remote_dir} on {hostname}...")
+        t1 = time.time()
+        try:
+            num_bytes = stream_tar(session, local_paths, remote_dir, codec=codec)
+            elapsed = time.time() - t1
+            print(f"Transfer successful: {num_bytes/1e6:.2f} MB in {elapsed:.2f} s ({num_bytes/1e6/max(elapsed, 1e-9):.2f} MB/s)")
+        except subprocess.CalledProcessError as e:
+            print(f"Error: {e}")
+        return [os.path.join(remote_dir, p) for p in local_paths]
+
     # Use tempfile to create an archive name, if not provided
     if archive_name is None:
         tmp_basename = os.path.relpath(tempfile.NamedTemporaryFile(dir='.').name, '.')
-        archive_name = tmp_basename + '.tar.gz'
-    
-    # Expand paths
-    key_filename = os.path.expanduser(key_filename)
+        archive_name = tmp_basename + transfer_codecs[codec][2]
     
     # Create the tar command for the list of files
-    compress_command = ["tar", "-czf", archive_name] + local_paths
+    compress_command = ["tar", *_tar_create_options(codec), "-cf", archive_name] + local_paths
+    import shlex
+    remote_archive = f"{remote_dir}/{archive_name}"
     
     try:
-        # Step 1: Compress the files into a tar.gz archive
+        # Step 1: Compress the files into an archive (with the codec's compression)
         print(f"Compressing files into {archive_name}...")
         subprocess.run(compress_command, check=True)
         print(f"Compression successful: {archive_name}")
 
         # Step 2: Create the remote directory if it does not exist
-        ssh_mkdir_command = f"mkdir -p {remote_dir}"
-        ssh_mkdir = [
-            "ssh",
-            "-i", key_filename,
-            f"{username}@{hostname}",
-            ssh_mkdir_command
-        ]
         print(f"Creating remote directory {remote_dir}...")
-        subprocess.run(ssh_mkdir, check=True)
+        session.run(f"mkdir -p {shlex.quote(remote_dir)}")
         print(f"Remote directory created: {remote_dir}")
 
         # Step 3: Transfer the compressed file to the remote server using scp
-        scp_command = [
-            "scp",
-            "-i", key_filename,  # Path to SSH private key
-            archive_name,        # Local compressed file
-            f"{username}@{hostname}:{remote_dir}"  # Remote destination (user@host:/remote/path)
-        ]
         print(f"Transferring {archive_name} to {remote_dir} on {hostname}...")
-        subprocess.run(scp_command, check=True)
+        session.put(archive_name, remote_dir)
         print(f"Transfer successful.")
 
-        # Step 4: Connect to the remote server to uncompress the archive
-        uncompress_command = f"tar -xzf {remote_dir}/{archive_name} -C {remote_dir}"
-        ssh_command = [
-            "ssh",
-            "-i", key_filename,  # Path to SSH private key
-            f"{username}@{hostname}",  # Remote user and host
-            uncompress_command  # Command to uncompress the file on remote server
-        ]
+        # Step 4: Uncompress the archive on the remote server
         print(f"Uncompressing {archive_name} on remote server...")
-        subprocess.run(ssh_command, check=True)
+        session.run(_tar_extract_command(codec, remote_archive, remote_dir))
         print(f"Uncompression successful on {hostname}.")
 
     except subprocess.CalledProcessError as e:
@@ -355,15 +953,8 @@ def compress_and_transfer(hostname, username, key_filename, local_paths, remote_
             os.remove(archive_name)
             print(f"Removed local archive {archive_name}.")
         # Delete the remote archive after uncompression
-        ssh_delete_command = f"rm {remote_dir}/{archive_name}"
-        ssh_delete = [
-            "ssh",
-            "-i", key_filename,
-            f"{username}@{hostname}",
-            ssh_delete_command
-        ]
         print(f"Deleting remote archive {archive_name}...")
-        subprocess.run(ssh_delete, check=True)
+        session.run(f"rm {shlex.quote(remote_archive)}")
         print(f"Deleted remote archive {archive_name}.")
     
     remote_paths = [os.path.join(remote_dir, p) for p in local_paths]
@@ -15,4 +15,18 @@ def single_run(
     message += f"Extra args: {extra_arg_1}, {extra_arg_2}"
     results_file = os.path.join(results_dir, f'results_{id}.txt')
     save_txt(message, results_file)
-    return data
\ No newline at end of file
+    return data
+
+
+def batch_run(
+    ids: list[int],
+    data: list[list[str]],
+    results_dir: str,
+    extra_arg_1: str,
+    extra_arg_2: str,
+) -> list[list[str]]:
+    message = f"Hello, world! I am from run ids {ids}.\n"
+    message += f"Extra args: {extra_arg_1}, {extra_arg_2}"
+    results_file = os.path.join(results_dir, f'results_{ids[0]}-{ids[-1]}.txt')
+    save_txt(message, results_file)
+    return list(data)
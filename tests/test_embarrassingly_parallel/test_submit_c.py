@@ -0,0 +1,4 @@
+from slurm_assist import EmbarrassinglyParallelJobs
+
+job = EmbarrassinglyParallelJobs(['test_embarrassingly_parallel/config_1c.yaml', 'test_embarrassingly_parallel/config_2.yaml'])
+job.submit()
\ No newline at end of file
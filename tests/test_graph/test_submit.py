@@ -0,0 +1,12 @@
+from slurm_assist import JobGraph, SingleJob
+
+def job(name):
+    return SingleJob(['test_single/config.yaml', dict(slurm_args={'job-name': name}, program_args=dict(foo=name, bar=1.0))])
+
+# prep -> (a, b) -> report, with the report running even if a or b fails
+graph = JobGraph(
+    nodes={'prep': job('prep'), 'a': job('a'), 'b': job('b'), 'report': job('report')},
+    edges=[('prep', 'a'), ('prep', 'b'), ('a', 'report', 'afterany'), ('b', 'report', 'afterany')]
+)
+print(graph.submit())
+print(graph.job_ids)
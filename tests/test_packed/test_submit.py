@@ -0,0 +1,11 @@
+from slurm_assist import PackedJobs
+
+jobs = [
+    dict(
+        program_args=dict(foo=f"I_am_job_{k}", bar=float(k)),
+        slurm_args={'time': '00:02:00', 'cpus-per-task': 1 + k % 2}
+    )
+    for k in range(12)
+]
+job = PackedJobs(jobs, 'test_packed/config.yaml')
+job.submit()
@@ -0,0 +1,62 @@
+import os
+import re
+import pytest
+from slurm_assist import EmbarrassinglyParallelJobs, use_local_backend
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path/'data.csv').write_text('x\n' + ''.join(f'{k}\n' for k in range(10)))
+    (tmp_path/'image.sif').write_text('')  # the local apptainer runs on the host
+    (tmp_path/'single_run.py').write_text('def single_run(id, data, results_dir):\n    return data[0]*2\n')
+    return tmp_path
+
+def _config(**kwargs):
+    return dict(dict(
+        input_data_file='data.csv',
+        results_dir='results',
+        single_run_module_parent_dir='.',
+        single_run_module='single_run',
+        single_run_function='single_run',
+        container_image='image.sif',
+        mpi='pmi2',
+        generate_new_ids=True,
+        main_slurm_args={'array': '1-5', 'ntasks': None, 'time': '00:10:00'},
+        merge_slurm_args={'time': '00:10:00'}
+    ), **kwargs)
+
+def test_throttled_chunks_run_one_after_the_other(workdir):
+    with use_local_backend(max_slots=8) as backend:
+        job = EmbarrassinglyParallelJobs(_config(max_array_size=3, target_concurrency=2))
+        assert job.array_chunks == [('1-2%2', 0), ('1-2%2', 2), ('1-1%2', 4)]
+        job.submit()
+        backend.wait()
+        chunks = [backend.jobs[job_id] for job_id in job.main_job_ids]
+        assert all(chunk.state == 'COMPLETED' for chunk in chunks)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            assert ('afterany', [previous.job_id]) in chunk.dependencies
+            assert min(t.start_time for t in chunk.tasks) >= max(t.end_time for t in previous.tasks)
+    with open(os.path.join('results', 'merged_results.txt')) as f:
+        assert [int(line.split(',')[1]) for line in f] == [2*k for k in range(10)]
+
+def test_tree_merge(workdir):
+    (workdir/'data.csv').write_text('x\n' + ''.join(f'{k}\n' for k in range(18)))
+    with use_local_backend(max_slots=8) as backend:
+        job = EmbarrassinglyParallelJobs(_config(merge_fan_in=2, main_slurm_args={'array': '1-9', 'ntasks': None, 'time': '00:10:00'}))
+        job.submit()
+        backend.wait()
+        assert all(j.state == 'COMPLETED' for j in backend.jobs.values())
+        # 9 results files -> 5 -> 3 -> 2 partial results files -> the merged results
+        levels = [job.merge_job_ids[:5], job.merge_job_ids[5:8], job.merge_job_ids[8:10], job.merge_job_ids[10:]]
+        assert [len(level) for level in levels] == [5, 3, 2, 1]
+        for previous, level in zip(levels, levels[1:]):
+            for job_id in level:
+                assert backend.jobs[job_id].dependencies == [('afterany', previous)]
+    with open(os.path.join('results', 'merged_results.txt')) as f:
+        assert [int(line.split(',')[1]) for line in f] == [2*k for k in range(18)]
+    # Every partial results file was read by a merge job of the next level
+    loaded = set()
+    for filename in os.listdir(job.stdout_dir):
+        with open(os.path.join(job.stdout_dir, filename)) as f:
+            loaded.update(re.findall(r'^Loaded .*/(partial_\d+_\d+)\.pkl$', f.read(), re.MULTILINE))
+    assert loaded == {f'partial_{l}_{k}' for l, n in ((1, 5), (2, 3), (3, 2)) for k in range(n)}
@@ -0,0 +1,64 @@
+import pytest
+from slurm_assist import SingleJob, JobGraph, SerialJobs, use_local_backend
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path/'image.sif').write_text('')
+    (tmp_path/'record.py').write_text(
+        'import sys\n'
+        'with open("order.txt", "a") as f:\n'
+        '    f.write(sys.argv[1].partition("=")[2] + "\\n")\n'
+    )
+    return tmp_path
+
+def _job(name):
+    return SingleJob(dict(
+        slurm_args={'job-name': name, 'time': '00:10:00'},
+        program='record.py',
+        program_args={'name': name},
+        container_image='image.sif'
+    ))
+
+def _graph():
+    return JobGraph(
+        nodes={'prep': _job('prep'), 'a': _job('a'), 'b': _job('b'), 'report': _job('report')},
+        edges=[('prep', 'a'), ('prep', 'b'), ('a', 'report', 'afterany'), ('b', 'report', 'afterany')]
+    )
+
+def _order(workdir):
+    return (workdir/'order.txt').read_text().split()
+
+def test_graph_in_serial_jobs(workdir):
+    with use_local_backend(max_slots=4) as backend:
+        first, graph, last = _job('first'), _graph(), _job('last')
+        serial = SerialJobs([first, graph, last], dependency_gen_fns=lambda ids: ([list(ids)], ['afterok']))
+        serial.submit()
+        backend.wait()
+        assert all(job.state == 'COMPLETED' for job in backend.jobs.values())
+        job_ids = tuple(graph.job_ids[name][0] for name in ('prep', 'a', 'b', 'report'))
+        assert serial.job_groups[1] is graph
+        assert backend.jobs[graph.job_ids['prep'][0]].dependencies == [('afterok', [first.job_id])]
+        assert backend.jobs[last.job_id].dependencies == [('afterok', list(job_ids))]
+        assert sorted(serial.all_job_ids) == sorted((first.job_id, *job_ids, last.job_id))
+    order = _order(workdir)
+    assert order[0] == 'first' and order[-2:] == ['report', 'last']
+    assert sorted(order) == ['a', 'b', 'first', 'last', 'prep', 'report']
+
+def test_graph_in_graph(workdir):
+    with use_local_backend(max_slots=4) as backend:
+        inner = _graph()
+        outer = JobGraph(
+            nodes={'start': _job('start'), 'inner': inner, 'end': _job('end')},
+            edges=[('start', 'inner'), ('inner', 'end', 'afterany')]
+        )
+        job_ids = outer.submit(verbose=False)
+        backend.wait()
+        assert all(job.state == 'COMPLETED' for job in backend.jobs.values())
+        inner_ids = [inner.job_ids[name][0] for name in ('prep', 'a', 'b', 'report')]
+        assert outer.job_ids['inner'] == tuple(inner_ids)
+        assert job_ids == (outer.job_ids['start'][0], *inner_ids, outer.job_ids['end'][0])
+        assert backend.jobs[inner.job_ids['prep'][0]].dependencies == [('afterok', list(outer.job_ids['start']))]
+        assert backend.jobs[outer.job_ids['end'][0]].dependencies == [('afterany', inner_ids)]
+    order = _order(workdir)
+    assert (order[0], order[1], order[-2], order[-1]) == ('start', 'prep', 'report', 'end')
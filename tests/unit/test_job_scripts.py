@@ -0,0 +1,71 @@
+import os
+import time
+from slurm_assist import SingleJob, use_local_backend
+from slurm_assist import utils
+from slurm_assist.utils import write_job_script, prune_job_scripts
+
+template = '#!/bin/bash\necho {{ greeting }} "$@"\n'
+
+def _scripts(dir):
+    return sorted(f for f in os.listdir(dir) if f.startswith('submit_'))
+
+def _index(dir):
+    return (dir/'index.txt').read_text().splitlines()
+
+def test_same_render_reuses_the_script(tmp_path, monkeypatch):
+    path = write_job_script(template, str(tmp_path), greeting='hello')
+    assert os.path.basename(path).startswith('submit_') and path.endswith('.sh')
+    assert write_job_script(template, str(tmp_path), greeting='hello') == path
+    # Another process only has the index
+    monkeypatch.setattr(utils, '_job_script_index', {})
+    monkeypatch.setattr(utils, '_compiled_templates', {})
+    assert write_job_script(template, str(tmp_path), greeting='hello') == path
+    assert utils._compiled_templates == {}  # nothing was rendered
+    assert _scripts(tmp_path) == [os.path.basename(path)]
+    assert len(_index(tmp_path)) == 1
+
+def test_different_render_makes_a_new_script(tmp_path):
+    hello = write_job_script(template, str(tmp_path), greeting='hello')
+    bye = write_job_script(template, str(tmp_path), greeting='bye')
+    assert hello != bye
+    assert _scripts(tmp_path) == sorted(os.path.basename(p) for p in (hello, bye))
+    # Different render arguments that give the same script share it
+    same = write_job_script('#!/bin/bash\necho {{ greeting }}{{ suffix }} "$@"\n', str(tmp_path), greeting='hello', suffix='')
+    assert same == hello
+    assert len(_index(tmp_path)) == 3
+
+def test_prune_job_scripts(tmp_path):
+    old = write_job_script(template, str(tmp_path), greeting='old')
+    new = write_job_script(template, str(tmp_path), greeting='new')
+    os.utime(old, (time.time() - 2*utils.job_script_max_age,)*2)
+    assert prune_job_scripts(str(tmp_path)) == 1
+    assert _scripts(tmp_path) == [os.path.basename(new)]
+    assert [line.split()[1] for line in _index(tmp_path)] == [os.path.basename(new)]
+    # Rendered again when needed
+    assert write_job_script(template, str(tmp_path), greeting='old') == old
+    assert os.path.exists(old)
+
+def test_job_values_are_script_arguments(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path/'image.sif').write_text('')
+    (tmp_path/'record.py').write_text(
+        'import sys\n'
+        'with open("args.txt", "a") as f:\n'
+        '    f.write(" ".join(sys.argv[1:]) + "\\n")\n'
+    )
+    with use_local_backend(max_slots=1) as backend:
+        jobs = [
+            SingleJob(dict(
+                slurm_args={'time': '00:10:00'},
+                program='record.py',
+                program_args={'name': name, 'size': size},
+                container_image='image.sif'
+            ))
+            for name, size in (('a', 1), ('b', 2))
+        ]
+        for job in jobs:
+            job.submit(verbose=False)
+        backend.wait()
+        assert len(set(backend.jobs[job.job_id].job_script_filename for job in jobs)) == 1
+    assert _scripts(tmp_path/'.slurm_assist'/'job_scripts') == [os.path.basename(backend.jobs[jobs[0].job_id].job_script_filename)]
+    assert (tmp_path/'args.txt').read_text().splitlines() == ['--name=a --size=1', '--name=b --size=2']
@@ -0,0 +1,15 @@
+import pytest
+from slurm_assist.local_backend import LocalBackend
+
+def test_shutdown_stops_the_scheduler(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    script = tmp_path/'job.sh'
+    script.write_text('#!/bin/bash\necho $SLURM_ARRAY_TASK_ID\n')
+    backend = LocalBackend(max_slots=2)
+    job_id = backend.sbatch(['sbatch', '--array=1-3', str(script)])
+    assert backend.wait([job_id], timeout=30) == {job_id: 'COMPLETED'}
+    scheduler = backend._scheduler
+    backend.shutdown()
+    assert not scheduler.is_alive()
+    with pytest.raises(RuntimeError):
+        backend.sbatch(['sbatch', str(script)])
@@ -0,0 +1,91 @@
+import os
+import sys
+import subprocess
+import pytest
+from slurm_assist import utils
+
+pytest.importorskip('pyarrow')
+
+MERGE_SCRIPT = os.path.join(os.path.dirname(utils.__file__), 'embarrassingly_parallel', 'merge.py')
+
+# The first batch fixes neither the type of 'value' nor of 'c1': ints are followed by floats,
+# and None by numbers
+BATCHES = {
+    'scalar': [[(0, 1), (1, 2)], [(2, 1.5)], [(3, None)]],
+    'list': [[(0, [1, None]), (1, [2, None])], [(2, [3, 0.5]), (3, [4, 5, 6])]],
+}
+
+def _merge(tmp_path, batches, merge_mode, merged_format, **kwargs):
+    batched_results_dir = tmp_path/'results'
+    batched_results_dir.mkdir()
+    for i, rows in enumerate(batches):
+        utils.save_batch(rows, str(batched_results_dir/f'results_{i + 1}.pkl'))
+    merged_results_file = tmp_path/f'merged.{merged_format}'
+    args = dict(
+        utils_parent_dir=os.path.dirname(utils.__file__),
+        batched_results_dir=batched_results_dir,
+        merged_results_file=merged_results_file,
+        tmp_dir=tmp_path/'tmp',
+        job_array=f'1-{len(batches)}',
+        merge_mode=merge_mode,
+        merged_format=merged_format,
+        **kwargs
+    )
+    subprocess.run(
+        [sys.executable, MERGE_SCRIPT, *[a for k, v in args.items() for a in (f"--{k.replace('_', '-')}", str(v))]],
+        check=True, capture_output=True
+    )
+    return merged_results_file
+
+@pytest.mark.parametrize('merge_mode', ['memory', 'stream'])
+@pytest.mark.parametrize('merged_format', ['parquet', 'arrow'])
+@pytest.mark.parametrize('row_type', ['scalar', 'list'])
+def test_merge_mixed_dtypes(tmp_path, merge_mode, merged_format, row_type):
+    batches = BATCHES[row_type]
+    merged_results_file = _merge(tmp_path, batches, merge_mode, merged_format)
+    expected = [
+        (id, list(value) + [None]*(3 - len(value)) if row_type == 'list' else value)
+        for rows in batches for id, value in rows
+    ]
+    assert utils.load_batch(str(merged_results_file), merged_format) == expected
+
+def test_merge_partial_mixed_dtypes(tmp_path):
+    batches = BATCHES['scalar']
+    batched_results_dir = tmp_path/'results'
+    batched_results_dir.mkdir()
+    for i, rows in enumerate(batches):
+        utils.save_batch(rows, str(batched_results_dir/f'results_{i + 1}.parquet'), 'parquet')
+    partial_results_file = tmp_path/'partial_1_0.parquet'
+    subprocess.run([
+        sys.executable, MERGE_SCRIPT,
+        '--utils-parent-dir', os.path.dirname(utils.__file__),
+        '--batched-results-dir', str(batched_results_dir),
+        '--job-array', f'1-{len(batches)}',
+        '--batch-format', 'parquet',
+        '--partial-results-file', str(partial_results_file),
+    ], check=True, capture_output=True)
+    assert utils.load_batch(str(partial_results_file), 'parquet') == [(0, 1.0), (1, 2.0), (2, 1.5), (3, None)]
+
+def test_table_writer_incompatible_types(tmp_path):
+    writer = utils.open_table_writer(str(tmp_path/'merged.parquet'), 'parquet')
+    writer.write([(0, 1)])
+    with pytest.raises(ValueError, match="Column 'value'"):
+        writer.write([(1, 'a')])
+
+@pytest.mark.parametrize('batches', [
+    [[(0, 1), (1, 2)], [(2, None), (3, 3)]],  # ints with a missing value in one batch only
+    [[(0, 1.5), (1, None)], [(2, float('nan')), (3, 2.5)]],
+    [[(0, [1, 2.5]), (1, [None, 'a,b'])], [(2, [3, 4.5])]],
+])
+def test_merge_csv_same_in_both_modes(tmp_path, batches):
+    merged = {}
+    for merge_mode in ('memory', 'stream'):
+        (tmp_path/merge_mode).mkdir()
+        merged[merge_mode] = _merge(tmp_path/merge_mode, batches, merge_mode, 'csv').read_text()
+    assert merged['memory'] == merged['stream']
+
+def test_merge_csv_ints_with_missing_values(tmp_path):
+    batches = [[(0, 1), (1, 2)], [(2, None), (3, 3)], [(4, 0.5)]]
+    for merge_mode in ('memory', 'stream'):
+        (tmp_path/merge_mode).mkdir()
+        assert _merge(tmp_path/merge_mode, batches, merge_mode, 'csv').read_text() == '0,1\n1,2\n2,\n3,3\n4,0.5\n'
@@ -0,0 +1,41 @@
+import pytest
+from slurm_assist.monitoring import load_resource_logs, right_size
+
+@pytest.fixture
+def log_dir(tmp_path):
+    # Samples every minute, with a hostname
+    (tmp_path/'cpu-percent-run-100_1.log').write_text('1700000000 node01 100.0\n1700000060 node01 200.0\n1700000120 node01 300.0\n')
+    (tmp_path/'cpu-memory-run-100_1.log').write_text('1700000000 node01 1.0\n1700000060 node01 2.0\n1700000180 node01 1.5\n')
+    # Dates and times, with a header
+    (tmp_path/'cpu-percent-run-100_2.log').write_text('time host value\n2024-01-01 00:00:00 node02 50\n2024-01-01 00:10:00 node02 50\n')
+    # A step of PackedJobs (no array task id)
+    (tmp_path/'cpu-percent-run-101_.log').write_text('1700000000 100\n1700000030 100\n')
+    # Not resource monitoring logs
+    (tmp_path/'notes.log').write_text('1700000000 1\n')
+    (tmp_path/'cpu-percent-run-abc.log').write_text('1700000000 1\n')
+    return tmp_path
+
+def test_load_resource_logs(log_dir):
+    summary, timeseries = load_resource_logs(str(log_dir), resolution=120)
+    assert list(summary.index) == [(100, 1), (100, 2), (101, -1)]
+    assert list(summary['duration']) == [180, 600, 30]
+    assert summary.loc[(100, 1), 'cpu_percent_peak'] == 3.0
+    assert summary.loc[(100, 1), 'cpu_percent_mean'] == 2.0
+    assert summary.loc[(100, 1), 'cpu_memory_peak'] == 2.0
+    assert summary.loc[(101, -1), 'cpu_percent_mean'] == 1.0
+    series = timeseries[(timeseries['job_id'] == 100) & (timeseries['array_task_id'] == 1) & (timeseries['metric'] == 'cpu_percent')]
+    assert list(series['t']) == [0, 120]
+    assert list(series['value']) == [1.5, 3.0]
+
+def test_memory_units(log_dir):
+    with pytest.raises(ValueError):
+        load_resource_logs(str(log_dir), memory_units='percent')
+    summary, _ = load_resource_logs(str(log_dir), memory_units='percent', node_memory=10)
+    assert summary.loc[(100, 1), 'cpu_memory_peak'] == pytest.approx(0.2)
+
+def test_right_size(log_dir):
+    summary, _ = load_resource_logs(str(log_dir))
+    recommended = right_size(summary, current_slurm_args={'mem': '8G', 'time': '01:00:00'})
+    assert recommended == {'mem': '3G', 'cpus-per-task': 3, 'time': '00:15:00'}
+    with pytest.raises(ValueError):
+        right_size(summary.iloc[:0])
@@ -0,0 +1,33 @@
+import json
+import pytest
+from slurm_assist import PackedJobs
+from slurm_assist.packed import launcher
+from slurm_assist.utils import parse_slurm_time
+
+def _packed(slurm_args, **config):
+    jobs = [dict(program_args=dict(k=k), slurm_args=args) for k, args in enumerate(slurm_args)]
+    return PackedJobs(jobs, dict(program='program.py', container_image='image.sif', **config))
+
+def test_allocation_memory_and_time():
+    job = _packed([{'time': '00:10:00', 'ntasks': 4, 'mem': '8G'}] + [{'time': '00:10:00', 'mem-per-cpu': '1G'}]*4, max_cpus=4)
+    slurm_args = job.slurm_args
+    # At most the 4-cpu job (8G) or the four 1-cpu jobs (4G) run at once
+    assert slurm_args['mem'] == f'{8*1024}M'
+    # 80 cpu-minutes on 4 cpus, while a 4-cpu job may wait on 1 free cpu, plus the longest job
+    assert parse_slurm_time(slurm_args['time']) == 80*60//(4 - 4 + 1) + 10*60
+
+def test_memory_of_all_jobs_or_none():
+    with pytest.raises(ValueError, match='memory'):
+        _packed([{'mem': '1G'}, {}])
+
+def test_launcher_packs_on_memory(tmp_path):
+    script = tmp_path/'job.sh'
+    script.write_text('sleep 0.2\n')
+    jobs = [dict(index=k, job_script=str(script), script_args=[], slots=1, mem=600, time=60) for k in range(3)]
+    manifest_file = tmp_path/'manifest.json'
+    manifest_file.write_text(json.dumps(dict(stdout_dir=str(tmp_path), jobs=jobs)))
+    assert launcher.main(str(manifest_file), str(tmp_path), num_slots=4, use_srun=False, total_mem=1000) == 0
+    lines = (tmp_path/'packed-local.exit_codes').read_text().splitlines()
+    intervals = sorted(tuple(map(float, line.split()[2:])) for line in lines)
+    # Only one job fits in the memory at a time
+    assert all(end <= next_start + 1e-3 for (_, end), (next_start, _) in zip(intervals, intervals[1:]))
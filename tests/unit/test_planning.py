@@ -0,0 +1,64 @@
+import pytest
+from slurm_assist import EmbarrassinglyParallelJobs, SingleJob, JobGraph, use_local_backend
+from slurm_assist.planning import simulate, uniform
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path/'data.csv').write_text('x\n' + ''.join(f'{k}\n' for k in range(6)))
+    (tmp_path/'image.sif').write_text('')
+    (tmp_path/'single_run.py').write_text('def single_run(id, data, results_dir):\n    return data[0]\n')
+    return tmp_path
+
+def _parallel_job(**kwargs):
+    return EmbarrassinglyParallelJobs(dict(
+        input_data_file='data.csv',
+        results_dir='results',
+        single_run_module_parent_dir='.',
+        single_run_module='single_run',
+        single_run_function='single_run',
+        container_image='image.sif',
+        mpi='pmi2',
+        generate_new_ids=True,
+        main_slurm_args={'array': '1-6', 'ntasks': None, 'time': '00:10:00'},
+        merge_slurm_args={'time': '00:10:00'},
+        **kwargs
+    ))
+
+def test_chained_chunks_run_one_after_the_other(workdir):
+    runtimes = {'split': 0, 'run': 10, 'merge': 0}
+    with use_local_backend():
+        # Two chunks of 3 tasks, 2 at a time: 20s each, one after the other
+        job = _parallel_job(max_array_size=4, target_concurrency=2)
+        assert [chunk for chunk, _ in job.array_chunks] == ['1-3%2', '1-3%2']
+        assert simulate(job, runtimes, num_runs=6, num_trials=1).mean == 40
+        # One array of 6 tasks, 2 at a time
+        job = _parallel_job(target_concurrency=2)
+        assert simulate(job, runtimes, num_runs=6, num_trials=1).mean == 30
+
+def _single_job(name, time='00:10:00'):
+    return SingleJob(dict(
+        slurm_args={'job-name': name, 'time': time, 'cpus-per-task': 2},
+        program='run.py',
+        program_args={},
+        container_image='image.sif'
+    ))
+
+def test_single_job():
+    plan = simulate(_single_job('a'), {'a': 120}, queue_wait=30, num_trials=10)
+    assert plan.makespans == [150]*10
+    assert plan.cpu_hours == [pytest.approx(120*2/3600)]*10
+    assert len(plan.timeouts) == 0
+    plan = simulate(_single_job('a', time='00:01:00'), {'a': 120}, num_trials=10)
+    assert plan.timeouts == {'single': 10}
+
+def test_graph_critical_path():
+    graph = JobGraph(
+        nodes={'prep': _single_job('prep'), 'a': _single_job('a'), 'b': _single_job('b'), 'report': _single_job('report')},
+        edges=[('prep', 'a'), ('prep', 'b'), ('a', 'report'), ('b', 'report')]
+    )
+    runtimes = {'prep': 10, 'a': 100, 'b': uniform(0, 50), 'report': 10}
+    plan = simulate(graph, runtimes, num_trials=100, seed=0)
+    assert plan.makespans == [120]*100
+    assert plan.critical_paths == {('prep', 'a', 'report'): 100}
+    assert plan.percentile(0.5) == 120
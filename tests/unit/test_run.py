@@ -0,0 +1,134 @@
+import os
+import sys
+import shutil
+import subprocess
+import pytest
+from slurm_assist import utils
+from slurm_assist.utils import ResultJournal, load_journal
+
+RUN_SCRIPT = os.path.join(os.path.dirname(utils.__file__), 'embarrassingly_parallel', 'run.py')
+
+WORK_MODULE = '''import os
+
+def single_run(id, data, results_dir, **kwargs):
+    # One file per run of an item, to count the runs
+    open(os.path.join(results_dir, f'ran_{id}_{os.getpid()}'), 'w').close()
+    return data[0]*10
+
+def batch_run(ids, data_batch, results_dir, fail_on=None, **kwargs):
+    with open(os.path.join(results_dir, 'calls.txt'), 'a') as f:
+        f.write(' '.join(map(str, ids)) + '\\n')
+    if (fail_on is not None) and (int(fail_on) in ids):
+        raise RuntimeError('Killed')
+    return [single_run(id, data, results_dir) for id, data in zip(ids, data_batch)]
+
+def batch_run_stacked(ids, data_batch, results_dir, **kwargs):
+    import numpy as np
+    assert isinstance(data_batch, np.ndarray) and data_batch.shape == (len(ids), 2)
+    with open(os.path.join(results_dir, 'calls.txt'), 'a') as f:
+        f.write(' '.join(map(str, ids)) + '\\n')
+    return (10*data_batch[:, 0] + data_batch[:, 1]).tolist()
+'''
+
+def _run(tmp_path, batches, mpirun_n=None, check=True, **kwargs):
+    """Save the batches as data_<name>.pkl and run run.py on them (under mpirun -n mpirun_n if
+    given). Returns the directories of the batched results and of the split results."""
+    (tmp_path/'work.py').write_text(WORK_MODULE)
+    batched_data_dir, batched_results_dir, split_results_dir = tmp_path/'data', tmp_path/'results', tmp_path/'split_results'
+    for dir in (batched_data_dir, batched_results_dir, split_results_dir):
+        dir.mkdir(exist_ok=True)
+    for name, rows in batches.items():
+        utils.save_batch(rows, str(batched_data_dir/f'data_{name}.pkl'))
+    args = dict(dict(
+        array_id=1,
+        utils_parent_dir=os.path.dirname(utils.__file__),
+        single_run_module_parent_dir=tmp_path,
+        single_run_module='work',
+        single_run_fn='single_run',
+        batched_data_dir=batched_data_dir,
+        batched_results_dir=batched_results_dir,
+        split_results_dir=split_results_dir,
+        job_array='1',
+        ntasks_per_job='None'
+    ), **kwargs)
+    argv = [sys.executable, RUN_SCRIPT, *[a for k, v in args.items() if v is not None for a in (f"--{k.replace('_', '-')}", str(v))]]
+    if mpirun_n is not None:
+        argv = ['mpirun', '-n', str(mpirun_n), *argv]
+    subprocess.run(argv, check=check, capture_output=True, timeout=120)
+    return batched_results_dir, split_results_dir
+
+def _runs(split_results_dir):
+    """Number of runs of each item."""
+    runs = {}
+    for filename in os.listdir(split_results_dir):
+        if not filename.startswith('ran_'):
+            continue
+        id = int(filename.split('_')[1])
+        runs[id] = runs.get(id, 0) + 1
+    return runs
+
+def test_dynamic_schedule_runs_each_item_once(tmp_path):
+    pytest.importorskip('mpi4py')
+    if shutil.which('mpirun') is None:
+        pytest.skip('mpirun is not installed')
+    # Uneven batches, so rank 1 runs items of rank 0
+    batches = {'1_0': [(k, [k]) for k in range(7)], '1_1': [(k, [k]) for k in range(7, 9)]}
+    batched_results_dir, split_results_dir = _run(tmp_path, batches, mpirun_n=2, ntasks_per_job=2, schedule='dynamic', schedule_chunksize=2)
+    assert _runs(split_results_dir) == {k: 1 for k in range(9)}
+    for name, rows in batches.items():
+        assert utils.load_batch(str(batched_results_dir/f'results_{name}.pkl')) == [(id, data[0]*10) for id, data in rows]
+
+def test_resume_from_journal(tmp_path):
+    batch = [(k, [k]) for k in range(5)]
+    (tmp_path/'results').mkdir()
+    journal_file = tmp_path/'results'/'journal_1.pkl'
+    journal = ResultJournal(str(journal_file))
+    journal.append(0, 'from journal')
+    journal.append(1, 'from journal')
+    journal.close()
+    with open(journal_file, 'ab') as f:
+        f.write(b'\x00\x00\x00\x00\x00\x00\x01\x00trunc')  # a record cut off by the end of the job
+    batched_results_dir, split_results_dir = _run(tmp_path, {'1': batch}, checkpoint_every=1)
+    assert _runs(split_results_dir) == {2: 1, 3: 1, 4: 1}
+    assert utils.load_batch(str(batched_results_dir/'results_1.pkl')) == [(0, 'from journal'), (1, 'from journal'), (2, 20), (3, 30), (4, 40)]
+    records, size = load_journal(str(journal_file))
+    assert records == [(0, 'from journal'), (1, 'from journal'), (2, 20), (3, 30), (4, 40)]
+    assert size == os.path.getsize(journal_file)
+
+def test_batch_run_fn_results_are_journaled_per_chunk(tmp_path):
+    batch = [(k, [k]) for k in range(5)]
+    kwargs = dict(single_run_fn=None, batch_run_fn='batch_run', checkpoint_every=2)
+    # The second call fails, after the first one's results were journaled
+    _, split_results_dir = _run(tmp_path, {'1': batch}, check=False, fail_on=3, **kwargs)
+    assert load_journal(str(tmp_path/'results'/'journal_1.pkl'))[0] == [(0, 0), (1, 10)]
+    batched_results_dir, split_results_dir = _run(tmp_path, {'1': batch}, **kwargs)
+    assert (split_results_dir/'calls.txt').read_text().splitlines() == ['0 1', '2 3', '2 3', '4']
+    assert _runs(split_results_dir) == {k: 1 for k in range(5)}
+    assert utils.load_batch(str(batched_results_dir/'results_1.pkl')) == [(k, 10*k) for k in range(5)]
+
+def test_process_executor_same_as_serial(tmp_path):
+    batch = [(k, [k]) for k in range(10)]
+    results = {}
+    for executor in ('serial', 'process'):
+        (tmp_path/executor).mkdir()
+        batched_results_dir, split_results_dir = _run(tmp_path/executor, {'1': batch}, executor=executor, executor_chunksize=3)
+        results[executor] = utils.load_batch(str(batched_results_dir/'results_1.pkl'))
+        assert _runs(split_results_dir) == {k: 1 for k in range(10)}
+    assert results['process'] == results['serial'] == [(k, 10*k) for k in range(10)]
+
+def test_batch_run_fn(tmp_path):
+    batch = [(k, [k]) for k in range(5)]
+    batched_results_dir, split_results_dir = _run(tmp_path, {'1': batch}, single_run_fn=None, batch_run_fn='batch_run')
+    # One call for the whole batch, with the data as a list
+    assert (split_results_dir/'calls.txt').read_text().splitlines() == ['0 1 2 3 4']
+    assert utils.load_batch(str(batched_results_dir/'results_1.pkl')) == [(k, 10*k) for k in range(5)]
+
+def test_batch_run_fn_stacked(tmp_path):
+    batch = [(k, [k, 0.5]) for k in range(5)]
+    batched_results_dir, split_results_dir = _run(
+        tmp_path, {'1': batch}, single_run_fn=None, batch_run_fn='batch_run_stacked', batch_run_stack=True,
+        executor='process', executor_chunksize=2
+    )
+    # One call per chunk of items in the pool, with the data as a NumPy array
+    assert sorted((split_results_dir/'calls.txt').read_text().splitlines()) == ['0 1', '2 3', '4']
+    assert utils.load_batch(str(batched_results_dir/'results_1.pkl')) == [(k, 10*k + 0.5) for k in range(5)]
@@ -0,0 +1,81 @@
+import os
+import sys
+import subprocess
+import pytest
+from slurm_assist import utils
+
+SPLIT_SCRIPT = os.path.join(os.path.dirname(utils.__file__), 'embarrassingly_parallel', 'split.py')
+
+def _split(tmp_path, input_file, split_mode, **kwargs):
+    batched_data_dir = tmp_path/split_mode
+    batched_data_dir.mkdir()
+    args = dict(dict(
+        utils_parent_dir=os.path.dirname(utils.__file__),
+        input_file=input_file,
+        batched_data_dir=batched_data_dir,
+        job_array='1-2',
+        split_mode=split_mode
+    ), **kwargs)
+    subprocess.run(
+        [sys.executable, SPLIT_SCRIPT, '--generate-new-ids', *[a for k, v in args.items() for a in (f"--{k.replace('_', '-')}", str(v))]],
+        check=True, capture_output=True
+    )
+    return batched_data_dir
+
+@pytest.mark.parametrize('content', [
+    'a,b\n1,2\n3,\n5,6\n',  # a missing value in the middle chunk only
+    'a,b\n1,x\n2,3\n4,5\n',  # strings in the first chunk only
+    'a,b\n1,True\n2,1\n',  # bools and ints
+])
+def test_stream_split_same_as_memory(tmp_path, content):
+    input_file = tmp_path/'data.csv'
+    input_file.write_text(content)
+    batches = {}
+    for split_mode, kwargs in (('memory', {}), ('stream', {'chunksize': 1})):
+        batched_data_dir = _split(tmp_path, input_file, split_mode, **kwargs)
+        batches[split_mode] = [utils.load_batch(str(batched_data_dir/f'data_{k}.pkl')) for k in (1, 2)]
+    assert repr(batches['stream']) == repr(batches['memory'])
+
+def test_index_split_same_as_memory(tmp_path, monkeypatch):
+    from slurm_assist.embarrassingly_parallel import run
+    # run.py gets these from utils when it runs as a script
+    monkeypatch.setattr(run, 'assign_ids', utils.assign_ids, raising=False)
+    monkeypatch.setattr(run, 'load_pickle', utils.load_pickle, raising=False)
+    input_file = tmp_path/'data.csv'
+    input_file.write_text('a,b\n1,2\n3,\n5,6\n')
+    memory_dir = _split(tmp_path, input_file, 'memory')
+    index_dir = _split(tmp_path, input_file, 'index', chunksize=1)
+    for k in (1, 2):
+        batch = run._load_data_batch(str(index_dir), str(k), 'index', str(input_file), True)
+        assert repr(batch) == repr(utils.load_batch(str(memory_dir/f'data_{k}.pkl')))
+
+# Costs of the rows: many cheap ones, then a few expensive ones at the end
+COSTS = [1]*16 + [40, 30, 20, 10]
+
+def test_balance_by_cost():
+    assignment = utils.balance_by_cost(COSTS, 4)
+    totals = [sum(c for c, k in zip(COSTS, assignment) if k == b) for b in range(4)]
+    # The largest cost (40) is a lower bound; contiguous batches would have 5, 5, 5 and 101
+    assert sorted(totals) == [23, 23, 30, 40]
+
+def _batch_costs(batched_data_dir, cost_of_row):
+    batches = [utils.load_batch(str(batched_data_dir/f'data_{k}.pkl')) for k in range(1, 5)]
+    ids = [id for batch in batches for id, _ in batch]
+    assert sorted(ids) == list(range(len(COSTS)))
+    assert all([id for id, _ in batch] == sorted(id for id, _ in batch) for batch in batches)
+    return sorted(sum(cost_of_row(id, data) for id, data in batch) for batch in batches)
+
+@pytest.mark.parametrize('split_mode, kwargs', [('memory', {}), ('stream', {'chunksize': 3})])
+def test_split_balanced_by_cost_column(tmp_path, split_mode, kwargs):
+    input_file = tmp_path/'data.csv'
+    input_file.write_text('x,cost\n' + ''.join(f'{k},{c}\n' for k, c in enumerate(COSTS)))
+    batched_data_dir = _split(tmp_path, input_file, split_mode, job_array='1-4', cost_column='cost', **kwargs)
+    # The cost column is removed from the data
+    assert _batch_costs(batched_data_dir, lambda id, data: COSTS[data[0]] if len(data) == 1 else None) == [23, 23, 30, 40]
+
+def test_split_balanced_by_cost_fn(tmp_path):
+    input_file = tmp_path/'data.csv'
+    input_file.write_text('x,cost\n' + ''.join(f'{k},{c}\n' for k, c in enumerate(COSTS)))
+    (tmp_path/'costs.py').write_text('def cost(id, data):\n    return data[1]\n')
+    batched_data_dir = _split(tmp_path, input_file, 'memory', job_array='1-4', cost_module_parent_dir=tmp_path, cost_module='costs', cost_fn='cost')
+    assert _batch_costs(batched_data_dir, lambda id, data: data[1]) == [23, 23, 30, 40]
@@ -0,0 +1,38 @@
+import os
+import stat
+import pytest
+from slurm_assist import status
+
+def _fake_command(bin_dir, name, stdout):
+    path = bin_dir/name
+    path.write_text(f"#!/bin/bash\necho \"$@\" >> {bin_dir}/{name}.calls\ncat <<'END'\n{stdout}\nEND\n")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+
+@pytest.fixture
+def fake_slurm(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    def install(squeue='', sacct=''):
+        _fake_command(tmp_path, 'squeue', squeue)
+        _fake_command(tmp_path, 'sacct', sacct)
+    install.calls = lambda name: (tmp_path/f'{name}.calls').read_text().splitlines() if (tmp_path/f'{name}.calls').exists() else []
+    return install
+
+def test_array_elements_aged_out_of_squeue(fake_slurm):
+    # Element 1 failed a while ago and is only in sacct anymore
+    fake_slurm(squeue='123_2|COMPLETED', sacct='123_1|FAILED\n123_2|COMPLETED')
+    cache = status.JobStatusCache()
+    assert cache.states([123]) == {'123': 'FAILED'}
+    assert cache.element_states(123) == {'123_1': 'FAILED', '123_2': 'COMPLETED'}
+
+def test_running_jobs_are_not_looked_up_in_sacct(fake_slurm):
+    fake_slurm(squeue='123_1|RUNNING\n123_2|COMPLETED\n124|COMPLETED')
+    cache = status.JobStatusCache()
+    assert cache.states([123, 124]) == {'123': 'RUNNING', '124': 'COMPLETED'}
+    assert fake_slurm.calls('sacct') == []
+
+def test_unknown_jobs_become_not_found(fake_slurm):
+    fake_slurm()
+    cache = status.JobStatusCache(max_unknown=3)
+    states = [cache.states([125], max_age=0)['125'] for _ in range(3)]
+    assert states == ['UNKNOWN', 'UNKNOWN', 'NOT_FOUND']
+    assert status.wait([125], min_interval=0, cache=cache) == {'125': 'NOT_FOUND'}
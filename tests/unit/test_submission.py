@@ -0,0 +1,55 @@
+import os
+import stat
+import pytest
+from slurm_assist import submission
+from slurm_assist.submission import sbatch_argv, parse_sbatch_output, run_sbatch, submit_slurm_jobs
+
+@pytest.fixture
+def fake_sbatch(tmp_path, monkeypatch):
+    """Install an sbatch that prints `stdout` and `stderr` and exits with `exit_code`."""
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(submission, '_backend', None)
+    def install(stdout='', stderr='', exit_code=0):
+        path = tmp_path/'sbatch'
+        path.write_text(f"#!/bin/bash\necho \"$@\" >> {tmp_path}/sbatch.calls\necho -n '{stdout}'\necho -n '{stderr}' >&2\nexit {exit_code}\n")
+        path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    install.calls = lambda: (tmp_path/'sbatch.calls').read_text().splitlines()
+    return install
+
+def test_sbatch_argv():
+    argv = sbatch_argv(
+        {'time': '00:10:00', 'array': '1-3%2', 'exclusive': True, 'mem': None, 'requeue': False},
+        'job script.sh',
+        dependency_ids=[[1, 2], [3]],
+        dependency_conditions=['afterok', 'afterany'],
+        script_args=['--name=a b', 2]
+    )
+    assert argv == [
+        'sbatch', '--parsable', '--time=00:10:00', '--array=1-3%2', '--exclusive',
+        '--dependency=afterok:1:2,afterany:3', 'job script.sh', '--name=a b', '2'
+    ]
+    with pytest.raises(RuntimeError):
+        sbatch_argv({}, 'job.sh', dependency_ids=[[1]])
+
+def test_parse_sbatch_output():
+    assert parse_sbatch_output('123\n') == 123
+    assert parse_sbatch_output('123;cluster\n') == 123
+    assert parse_sbatch_output('sbatch: warning: no time limit\n124\n') == 124
+    with pytest.raises(RuntimeError):
+        parse_sbatch_output('\n')
+
+def test_run_sbatch(fake_sbatch):
+    fake_sbatch(stdout='125;cluster\n')
+    assert run_sbatch(['sbatch', '--parsable', 'job.sh'], verbose=False) == 125
+    assert fake_sbatch.calls() == ['--parsable job.sh']
+
+def test_run_sbatch_raises_on_failure(fake_sbatch):
+    fake_sbatch(stderr='sbatch: error: invalid partition', exit_code=1)
+    with pytest.raises(RuntimeError, match='invalid partition'):
+        run_sbatch(['sbatch', '--parsable', 'job.sh'], verbose=False)
+
+def test_submit_slurm_jobs_keeps_the_order(fake_sbatch):
+    fake_sbatch(stdout='126\n')
+    jobs = [dict(slurm_args={'job-name': str(k)}, job_script_filename='job.sh') for k in range(5)]
+    assert submit_slurm_jobs(jobs, max_workers=3) == [126]*5
+    assert sorted(fake_sbatch.calls()) == sorted(f'--parsable --job-name={k} job.sh' for k in range(5))
@@ -0,0 +1,40 @@
+import os
+from slurm_assist.move.sync import sync, relative_path, manifest_name, LocalDirTransport
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def test_second_sync_sends_only_changed_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ('a.txt', 'b.txt', 'sub/c.txt'):
+        _write(os.path.join('data', name), name)
+    transport = LocalDirTransport()
+
+    first = sync(['data'], 'remote', transport, verbose=False)
+    assert sorted(first.sent) == ['data/a.txt', 'data/b.txt', 'data/sub/c.txt']
+    _write('data/sub/c.txt', 'changed')
+    os.utime('data/a.txt')  # touched, but not changed
+    second = sync(['data'], 'remote', transport, verbose=False)
+    assert second.sent == ['data/sub/c.txt']
+    assert sorted(second.unchanged) == ['data/a.txt', 'data/b.txt']
+    with open('remote/data/sub/c.txt') as f:
+        assert f.read() == 'changed'
+
+def test_absolute_paths(tmp_path):
+    _write(str(tmp_path/'data'/'a.txt'), 'a')
+    remote_dir = str(tmp_path/'remote')
+    result = sync([str(tmp_path/'data'/'a.txt')], remote_dir, LocalDirTransport(), verbose=False)
+    assert result.sent == [str(tmp_path/'data'/'a.txt')]
+    assert os.path.exists(os.path.join(remote_dir, relative_path(str(tmp_path/'data'/'a.txt'))))
+
+def test_one_manifest_per_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write('a.txt', 'a')
+    _write('b.txt', 'b')
+    transport = LocalDirTransport()
+    sync(['a.txt'], 'remote', transport, verbose=False)
+    sync(['b.txt'], 'remote', transport, verbose=False)
+    assert [f for f in os.listdir('remote') if f.startswith('.')] == [manifest_name]
+    assert sync(['a.txt', 'b.txt'], 'remote', transport, verbose=False).sent == []
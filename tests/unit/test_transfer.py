@@ -0,0 +1,132 @@
+import os
+import random
+import shutil
+import subprocess
+import pytest
+from slurm_assist import utils, transport
+from slurm_assist.utils import stream_tar, parallel_stream_tar, compress_and_transfer, available_codecs, choose_codec, transfer_codecs
+
+class LocalSession:
+    """Runs the 'remote' commands on this machine."""
+    def __init__(self, channel=0):
+        self.channel = channel
+
+    def run(self, command, check=True, **kwargs):
+        return subprocess.run(['bash', '-c', command], check=check, **kwargs)
+
+    def popen(self, command, **kwargs):
+        return subprocess.Popen(['bash', '-c', command], **kwargs)
+
+    def put(self, local_path, remote_path, check=True):
+        return subprocess.run(['cp', local_path, remote_path], check=check)
+
+    def which(self, *commands):
+        return {c for c in commands if shutil.which(c) is not None}
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+@pytest.fixture
+def streams(monkeypatch):
+    """The paths sent over each stream of parallel_stream_tar, by channel."""
+    sent = {}
+    stream_tar = utils.stream_tar
+    def recording_stream_tar(session, local_paths, remote_dir, **kwargs):
+        sent[session.channel] = sorted(local_paths)
+        return stream_tar(session, local_paths, remote_dir, **kwargs)
+    monkeypatch.setattr(utils, 'stream_tar', recording_stream_tar)
+    monkeypatch.setattr(transport, 'get_session', lambda hostname, username, key_filename, channel=0: LocalSession(channel))
+    return sent
+
+def test_parallel_streams_are_balanced_by_size(tmp_path, monkeypatch, streams):
+    monkeypatch.chdir(tmp_path)
+    for name, size in (('a', 100), ('b', 60), ('c', 50), ('d', 40), ('e', 30)):
+        _write(os.path.join('data', name), b'x'*size)
+    parallel_stream_tar('host', 'me', None, ['data'], 'remote', num_streams=2, codec='none')
+    assert sorted(streams.values()) == [['data/a', 'data/d'], ['data/b', 'data/c', 'data/e']]
+    assert sorted(os.listdir('remote/data')) == ['a', 'b', 'c', 'd', 'e']
+
+def test_more_streams_than_files(tmp_path, monkeypatch, streams):
+    monkeypatch.chdir(tmp_path)
+    _write('a', b'a')
+    _write('b', b'b')
+    parallel_stream_tar('host', 'me', None, ['a', 'b'], 'remote', num_streams=8, codec='none')
+    assert sorted(streams.values()) == [['a'], ['b']]
+
+def test_nothing_to_stream(tmp_path, monkeypatch, streams):
+    monkeypatch.chdir(tmp_path)
+    assert parallel_stream_tar('host', 'me', None, [], 'remote', num_streams=4) == 0
+    assert streams == {}
+
+def test_archive_transfer_quotes_remote_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write('data/a.txt', b'a')
+    remote_dir = str(tmp_path/'remote dir; $(touch oops)')
+    compress_and_transfer('host', 'me', None, ['data'], remote_dir, session=LocalSession())
+    assert os.listdir(remote_dir) == ['data']  # extracted, and the archive removed
+    with open(os.path.join(remote_dir, 'data', 'a.txt')) as f:
+        assert f.read() == 'a'
+    assert not os.path.exists('oops')
+
+def _tree(dir):
+    """{relative path: content} of the files in dir, and None for empty directories."""
+    tree = {}
+    for dir_path, dir_names, file_names in os.walk(dir):
+        if len(dir_names) == 0 and len(file_names) == 0:
+            tree[os.path.relpath(dir_path, dir)] = None
+        for file_name in file_names:
+            with open(os.path.join(dir_path, file_name), 'rb') as f:
+                tree[os.path.relpath(os.path.join(dir_path, file_name), dir)] = f.read()
+    return tree
+
+def test_stream_tar_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write('data/a.txt', b'a'*100000)
+    _write('data/sub dir/b.bin', bytes(range(256))*100)
+    os.makedirs('data/empty')
+    progress = []
+    num_bytes = stream_tar(LocalSession(), ['data'], 'remote dir', chunk_size=4096, progress=progress.append)
+    assert _tree('remote dir/data') == _tree('data')
+    assert sum(progress) == num_bytes
+    assert num_bytes < 100000  # compressed
+    # Nothing is left behind on either side
+    assert sorted(os.listdir('.')) == ['data', 'remote dir']
+    assert os.listdir('remote dir') == ['data']
+
+def test_stream_tar_fails_if_the_remote_tar_fails(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write('data/a.txt', b'a')
+    _write('remote', b'not a directory')
+    with pytest.raises(subprocess.CalledProcessError):
+        stream_tar(LocalSession(), ['data'], 'remote')
+
+@pytest.mark.parametrize('codec', list(transfer_codecs))
+def test_codec_round_trip(tmp_path, monkeypatch, codec):
+    if codec not in available_codecs():
+        pytest.skip(f'{codec} is not installed')
+    monkeypatch.chdir(tmp_path)
+    _write('data/a.csv', b''.join(b'%d,%d\n' % (k, k % 7) for k in range(10000)))
+    stream_tar(LocalSession(), ['data'], 'remote', codec=codec)
+    assert _tree('remote/data') == _tree('data')
+
+class RemoteWithout(LocalSession):
+    """A remote on which some commands are missing."""
+    def __init__(self, *missing):
+        super().__init__()
+        self.missing = missing
+
+    def which(self, *commands):
+        return super().which(*commands) - set(self.missing)
+
+def test_choose_codec(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(0)
+    _write('random/a.bin', rng.getrandbits(8*2**20).to_bytes(2**20, 'little'))
+    _write('text/a.csv', b''.join(b'%d,%.3f,sample_%d\n' % (k, rng.random(), k % 97) for k in range(50000)))
+    assert choose_codec(['random'], LocalSession()) == 'none'
+    codecs = available_codecs(LocalSession())
+    assert choose_codec(['text'], LocalSession()) == next(c for c in ('zstd', 'lz4', 'gzip') if c in codecs)
+    # Only codecs that exist on both ends are used
+    assert choose_codec(['text'], RemoteWithout('zstd', 'lz4')) == 'gzip'
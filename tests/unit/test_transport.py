@@ -0,0 +1,51 @@
+import os
+import pytest
+from slurm_assist.transport import SSHSession
+
+# Stand-in for ssh: logs its options and runs the remote command locally
+FAKE_SSH = """#!/bin/bash
+echo "$@" >> {log}
+CP=""; OP=""; MASTER=no; args=()
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -o) case "$2" in ControlPath=*) CP=${{2#ControlPath=}};; ControlMaster=yes) MASTER=yes;; esac; shift 2;;
+    -O) OP=$2; shift 2;;
+    -i) shift 2;;
+    -N|-f) shift;;
+    *) args+=("$1"); shift;;
+  esac
+done
+if [ "$OP" = check ]; then [ -e "$CP" ]; exit $?; fi
+if [ "$OP" = exit ]; then rm -f "$CP"; exit 0; fi
+if [ "$MASTER" = yes ]; then touch "$CP"; exit 0; fi
+bash -c "${{args[1]}}"
+"""
+
+@pytest.fixture
+def ssh_log(tmp_path, monkeypatch):
+    bin_dir = tmp_path/'bin'
+    bin_dir.mkdir()
+    log = tmp_path/'ssh.log'
+    (bin_dir/'ssh').write_text(FAKE_SSH.format(log=log))
+    (bin_dir/'ssh').chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return lambda: log.read_text().splitlines() if log.exists() else []
+
+def test_master_is_checked_once(tmp_path, ssh_log):
+    session = SSHSession('host', 'me', control_dir=str(tmp_path/'control'))
+    for _ in range(5):
+        assert session.run('echo hi', capture_output=True, text=True).stdout == 'hi\n'
+    lines = ssh_log()
+    assert sum('-O check' in line for line in lines) == 1
+    assert sum('ControlMaster=yes' in line for line in lines) == 1
+    assert session.stats() == dict(handshakes=1, commands=5, reused=4)
+    assert not any('BatchMode' in line for line in lines)
+
+def test_master_is_checked_after_a_connection_error(tmp_path, ssh_log):
+    session = SSHSession('host', 'me', control_dir=str(tmp_path/'control'), batch_mode=True)
+    session.run('true')
+    assert session.run('exit 255', check=False).returncode == 255
+    session.run('true')
+    lines = ssh_log()
+    assert sum('-O check' in line for line in lines) == 2
+    assert all('BatchMode=yes' in line for line in lines)
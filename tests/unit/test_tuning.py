@@ -0,0 +1,29 @@
+import pytest
+from slurm_assist.tuning import tune, evaluate, SiteLimits
+from slurm_assist.planning import lognormal
+from slurm_assist.utils import parse_slurm_time
+
+def test_single_rank_tasks_do_not_select_mpi():
+    result = tune(num_runs=100, single_run_time=60, limits=SiteLimits(max_array_size=1001, cores_per_node=1))
+    assert result.ntasks == 1
+    assert result.main_slurm_args == {'array': '1-100', 'ntasks': None, 'time': '00:02:00'}
+
+def test_time_and_core_hours_objectives():
+    limits = SiteLimits(max_array_size=101, max_walltime='04:00:00', cores_per_node=16, core_hour_cost=2.0)
+    fastest = tune(1000, lognormal(median=60, sigma=0.5), limits, objective='time', seed=0)
+    cheapest = tune(1000, lognormal(median=60, sigma=0.5), limits, objective='core_hours', seed=0)
+    assert fastest.expected_time <= cheapest.expected_time
+    assert cheapest.core_hours <= fastest.core_hours
+    assert cheapest.cost == pytest.approx(2.0*cheapest.core_hours)
+    for result in (fastest, cheapest):
+        assert int(result.main_slurm_args['array'].split('-')[1]) < limits.max_array_size
+        assert parse_slurm_time(result.main_slurm_args['time']) <= parse_slurm_time(limits.max_walltime)
+
+def test_limits():
+    limits = SiteLimits(max_array_size=11, max_walltime='01:00:00', cores_per_node=4)
+    assert evaluate(11, 1, 100, 60, 0, limits) is None  # array too large
+    assert evaluate(1, 4, 1000, 60, 0, limits) is None  # longer than the walltime
+    with pytest.raises(ValueError):
+        tune(10000, 60, limits)
+    with pytest.raises(ValueError):
+        tune(100, 60, limits, objective='cost')